@@ -1,10 +1,18 @@
+import json
+
 import requests
 
-from . import settings
+from omniclient import ConfigurationError
+
+from . import settings, wire
 
 
 class OmnispectiveClient(object):
 
+    # Whether the server has rejected the frames format, (in which case
+    # batches are posted as JSON):
+    frames_unsupported = False
+
     @staticmethod
     def get_url(resource):
         if settings.HOST_IS_SECURE:
@@ -18,11 +26,11 @@ class OmnispectiveClient(object):
         )
 
     @staticmethod
-    def get_headers():
+    def get_headers(content_type='application/json'):
         auth = 'ApiKey {0}:{1}'.format(settings.USERNAME, settings.API_KEY)
         return {
             'authorization': auth,
-            'content-type': 'application/json',
+            'content-type': content_type,
         }
 
     @classmethod
@@ -36,3 +44,32 @@ class OmnispectiveClient(object):
     @classmethod
     def post_response(cls, data):
         raise NotImplementedError
+
+    @classmethod
+    def post_batch(cls, items, session=requests):
+        """Post the given batch items, (see ``OmnispectiveMiddleware.capture``),
+        in a single batch, (via the given ``requests`` session, if any), in
+        the WIRE_FORMAT.
+
+        Should the server not support the frames format, the batch, (and
+        those following), is posted as JSON.
+
+        """
+        if settings.WIRE_FORMAT not in wire.FORMATS:
+            raise ConfigurationError(
+                "Invalid wire format: {0}".format(settings.WIRE_FORMAT))
+        if settings.WIRE_FORMAT == 'frames' and not cls.frames_unsupported:
+            response = session.post(
+                cls.get_url('clientrequest/batch'),
+                headers=cls.get_headers(wire.CONTENT_TYPE),
+                data=wire.encode(items),
+            )
+            if response.status_code != 415:
+                return response
+            OmnispectiveClient.frames_unsupported = True
+        return session.post(
+            cls.get_url('clientrequest/batch'),
+            headers=cls.get_headers(),
+            data=json.dumps({'objects': [wire.text(item) for item in items]},
+                            separators=(',', ':')),
+        )
@@ -1,8 +1,18 @@
+import atexit
+import logging
+import threading
+
+import requests
+
 from omniclient import ConfigurationError
 
+from . import settings, shipper
 from .base import OmnispectiveClient
 
 
+logger = logging.getLogger(__name__)
+
+
 class NoCeleryTask(object):
 
     def __call__(self, _task):
@@ -25,3 +35,50 @@ def post_request(data):
 @task()
 def post_response(data):
     OmnispectiveClient.post_response(data)
+
+
+# The keep-alive session of the worker process, (shared by its batches):
+_session = requests.Session()
+
+@task()
+def post_batch(items):
+    response = OmnispectiveClient.post_batch(items, session=_session)
+    response.raise_for_status()
+
+
+class TaskBatcher(shipper.Shipper):
+    """Buffers captures in this process, and enqueues them in batches, (of
+    up to ``batch_size`` items, or ``interval`` seconds in age), each as a
+    single ``post_batch`` task.
+
+    """
+    def send(self, batch):
+        try:
+            post_batch.delay(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to enqueue %d request(s)", len(batch))
+        else:
+            self.sent += len(batch)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Return the TaskBatcher of this process, (configured by settings)."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                batcher = TaskBatcher(
+                    settings.SHIPPER_QUEUE_SIZE,
+                    settings.CELERY_BATCH_SIZE,
+                    settings.CELERY_BATCH_AGE,
+                    settings.SHIPPER_FULL_POLICY,
+                    settings.SHIPPER_BLOCK_TIMEOUT,
+                )
+                atexit.register(batcher.flush, settings.SHIPPER_EXIT_TIMEOUT)
+                _batcher = batcher
+    return _batcher
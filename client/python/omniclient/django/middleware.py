@@ -1,6 +1,11 @@
+import datetime
+import httplib
 import json
 
-from . import base, celery, settings
+import django.conf
+from django.utils.encoding import iri_to_uri
+
+from . import base, celery, sampling, settings, shipper, spool, wire
 
 
 class OmnispectiveMiddleware(base.OmnispectiveClient):
@@ -11,21 +16,160 @@ class OmnispectiveMiddleware(base.OmnispectiveClient):
         task.delay(data)
 
     @staticmethod
-    def parse_request(request):
-        return json.dumps({
-        })
+    def parse_request(request, weight=1.0):
+        data = {
+        }
+        if weight != 1.0:
+            # (The number of requests which the sampled capture represents.)
+            data['weight'] = weight
+        return json.dumps(data)
 
     @staticmethod
     def parse_response(response):
         return json.dumps({
         })
 
+    @staticmethod
+    def request_body(request):
+        try:
+            return request.body
+        except Exception:
+            # The body is unavailable once the request's stream has been
+            # read directly, (as by the parsing of multipart forms):
+            return ''
+
+    @staticmethod
+    def session_key(request):
+        """Return the key of the session of the given request: that of its
+        Django session, if any, or else its remote address.
+
+        """
+        key = getattr(getattr(request, 'session', None), 'session_key', None)
+        if not key:
+            key = request.COOKIES.get(django.conf.settings.SESSION_COOKIE_NAME)
+        return key or request.META.get('REMOTE_ADDR', '')
+
+    @staticmethod
+    def response_chunks(response):
+        """Return the chunks of the content of the given response, or None
+        if its content is streamed, (and so cannot be read without being
+        consumed).
+
+        """
+        if (getattr(response, 'streaming', False) or
+                getattr(response, '_base_content_is_iter', False)):
+            return None
+        return list(response._container)
+
+    @classmethod
+    def request_item(cls, request, body, created, weight=1.0):
+        """Return the batch item, (less its ``response``), of the given
+        request, (with the given body), captured at the given time.
+
+        """
+        lines = ['{0} {1} {2}'.format(
+            request.method,
+            iri_to_uri(request.get_full_path()),
+            request.META.get('SERVER_PROTOCOL', 'HTTP/1.1'),
+        )]
+        for (key, value) in sorted(request.META.items()):
+            if key.startswith('HTTP_'):
+                name = key[len('HTTP_'):]
+            elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+                name = key
+            else:
+                continue
+            lines.append('{0}: {1}'.format(name.replace('_', '-').title(),
+                                           value))
+        data = {
+            'content': '\r\n'.join(lines) + '\r\n\r\n' + body,
+            'full_url': request.build_absolute_uri(),
+            'remote_addr': request.META.get('REMOTE_ADDR', ''),
+            'session': {'key': cls.session_key(request), 'app': settings.APP},
+            'created': created,
+        }
+        if weight != 1.0:
+            # (The number of requests which the sampled capture represents.)
+            data['weight'] = weight
+        return data
+
+    @staticmethod
+    def response_item(status_code, headers, chunks, charset, created):
+        """Return the ``response`` data of a batch item, (the raw content
+        and time of capture), of the response of the given status code,
+        headers and content chunks, (see ``response_chunks``).
+
+        The content of streamed responses is omitted.
+
+        """
+        lines = ['HTTP/1.1 {0} {1}'.format(
+            status_code,
+            httplib.responses.get(status_code, ''),
+        )]
+        lines.extend('{0}: {1}'.format(name, value)
+                     for (name, value) in headers)
+        body = ''.join(chunk.encode(charset) if isinstance(chunk, unicode)
+                       else str(chunk) for chunk in chunks or ())
+        return {
+            'content': '\r\n'.join(lines) + '\r\n\r\n' + body,
+            'created': created,
+        }
+
+    @classmethod
+    def capture(cls, request, response, weight=1.0):
+        """Return a callable returning the batch item of the given request
+        and its response, (as expected by the server's batch endpoint). The
+        content of either is the raw message, (a byte string).
+
+        Only references to the request and response are taken, such that
+        the cost of building the item, (rendering their content), falls to
+        whichever thread calls the capture.
+
+        """
+        created = datetime.datetime.utcnow().isoformat() + 'Z'
+        body = cls.request_body(request)
+        (status_code, headers) = (response.status_code, response.items())
+        chunks = cls.response_chunks(response)
+        charset = getattr(response, '_charset',
+                          django.conf.settings.DEFAULT_CHARSET)
+
+        def build():
+            item = cls.request_item(request, body, created, weight)
+            item['response'] = cls.response_item(status_code, headers,
+                                                 chunks, charset, created)
+            return item
+        return build
+
+    @classmethod
+    def batch_item(cls, request, response, weight=1.0):
+        """Return the batch item of the given request and its response,
+        (see ``capture``).
+
+        """
+        return cls.capture(request, response, weight)()
+
     def process_response(self, request, response):
-        request_data = self.parse_request(request)
-        response_data = self.parse_response(response)
-        if settings.USE_CELERY:
-            self.enqueue_task('post_request', request_data)
-            self.enqueue_task('post_response', response_data)
+        weight = 1.0
+        if settings.USE_SAMPLING:
+            weight = sampling.get_sampler().sample(request.path,
+                                                   response.status_code)
+            if weight is None:
+                return response
+        if settings.USE_CELERY and settings.USE_CELERY_BATCHES:
+            celery.get_batcher().ship(self.capture(request, response, weight))
+        elif settings.USE_CELERY:
+            self.enqueue_task('post_request',
+                              self.parse_request(request, weight))
+            self.enqueue_task('post_response', self.parse_response(response))
+        elif settings.SPOOL_DIR:
+            # (Spooled captures are durable once appended, and so are built
+            # by the request thread.)
+            spool.get_spool().append(
+                wire.frame(self.batch_item(request, response, weight)))
+        elif settings.USE_SHIPPER:
+            shipper.get_shipper().ship(
+                self.capture(request, response, weight))
         else:
-            self.post_request(request_data)
-            self.post_response(response_data)
+            self.post_request(self.parse_request(request, weight))
+            self.post_response(self.parse_response(response))
+        return response
@@ -0,0 +1,182 @@
+"""Sampling of captures, bounding the overhead of capture on hot paths.
+
+Each request is matched against SAMPLING_RULES, in order, (or else by the
+default SAMPLING_RATE and SAMPLING_LIMIT), and captured with the probability
+of the matching rule's ``rate``; this is scaled down as the process's
+shipping queue fills beyond SAMPLING_PRESSURE_THRESHOLD. Those sampled are
+further limited to the rule's ``limit`` per second, (by token bucket).
+Error and redirect responses are always captured.
+
+Each capture carries its ``weight``: the inverse of the, (estimated),
+probability of its capture, by which the server scales its counts, (such
+that these remain unbiased).
+
+Rules are dicts of the form:
+
+    {
+        'path': r'^/api/',   # A regular expression matched from the start
+        'status': 200,       # A status code, or a sequence of them
+        'rate': 0.1,         # The probability of capture, (default: 1)
+        'limit': 50,         # Captures per second, (default: unlimited)
+        'burst': 100,        # ...of which so many at once, (default: limit)
+    }
+
+"""
+import random
+import re
+import threading
+import time
+
+from omniclient import ConfigurationError
+
+from . import celery, settings, shipper
+
+
+# The weight of each outcome in the running estimate of the fraction of
+# sampled requests admitted by a rule's limit:
+ADMITTED_DECAY = 0.05
+
+
+class TokenBucket(object):
+    """Admits up to ``rate`` events per second, and up to ``burst`` at once."""
+
+    def __init__(self, rate, burst=None, clock=time.time):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token, and return whether one was available."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Rule(object):
+
+    def __init__(self, path=None, status=None, rate=1.0, limit=None,
+                 burst=None):
+        if not 0 <= rate <= 1:
+            raise ConfigurationError(
+                "Invalid sampling rate: {0}".format(rate))
+        self.path = path and re.compile(path)
+        self.status = (None if status is None else
+                       frozenset([status]) if isinstance(status, int) else
+                       frozenset(status))
+        self.rate = rate
+        self.bucket = None if limit is None else TokenBucket(limit, burst)
+        # The estimated fraction of sampled requests admitted by the limit:
+        self.admitted = 1.0
+
+    def matches(self, path, status):
+        return ((self.path is None or self.path.match(path)) and
+                (self.status is None or status in self.status))
+
+    def admit(self):
+        """Return whether a sampled request is admitted by the limit."""
+        if self.bucket is None:
+            return True
+        admitted = self.bucket.take()
+        self.admitted += ADMITTED_DECAY * (admitted - self.admitted)
+        return admitted
+
+
+class Sampler(object):
+    """Decides which requests are captured, and the weight of each, (see
+    ``sample``).
+
+    ``depth`` is a callable returning the fraction of the shipping queue
+    filled, (if any), beyond ``threshold`` of which the rates of rules are
+    reduced, in proportion to the space remaining, (to no less than
+    ``min_factor`` of their configured rate).
+
+    """
+    def __init__(self, rules=(), rate=1.0, limit=None, burst=None,
+                 depth=None, threshold=0.5, min_factor=0.01,
+                 random=random.random):
+        self.rules = [Rule(**rule) for rule in rules]
+        self.default = Rule(rate=rate, limit=limit, burst=burst)
+        self.depth = depth
+        self.threshold = threshold
+        self.min_factor = min_factor
+        self.random = random
+        self.skipped = self.limited = 0
+
+    def factor(self):
+        """Return the factor by which rates are reduced, given the depth of
+        the shipping queue.
+
+        """
+        depth = self.depth() if self.depth is not None else 0.0
+        if depth <= self.threshold:
+            return 1.0
+        return max(self.min_factor, (1.0 - depth) / (1.0 - self.threshold))
+
+    def sample(self, path, status):
+        """Return the weight of the capture of a request of the given path
+        and response status, or None if it is not to be captured.
+
+        """
+        if status >= 300:
+            # (Errors and redirects are always captured.)
+            return 1.0
+        for rule in self.rules:
+            if rule.matches(path, status):
+                break
+        else:
+            rule = self.default
+        probability = rule.rate * self.factor()
+        if probability < 1 and self.random() >= probability:
+            self.skipped += 1
+            return None
+        if not rule.admit():
+            self.limited += 1
+            return None
+        return 1.0 / (probability * rule.admitted)
+
+
+def shipping_depth():
+    """Return the fraction of the shipping queue of this process filled,
+    (or 0, where captures are not queued in process).
+
+    """
+    if settings.USE_CELERY:
+        if not settings.USE_CELERY_BATCHES:
+            return 0.0
+        queue = celery.get_batcher().queue
+    elif settings.USE_SHIPPER and not settings.SPOOL_DIR:
+        queue = shipper.get_shipper().queue
+    else:
+        return 0.0
+    return float(queue.qsize()) / queue.maxsize if queue.maxsize > 0 else 0.0
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """Return the Sampler of this process, (configured by settings)."""
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = Sampler(
+                    settings.SAMPLING_RULES,
+                    settings.SAMPLING_RATE,
+                    settings.SAMPLING_LIMIT,
+                    settings.SAMPLING_BURST,
+                    shipping_depth,
+                    settings.SAMPLING_PRESSURE_THRESHOLD,
+                    settings.SAMPLING_MIN_FACTOR,
+                )
+    return _sampler
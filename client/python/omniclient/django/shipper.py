@@ -0,0 +1,172 @@
+"""Background shipping of captured requests to the server.
+
+Captures are put on a bounded queue, (which costs the request thread only
+a few microseconds), and drained by a daemon thread, which builds their
+items, (see ``OmnispectiveMiddleware.capture``), and posts them in batches, of up to SHIPPER_BATCH_SIZE items or SHIPPER_BATCH_INTERVAL seconds,
+over a single keep-alive connection.
+
+"""
+import atexit
+import logging
+import os
+import Queue
+import threading
+import time
+
+import requests
+
+from omniclient import ConfigurationError
+
+from . import base, settings
+
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('drop_newest', 'drop_oldest', 'block')
+
+
+class Shipper(object):
+
+    def __init__(self, maxsize, batch_size, interval, policy='drop_newest',
+                 block_timeout=0.05, client=base.OmnispectiveClient):
+        if policy not in POLICIES:
+            raise ConfigurationError(
+                "Invalid shipper policy: {0}".format(policy))
+        self.queue = Queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.client = client
+        self.session = requests.Session()
+        self.sent = self.dropped = self.failed = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ship(self, data):
+        """Enqueue the given batch item, (or a capture, returning it), and
+        return whether it was enqueued, (rather than dropped, the queue being
+        full).
+
+        """
+        if self._pid != os.getpid():
+            # (Not yet started, or forked since.)
+            self.start()
+        try:
+            if self.policy == 'block':
+                self.queue.put(data, True, self.block_timeout)
+            else:
+                self.queue.put_nowait(data)
+        except Queue.Full:
+            pass
+        else:
+            return True
+
+        if self.policy == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+            except Queue.Empty:
+                pass
+            else:
+                self.queue.task_done()
+                self.dropped += 1
+            try:
+                self.queue.put_nowait(data)
+            except Queue.Full:
+                pass
+            else:
+                return True
+        self.dropped += 1
+        return False
+
+    def start(self):
+        """Start the shipping thread, (of this process)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(target=self.run,
+                                      name='omniclient-shipper')
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(True, timeout))
+                except Queue.Empty:
+                    break
+            try:
+                items = self.build(batch)
+                if items:
+                    self.send(items)
+            finally:
+                for _item in batch:
+                    self.queue.task_done()
+
+    def build(self, batch):
+        """Return the items of the given batch, calling those of its
+        entries which are captures.
+
+        """
+        items = []
+        for data in batch:
+            if callable(data):
+                try:
+                    data = data()
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Failed to build a captured request")
+                    continue
+            items.append(data)
+        return items
+
+    def send(self, batch):
+        try:
+            response = self.client.post_batch(batch, session=self.session)
+            response.raise_for_status()
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to ship %d request(s)", len(batch))
+        else:
+            self.sent += len(batch)
+
+    def flush(self, timeout=None):
+        """Wait, (for up to ``timeout`` seconds), for the requests enqueued
+        to be shipped, and return whether they were.
+
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+_shipper = None
+_shipper_lock = threading.Lock()
+
+
+def get_shipper():
+    """Return the Shipper of this process, (configured by settings)."""
+    global _shipper
+    if _shipper is None:
+        with _shipper_lock:
+            if _shipper is None:
+                shipper = Shipper(
+                    settings.SHIPPER_QUEUE_SIZE,
+                    settings.SHIPPER_BATCH_SIZE,
+                    settings.SHIPPER_BATCH_INTERVAL,
+                    settings.SHIPPER_FULL_POLICY,
+                    settings.SHIPPER_BLOCK_TIMEOUT,
+                )
+                atexit.register(shipper.flush, settings.SHIPPER_EXIT_TIMEOUT)
+                _shipper = shipper
+    return _shipper
@@ -0,0 +1,385 @@
+"""A durable on-disk spool of captured requests, (absorbing server outages).
+
+Captures are appended to numbered segment files in the spool directory,
+which are rolled at SPOOL_SEGMENT_SIZE bytes; once the spool exceeds
+SPOOL_MAX_SIZE bytes, its oldest segments are dropped. A replayer thread,
+(of one process at a time), drains the spool to the server in batches,
+backing off while the server is unavailable.
+
+Each record is framed as:
+
+    <4-byte big-endian payload length><4-byte CRC-32 of payload>
+    <8-byte time of append><payload>
+
+and the payload is the batch item, framed as in the frames wire format,
+(see ``wire.frame``), such that raw content is spooled as is.
+
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import requests
+
+from . import base, settings, wire
+
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct('>Iid')
+SEGMENT_SUFFIX = '.spool'
+CHECKPOINT = 'checkpoint'
+
+
+def segment_name(number):
+    return '{0:020d}{1}'.format(number, SEGMENT_SUFFIX)
+
+
+class Spool(object):
+    """Appends records to the spool in the given directory, and reads them
+    from its checkpoint.
+
+    Appends are serialized across threads, and processes, (with a lock
+    file). Writes are flushed to the OS immediately, but fsync'd only after
+    every ``sync_every`` records or ``sync_interval`` seconds. Records are
+    delivered at least once: a consumer should ``commit`` the position
+    returned with each batch once that batch is shipped. Consumed and
+    dropped segments are deleted.
+
+    """
+    def __init__(self, directory, segment_size, max_size, sync_every=100,
+                 sync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.checkpoint_path = os.path.join(directory, CHECKPOINT)
+        self.dropped = 0
+        self._file = None # (segment number, file)
+        self._pending = None # (record count, time of first)
+        self._lock = None
+        self._thread_lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def segment_numbers(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def _path(self, number):
+        return os.path.join(self.directory, segment_name(number))
+
+    # Appending #
+
+    def _open_tail(self):
+        # (Called with the spool locked.)
+        (number, file_) = self._file or (None, None)
+        if file_ is not None and (
+            # Rolled by another process, or due to be rolled:
+            os.path.exists(self._path(number + 1)) or
+            os.fstat(file_.fileno()).st_size >= self.segment_size
+        ):
+            self._sync(file_)
+            file_.close()
+            file_ = None
+
+        if file_ is None:
+            numbers = self.segment_numbers()
+            number = numbers[-1] if numbers else 0
+            if (os.path.exists(self._path(number)) and
+                    os.path.getsize(self._path(number)) >= self.segment_size):
+                number += 1
+                self._drop_oldest(numbers)
+            file_ = open(self._path(number), 'ab')
+            self._file = (number, file_)
+        return file_
+
+    def _drop_oldest(self, numbers):
+        """Delete the oldest of the given (sealed) segments, while their
+        total size exceeds the spool's ``max_size``.
+
+        """
+        sizes = [(number, os.path.getsize(self._path(number)))
+                 for number in numbers]
+        total = sum(size for (_number, size) in sizes)
+        for (number, size) in sizes:
+            if total <= self.max_size:
+                break
+            logger.warning("Spool full: dropping segment %d", number)
+            os.remove(self._path(number))
+            self.dropped += 1
+            total -= size
+
+    def _sync(self, file_):
+        if self._pending is not None:
+            self._pending = None
+            file_.flush()
+            os.fsync(file_.fileno())
+
+    def append(self, data):
+        """Append the given record data, (a byte string), to the spool."""
+        record = FRAME.pack(len(data), zlib.crc32(data), time.time()) + data
+        if self._lock is None:
+            self._lock = open(os.path.join(self.directory, 'lock'), 'a')
+        with self._thread_lock:
+            fcntl.flock(self._lock, fcntl.LOCK_EX)
+            try:
+                file_ = self._open_tail()
+                file_.write(record)
+                file_.flush()
+
+                (count, since) = self._pending or (0, time.time())
+                self._pending = (count + 1, since)
+                if (count + 1 >= self.sync_every or
+                        time.time() - since >= self.sync_interval):
+                    self._sync(file_)
+            finally:
+                fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._file is not None:
+            self._sync(self._file[1])
+            self._file[1].close()
+            self._file = None
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    # Reading #
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file_:
+                data = json.load(file_)
+        except (IOError, ValueError):
+            numbers = self.segment_numbers()
+            return (numbers[0] if numbers else 0, 0)
+        return (data['segment'], data['offset'])
+
+    @staticmethod
+    def _resync(file_, offset):
+        """Return the offset of the first valid record following that at
+        the given offset, (which is corrupt), or None if there is none.
+
+        """
+        file_.seek(offset + 1)
+        data = file_.read()
+        for index in xrange(len(data) - FRAME.size + 1):
+            (length, checksum, _appended) = FRAME.unpack_from(data, index)
+            end = index + FRAME.size + length
+            if (length and end <= len(data) and
+                    zlib.crc32(data[index + FRAME.size:end]) == checksum):
+                return offset + 1 + index
+        return None
+
+    def _read_segment(self, number, offset, max_records, sealed):
+        records = []
+        try:
+            file_ = open(self._path(number), 'rb')
+        except IOError:
+            return (records, offset)
+        with file_:
+            size = os.fstat(file_.fileno()).st_size
+            file_.seek(offset)
+            while len(records) < max_records:
+                header = file_.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                (length, checksum, appended) = FRAME.unpack(header)
+                # (Payloads are never empty, but zero-filled space, (left by a
+                # crash), would otherwise pass for empty records.)
+                if length and offset + FRAME.size + length <= size:
+                    payload = file_.read(length)
+                    if zlib.crc32(payload) == checksum:
+                        records.append((appended, payload))
+                        offset += FRAME.size + length
+                        continue
+                elif length and not sealed:
+                    # Incomplete, (perhaps still being written):
+                    break
+                # Torn, (e.g. by a crash), or otherwise corrupt:
+                logger.error("Skipping corrupt record at %s:%d",
+                             segment_name(number), offset)
+                resynced = self._resync(file_, offset)
+                if resynced is None:
+                    break
+                offset = resynced
+                file_.seek(offset)
+        return (records, offset)
+
+    def read(self, max_records, position=None):
+        """Return a list of up to ``max_records`` (time of append, data)
+        records following the given position, (by default, the checkpoint),
+        along with the position following them.
+
+        """
+        records = []
+        (number, offset) = position or self.load_checkpoint()
+        while len(records) < max_records:
+            later = [later for later in self.segment_numbers()
+                     if later > number]
+            (batch, offset) = self._read_segment(number, offset,
+                                                 max_records - len(records),
+                                                 sealed=bool(later))
+            records.extend(batch)
+            if len(records) >= max_records:
+                break
+            if not later:
+                # Await further appends to the tail segment:
+                break
+            # A later segment exists, so this one is sealed, (or dropped):
+            (number, offset) = (later[0], 0)
+        return (records, (number, offset))
+
+    def commit(self, position):
+        """Durably record the given position as consumed."""
+        (number, offset) = position
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as file_:
+            json.dump({'segment': number, 'offset': offset}, file_)
+            file_.flush()
+            os.fsync(file_.fileno())
+        os.rename(temp_path, self.checkpoint_path)
+
+        for consumed in self.segment_numbers():
+            if consumed >= number:
+                break
+            os.remove(self._path(consumed))
+
+    def stats(self):
+        """Return the depth of the spool, (in segments and unconsumed
+        bytes), its lag, (the age in seconds of the oldest unconsumed
+        record), and the number of segments dropped by this process.
+
+        """
+        (number, offset) = self.load_checkpoint()
+        numbers = [later for later in self.segment_numbers()
+                   if later >= number]
+        size = sum(os.path.getsize(self._path(later)) for later in numbers)
+        if numbers and numbers[0] == number:
+            size -= offset
+        (records, _position) = self.read(1, (number, offset))
+        return {
+            'segments': len(numbers),
+            'bytes': max(size, 0),
+            'lag': time.time() - records[0][0] if records else 0.0,
+            'dropped': self.dropped,
+        }
+
+
+class Replayer(object):
+    """Ships the records of a spool to the server in batches, (of up to
+    ``batch_size``), from whichever process first holds the spool's replay
+    lock.
+
+    """
+    def __init__(self, spool, batch_size, interval, max_backoff,
+                 client=base.OmnispectiveClient):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.client = client
+        self.session = requests.Session()
+        self.pid = None
+        self._lock = None
+
+    def replay(self):
+        """Ship a batch of records, and return their number, (or raise)."""
+        (records, position) = self.spool.read(self.batch_size)
+        if records:
+            response = self.client.post_batch(
+                [wire.unframe(data) for (_appended, data) in records],
+                session=self.session)
+            # (Items rejected by the server would be rejected again, and so
+            # are not retried.)
+            response.raise_for_status()
+            self.spool.commit(position)
+        return len(records)
+
+    def _acquire(self):
+        if self._lock is None:
+            lock = open(os.path.join(self.spool.directory, 'replay.lock'), 'a')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lock.close()
+                return False
+            self._lock = lock
+        return True
+
+    def run(self):
+        backoff = self.interval
+        while True:
+            if not self._acquire():
+                # (Another process is replaying.)
+                time.sleep(self.interval)
+                continue
+            try:
+                shipped = self.replay()
+            except Exception:
+                logger.exception("Failed to replay spool; retrying in %.1fs",
+                                 backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.interval
+            if shipped < self.batch_size:
+                time.sleep(self.interval)
+
+    def start(self):
+        """Start the replaying thread, (of this process)."""
+        self.pid = os.getpid()
+        self._lock = None # (Not inherited across a fork.)
+        thread = threading.Thread(target=self.run, name='omniclient-replayer')
+        thread.daemon = True
+        thread.start()
+
+
+_spool = None
+_replayer = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """Return the Spool of this process, (configured by settings), starting
+    its Replayer if need be.
+
+    """
+    global _spool, _replayer
+    if _replayer is None or _replayer.pid != os.getpid():
+        with _spool_lock:
+            if _replayer is None or _replayer.pid != os.getpid():
+                if _replayer is not None and _replayer._lock is not None:
+                    # Release (this child's hold on) the parent's lock:
+                    _replayer._lock.close()
+                _spool = Spool(settings.SPOOL_DIR,
+                               settings.SPOOL_SEGMENT_SIZE,
+                               settings.SPOOL_MAX_SIZE,
+                               settings.SPOOL_SYNC_EVERY,
+                               settings.SPOOL_SYNC_INTERVAL)
+                _replayer = Replayer(_spool,
+                                     settings.SPOOL_REPLAY_BATCH_SIZE,
+                                     settings.SPOOL_REPLAY_INTERVAL,
+                                     settings.SPOOL_REPLAY_MAX_BACKOFF)
+                _replayer.start()
+    return _spool
+
+
+@atexit.register
+def _close_spool():
+    if _replayer is not None and _replayer.pid == os.getpid():
+        _spool.close()
+
+
+def stats():
+    """Return the depth and lag of the spool, (see ``Spool.stats``)."""
+    return get_spool().stats()
@@ -1,9 +1,33 @@
+import json
+import shutil
+import tempfile
+import zlib
+
 import mock
+from django.http import HttpResponse
 from django.test import RequestFactory
 from django.test.utils import override_settings
 from unittest import TestCase
 
+from omniclient import ConfigurationError
+from omniclient.django import wire
+from omniclient.django.base import OmnispectiveClient
+from omniclient.django.celery import TaskBatcher
+from omniclient.django.sampling import Sampler, TokenBucket
 from omniclient.django.middleware import OmnispectiveMiddleware
+from omniclient.django.shipper import Shipper
+from omniclient.django.spool import Replayer, Spool
+
+
+def shipped_item(ship):
+    """Return the item of the (single) call of the given mock ``ship``,
+    (building it, if a capture).
+
+    """
+    ((data,), _kws) = ship.call_args
+    if callable(data):
+        data = data()
+    return data
 
 
 class TestBasicMiddleware(TestCase):
@@ -34,3 +58,349 @@ class TestBasicMiddleware(TestCase):
             },
             'data': '{}' # FIXME: for now
         })
+
+
+class TestShipper(TestCase):
+
+    def make_shipper(self, **kws):
+        client = mock.Mock()
+        args = dict(maxsize=10, batch_size=2, interval=0.01, client=client)
+        args.update(kws)
+        return (Shipper(**args), client)
+
+    def test_ship(self):
+        (shipper, client) = self.make_shipper()
+        for index in range(3):
+            self.assertTrue(shipper.ship('{{"index":{0}}}'.format(index)))
+        self.assertTrue(shipper.flush(timeout=5))
+        batches = [call[0][0] for call in client.post_batch.call_args_list]
+        self.assertEqual(batches, [['{"index":0}', '{"index":1}'],
+                                   ['{"index":2}']])
+        self.assertEqual(shipper.sent, 3)
+
+    def test_failure(self):
+        (shipper, client) = self.make_shipper()
+        client.post_batch.side_effect = IOError
+        shipper.ship('{}')
+        self.assertTrue(shipper.flush(timeout=5))
+        self.assertEqual((shipper.sent, shipper.failed), (0, 1))
+
+    def test_full(self):
+        for (policy, queued) in (('drop_newest', ['0', '1']),
+                                 ('drop_oldest', ['1', '2']),
+                                 ('block', ['0', '1'])):
+            (shipper, _client) = self.make_shipper(maxsize=2, policy=policy,
+                                                   block_timeout=0.01)
+            with mock.patch.object(shipper, 'start'):
+                results = [shipper.ship(str(index)) for index in range(3)]
+            self.assertEqual(results[:2], [True, True])
+            self.assertEqual(list(shipper.queue.queue), queued)
+            self.assertEqual(shipper.dropped, 1)
+
+    def test_invalid_policy(self):
+        self.assertRaises(ConfigurationError, self.make_shipper, policy='bogus')
+
+    @override_settings(
+        OMNISPECTIVE_HOST='example.com',
+        OMNISPECTIVE_USERNAME='client',
+        OMNISPECTIVE_API_KEY='1234',
+    )
+    def test_post_batch(self):
+        session = mock.Mock()
+        OmnispectiveClient.post_batch(
+            [{'content': 'GET / HTTP/1.1\r\n\r\n\xff'}, {'content': u'b'}],
+            session=session,
+        )
+        session.post.assert_called_once_with(
+            'https://example.com/api/clientrequest/batch/?format=json',
+            headers={
+                'content-type': 'application/json',
+                'authorization': 'ApiKey client:1234',
+            },
+            data=('{"objects":[{"content":"GET / HTTP/1.1\\r\\n\\r\\n'
+                  '\\ufffd"},{"content":"b"}]}'),
+        )
+
+    @override_settings(
+        OMNISPECTIVE_HOST='example.com',
+        OMNISPECTIVE_USERNAME='client',
+        OMNISPECTIVE_API_KEY='1234',
+        OMNISPECTIVE_WIRE_FORMAT='frames',
+    )
+    @mock.patch.object(OmnispectiveClient, 'frames_unsupported', False)
+    def test_post_batch_frames(self):
+        session = mock.Mock()
+        session.post.return_value.status_code = 200
+        item = {'content': 'GET / HTTP/1.1\r\n\r\n', 'full_url': '/',
+                'response': {'content': 'HTTP/1.1 200 OK\r\n\r\n\xff\x00'}}
+        OmnispectiveClient.post_batch([item], session=session)
+        (_args, kws) = session.post.call_args
+        self.assertEqual(kws['headers']['content-type'], wire.CONTENT_TYPE)
+        data = zlib.decompress(kws['data'])
+        (metadata_length, length, response_length) = wire.HEADER.unpack_from(
+            data)
+        data = data[wire.HEADER.size:]
+        self.assertEqual(json.loads(data[:metadata_length]),
+                         {'full_url': '/', 'response': {}})
+        self.assertEqual(data[metadata_length:][:length],
+                         item['content'])
+        self.assertEqual(data[metadata_length + length:],
+                         item['response']['content'])
+
+        # Falling back to JSON, (for good), if the server rejects frames:
+        session.post.return_value.status_code = 415
+        OmnispectiveClient.post_batch([{}], session=session)
+        self.assertEqual(
+            [kws['headers']['content-type']
+             for (_args, kws) in session.post.call_args_list[1:]],
+            [wire.CONTENT_TYPE, 'application/json'])
+        self.assertTrue(OmnispectiveClient.frames_unsupported)
+
+    @override_settings(OMNISPECTIVE_USE_SHIPPER=True,
+                       OMNISPECTIVE_APP='myapp')
+    @mock.patch('omniclient.django.shipper.get_shipper')
+    @mock.patch('omniclient.django.base.requests')
+    def test_middleware(self, requests, get_shipper):
+        mw = OmnispectiveMiddleware()
+        request = RequestFactory().get('/hello/', HTTP_COOKIE='sessionid=abc')
+        response = HttpResponse('hello', status=404)
+        self.assertIs(mw.process_response(request, response), response)
+        self.assertEqual(get_shipper.return_value.ship.call_count, 1)
+        item = shipped_item(get_shipper.return_value.ship)
+        self.assertTrue(item['content'].startswith(
+            'GET /hello/ HTTP/1.1\r\n'))
+        self.assertTrue('\r\nCookie: sessionid=abc\r\n' in item['content'])
+        self.assertEqual(item['full_url'], 'http://testserver/hello/')
+        self.assertEqual(item['remote_addr'], '127.0.0.1')
+        self.assertEqual(item['session'], {'key': 'abc', 'app': 'myapp'})
+        self.assertTrue(item['response']['content'].startswith(
+            'HTTP/1.1 404 Not Found\r\n'))
+        self.assertTrue(item['response']['content'].endswith('\r\n\r\nhello'))
+        self.assertTrue(item['response']['created'].endswith('Z'))
+        self.assertFalse(requests.post.called)
+
+        # Binary content is captured as is:
+        mw.process_response(request, HttpResponse('\xff\x00'))
+        item = shipped_item(get_shipper.return_value.ship)
+        self.assertTrue(item['response']['content'].endswith('\xff\x00'))
+
+        # Streamed content is neither consumed nor captured:
+        response = HttpResponse(iter(['hel', 'lo']))
+        mw.process_response(request, response)
+        item = shipped_item(get_shipper.return_value.ship)
+        self.assertTrue(item['response']['content'].endswith('\r\n\r\n'))
+        self.assertEqual(''.join(response), 'hello')
+
+    def test_build_failure(self):
+        (shipper, client) = self.make_shipper()
+        def capture():
+            raise ValueError
+        shipper.ship(capture)
+        shipper.ship(lambda: '{}')
+        self.assertTrue(shipper.flush(timeout=5))
+        self.assertEqual(client.post_batch.call_args[0][0], ['{}'])
+        self.assertEqual((shipper.sent, shipper.failed), (1, 1))
+
+
+class TestCeleryBatches(TestCase):
+
+    @mock.patch('omniclient.django.celery.post_batch')
+    def test_batches(self, post_batch):
+        batcher = TaskBatcher(maxsize=10, batch_size=2, interval=0.01)
+        for index in range(3):
+            batcher.ship('{{"index":{0}}}'.format(index))
+        self.assertTrue(batcher.flush(timeout=5))
+        batches = [call[0][0] for call in post_batch.delay.call_args_list]
+        self.assertEqual(batches, [['{"index":0}', '{"index":1}'],
+                                   ['{"index":2}']])
+        self.assertEqual(batcher.sent, 3)
+
+    @mock.patch('omniclient.django.celery.post_batch')
+    def test_broker_failure(self, post_batch):
+        post_batch.delay.side_effect = IOError
+        batcher = TaskBatcher(maxsize=10, batch_size=2, interval=0.01)
+        batcher.ship('{}')
+        self.assertTrue(batcher.flush(timeout=5))
+        self.assertEqual((batcher.sent, batcher.failed), (0, 1))
+
+    @override_settings(OMNISPECTIVE_USE_CELERY=True,
+                       OMNISPECTIVE_USE_CELERY_BATCHES=True,
+                       OMNISPECTIVE_APP='myapp')
+    @mock.patch('omniclient.django.celery.get_batcher')
+    @mock.patch('omniclient.django.celery.post_request')
+    def test_middleware(self, post_request, get_batcher):
+        mw = OmnispectiveMiddleware()
+        request = RequestFactory().get('/hello/')
+        response = HttpResponse('hello')
+        self.assertIs(mw.process_response(request, response), response)
+        self.assertEqual(get_batcher.return_value.ship.call_count, 1)
+        item = shipped_item(get_batcher.return_value.ship)
+        self.assertTrue(item['response']['content'].endswith('hello'))
+        self.assertFalse(post_request.delay.called)
+
+
+class TestSampling(TestCase):
+
+    def test_rules(self):
+        sampler = Sampler(
+            rules=[{'path': r'^/api/', 'status': [200, 204], 'rate': 0.25},
+                   {'path': r'^/static/', 'rate': 0}],
+            rate=0.5,
+            random=lambda: 0.4,
+        )
+        self.assertEqual(sampler.sample('/api/items/', 200), None)
+        self.assertEqual(sampler.sample('/api/items/', 201), 2.0)
+        self.assertEqual(sampler.sample('/static/app.js', 200), None)
+        self.assertEqual(sampler.sample('/', 200), 2.0)
+        # Errors and redirects are always captured:
+        self.assertEqual(sampler.sample('/static/app.js', 404), 1.0)
+        self.assertEqual(sampler.sample('/api/items/', 302), 1.0)
+        self.assertEqual((sampler.skipped, sampler.limited), (2, 0))
+
+    def test_limit(self):
+        now = [0.0]
+        bucket = TokenBucket(2, burst=3, clock=lambda: now[0])
+        self.assertEqual([bucket.take() for _index in range(4)],
+                         [True, True, True, False])
+        now[0] += 1.0
+        self.assertEqual([bucket.take() for _index in range(3)],
+                         [True, True, False])
+
+        sampler = Sampler(limit=1)
+        weights = [sampler.sample('/', 200) for _index in range(3)]
+        self.assertEqual(weights[0], 1.0)
+        self.assertEqual(weights[1:], [None, None])
+        self.assertEqual(sampler.limited, 2)
+        # Weighted by the fraction of requests admitted by the limit:
+        sampler.default.bucket.tokens = 1
+        self.assertTrue(sampler.sample('/', 200) > 1.0)
+
+    def test_adaptive(self):
+        depth = [0.0]
+        sampler = Sampler(rate=0.5, depth=lambda: depth[0], threshold=0.5,
+                          min_factor=0.1, random=lambda: 0.2)
+        self.assertEqual(sampler.sample('/', 200), 2.0)
+        depth[0] = 0.75
+        self.assertEqual(sampler.factor(), 0.5)
+        self.assertEqual(sampler.sample('/', 200), 4.0)
+        depth[0] = 1.0
+        self.assertEqual(sampler.factor(), 0.1)
+        self.assertEqual(sampler.sample('/', 200), None)
+
+    @override_settings(OMNISPECTIVE_USE_SAMPLING=True,
+                       OMNISPECTIVE_USE_SHIPPER=True,
+                       OMNISPECTIVE_APP='myapp')
+    @mock.patch('omniclient.django.shipper.get_shipper')
+    @mock.patch('omniclient.django.sampling.get_sampler')
+    def test_middleware(self, get_sampler, get_shipper):
+        mw = OmnispectiveMiddleware()
+        request = RequestFactory().get('/hello/')
+        response = HttpResponse('hello')
+        get_sampler.return_value.sample.return_value = None
+        self.assertIs(mw.process_response(request, response), response)
+        get_sampler.return_value.sample.assert_called_once_with('/hello/', 200)
+        self.assertFalse(get_shipper.return_value.ship.called)
+
+        get_sampler.return_value.sample.return_value = 4.0
+        mw.process_response(request, response)
+        self.assertEqual(get_shipper.return_value.ship.call_count, 1)
+        item = shipped_item(get_shipper.return_value.ship)
+        self.assertEqual(item['weight'], 4.0)
+        self.assertTrue(item['response']['content'].endswith('hello'))
+
+
+class TestSpool(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory, segment_size=64, max_size=1024)
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.directory)
+
+    def test_append_read(self):
+        for index in range(5):
+            self.spool.append('{{"index":{0}}}'.format(index))
+        self.assertTrue(len(self.spool.segment_numbers()) > 1)
+
+        (records, position) = self.spool.read(3)
+        self.assertEqual([data for (_appended, data) in records],
+                         ['{"index":0}', '{"index":1}', '{"index":2}'])
+        self.spool.commit(position)
+        (records, position) = self.spool.read(10)
+        self.assertEqual([data for (_appended, data) in records],
+                         ['{"index":3}', '{"index":4}'])
+
+        stats = self.spool.stats()
+        self.assertEqual(stats['segments'], len(self.spool.segment_numbers()))
+        self.assertTrue(stats['bytes'] > 0)
+        self.assertTrue(stats['lag'] >= 0)
+        self.spool.commit(position)
+        self.assertEqual(self.spool.stats()['bytes'], 0)
+
+    def test_torn_record(self):
+        spool = Spool(self.directory, segment_size=1024, max_size=4096)
+        spool.append('{"index":0}')
+        spool.close()
+        # A record torn by a crash, and zero-filled space:
+        (number,) = spool.segment_numbers()
+        with open(spool._path(number), 'ab') as file_:
+            file_.write(('\x00\x00\x00\x20\x12\x34' + '\x00' * 20))
+        spool.append('{"index":1}')
+        spool.append('{"index":2}')
+        spool.close()
+
+        (records, _position) = spool.read(10)
+        self.assertEqual([data for (_appended, data) in records],
+                         ['{"index":0}', '{"index":1}', '{"index":2}'])
+
+    @mock.patch('os.fsync')
+    def test_sync(self, fsync):
+        spool = Spool(self.directory, segment_size=1024, max_size=4096,
+                      sync_every=2, sync_interval=60)
+        for index in range(5):
+            spool.append('{{"index":{0}}}'.format(index))
+        self.assertEqual(fsync.call_count, 2)
+        spool.close()
+        self.assertEqual(fsync.call_count, 3)
+
+    def test_max_size(self):
+        for index in range(100):
+            self.spool.append('{{"index":{0}}}'.format(index))
+        self.assertTrue(self.spool.dropped > 0)
+        (records, _position) = self.spool.read(100)
+        self.assertEqual(records[-1][1], '{"index":99}')
+        self.assertTrue(len(records) < 100)
+
+    def test_replay(self):
+        client = mock.Mock()
+        replayer = Replayer(self.spool, batch_size=2, interval=0.01,
+                            max_backoff=0.1, client=client)
+        items = [{'content': 'GET /{0}/ HTTP/1.1\r\n\r\n\xff'.format(index)}
+                 for index in range(3)]
+        for item in items:
+            self.spool.append(wire.frame(item))
+
+        client.post_batch.return_value.raise_for_status.side_effect = IOError
+        self.assertRaises(IOError, replayer.replay)
+        self.assertEqual(len(self.spool.read(10)[0]), 3)
+
+        client.post_batch.return_value.raise_for_status.side_effect = None
+        self.assertEqual(replayer.replay(), 2)
+        self.assertEqual(replayer.replay(), 1)
+        self.assertEqual(replayer.replay(), 0)
+        self.assertEqual(client.post_batch.call_args[0][0], [items[2]])
+
+    @mock.patch('omniclient.django.spool.get_spool')
+    @mock.patch('omniclient.django.base.requests')
+    def test_middleware(self, requests, get_spool):
+        mw = OmnispectiveMiddleware()
+        request = RequestFactory().get('/hello/')
+        with override_settings(OMNISPECTIVE_SPOOL_DIR=self.directory,
+                               OMNISPECTIVE_APP='myapp'):
+            mw.process_response(request, HttpResponse('hello'))
+        self.assertEqual(get_spool.return_value.append.call_count, 1)
+        item = wire.unframe(shipped_item(get_spool.return_value.append))
+        self.assertTrue(item['response']['content'].endswith('hello'))
+        self.assertFalse(requests.post.called)
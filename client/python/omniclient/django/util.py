@@ -5,7 +5,61 @@ from omniclient import Defaults
 
 class Settings(Defaults):
 
+    # The format of batches posted: 'json', or the compact 'frames', (of
+    # zlib-compressed raw messages; batches are posted as JSON should the
+    # server not support it):
+    WIRE_FORMAT = 'json'
+
+    # Whether requests are sampled for capture, (see ``sampling``), by the
+    # first matching SAMPLING_RULES, or else at SAMPLING_RATE, and up to
+    # SAMPLING_LIMIT captures (of SAMPLING_BURST at once) per second:
+    USE_SAMPLING = False
+    SAMPLING_RULES = ()
+    SAMPLING_RATE = 1.0
+    SAMPLING_LIMIT = None
+    SAMPLING_BURST = None
+    # The fraction of the shipping queue filled beyond which rates are
+    # reduced, (to no less than SAMPLING_MIN_FACTOR of those configured):
+    SAMPLING_PRESSURE_THRESHOLD = 0.5
+    SAMPLING_MIN_FACTOR = 0.01
+
     USE_CELERY = 'djcelery' in django.conf.settings.INSTALLED_APPS
+    # Whether (with Celery) captures are buffered by each process, and
+    # enqueued in batches, (each a single task, posting to the server's batch
+    # endpoint), of up to CELERY_BATCH_SIZE items or CELERY_BATCH_AGE
+    # seconds; the buffer is bounded and drained as that of the shipper:
+    USE_CELERY_BATCHES = False
+    CELERY_BATCH_SIZE = 100
+    CELERY_BATCH_AGE = 1.0
+
+    # Whether (in the absence of Celery) captures are shipped in batches by
+    # a background thread, rather than posted during the request:
+    USE_SHIPPER = False
+    SHIPPER_QUEUE_SIZE = 1000
+    SHIPPER_BATCH_SIZE = 100
+    # Seconds for which a batch may wait to fill:
+    SHIPPER_BATCH_INTERVAL = 1.0
+    # When the queue is full: 'drop_newest', 'drop_oldest', or 'block' (for
+    # up to SHIPPER_BLOCK_TIMEOUT seconds, and then drop the newest):
+    SHIPPER_FULL_POLICY = 'drop_newest'
+    SHIPPER_BLOCK_TIMEOUT = 0.05
+    # Seconds allowed to ship the queue upon exit:
+    SHIPPER_EXIT_TIMEOUT = 2.0
+
+    # Whether (in the absence of Celery) captures are appended to a durable
+    # spool in this directory, and replayed to the server in the background:
+    SPOOL_DIR = None
+    SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+    # Beyond which the oldest segments are dropped:
+    SPOOL_MAX_SIZE = 1024 * 1024 * 1024
+    # Appends are fsync'd in batches, of so many records or seconds:
+    SPOOL_SYNC_EVERY = 100
+    SPOOL_SYNC_INTERVAL = 1.0
+    SPOOL_REPLAY_BATCH_SIZE = 100
+    # Seconds between replays of an idle spool, and at most between retries
+    # while the server is unavailable:
+    SPOOL_REPLAY_INTERVAL = 1.0
+    SPOOL_REPLAY_MAX_BACKOFF = 60.0
 
     def __getattribute__(self, key):
         external_key = 'OMNISPECTIVE_{0}'.format(key)
@@ -0,0 +1,82 @@
+"""Encoding of batches of captures in the server's compact "frames" wire
+format, (application/x-omnispective-frames).
+
+A batch is a zlib-compressed sequence of frames, one per item:
+
+    <4-byte big-endian metadata length><4-byte request content length>
+    <4-byte response content length><metadata><request content>
+    <response content>
+
+where the metadata is the JSON-encoded item less the ``content`` of its
+request and response, which follow, raw. (The response content is empty
+where the item has no ``response``.) Raw content, unlike that of items
+posted as JSON, need not be text.
+
+"""
+import json
+import struct
+import zlib
+
+
+CONTENT_TYPE = 'application/x-omnispective-frames'
+FORMATS = ('json', 'frames')
+HEADER = struct.Struct('>III')
+
+
+def _bytes(content):
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return content or ''
+
+
+def _text(content):
+    if isinstance(content, unicode):
+        return content
+    return (content or '').decode('utf-8', 'replace')
+
+
+def frame(item):
+    """Return the (uncompressed) frame of the given item."""
+    item = dict(item)
+    content = _bytes(item.pop('content', None))
+    if item.get('response') is None:
+        response_content = ''
+    else:
+        item['response'] = dict(item['response'])
+        response_content = _bytes(item['response'].pop('content', None))
+    metadata = json.dumps(item, separators=(',', ':'))
+    return ''.join((
+        HEADER.pack(len(metadata), len(content), len(response_content)),
+        metadata, content, response_content,
+    ))
+
+
+def unframe(data):
+    """Return the item of the given frame, (see ``frame``)."""
+    (metadata_length, length, response_length) = HEADER.unpack_from(data)
+    offset = HEADER.size
+    item = json.loads(data[offset:offset + metadata_length])
+    offset += metadata_length
+    item['content'] = data[offset:offset + length]
+    offset += length
+    if item.get('response') is not None:
+        item['response']['content'] = data[offset:offset + response_length]
+    return item
+
+
+def encode(items, level=6):
+    """Encode the given items as a batch of frames."""
+    return zlib.compress(''.join(frame(item) for item in items), level)
+
+
+def text(item):
+    """Return a copy of the given item whose content, (and that of its
+    response), is text, as required of items posted as JSON. (Content which
+    is not UTF-8 is decoded lossily.)
+
+    """
+    item = dict(item, content=_text(item.get('content')))
+    if item.get('response') is not None:
+        item['response'] = dict(item['response'],
+                                content=_text(item['response'].get('content')))
+    return item
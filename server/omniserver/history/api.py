@@ -1,18 +1,46 @@
 from django.conf.urls.defaults import url
-from tastypie import exceptions, fields
-from tastypie.authentication import ApiKeyAuthentication
+from django.http import HttpResponse
+from tastypie import exceptions, fields, http
 from tastypie.authorization import DjangoAuthorization
-from tastypie.resources import ModelResource
+from tastypie.bundle import Bundle
+from tastypie.resources import ALL_WITH_RELATIONS, ModelResource
 
-from history import models as history
+from history import (cache, clusters, export, ingest, ingestlog,
+                     models as history, search, timeline, wire)
+from history.authentication import CachedApiKeyAuthentication
+from history.conf import settings
+from history.pagination import CursorPaginator
+
+
+class HttpUnsupportedMediaType(HttpResponse):
+    status_code = 415
+
+
+class HeaderFilterMixin(object):
+    """Allows filtering by (stored) headers, given as "name" or
+    "name:value", (see ``history.models.store_headers``).
+
+    """
+    def apply_filters(self, request, applicable_filters):
+        objects = super(HeaderFilterMixin, self).apply_filters(
+            request, applicable_filters)
+        for header in request.GET.getlist('header'):
+            (name, sep, value) = header.partition(':')
+            if not name.strip():
+                raise exceptions.BadRequest(
+                    "Invalid header '{0}' provided".format(header))
+            objects = objects.with_header(name.strip(),
+                                          value.strip() if sep else None)
+        return objects
 
 
 class AppResource(ModelResource):
 
     class Meta(object):
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         queryset = history.App.objects.all()
         list_allowed_methods = detail_allowed_methods = ['get']
+        filtering = {'code': ['exact']}
 
     def prepend_urls(self):
         # Allow get app detail by code rather than PK:
@@ -27,30 +55,383 @@ class AppResource(ModelResource):
 class ClientSessionResource(ModelResource):
 
     app = fields.ToOneField(AppResource, 'app')
+    # Maintained by history.clusters:
+    cluster = fields.IntegerField(attribute='cluster', null=True,
+                                  readonly=True)
 
     def hydrate_app(self, bundle):
         # Allow specification of app by code:
         if not bundle.obj.app_id:
             try:
                 app_code = bundle.data.pop('app')
-                app = history.App.objects.get(code=app_code)
+                app = cache.get_app(app_code)
             except (KeyError, history.App.DoesNotExist):
                 raise exceptions.BadRequest("App code missing or invalid")
             else:
                 bundle.obj.app = app
         return bundle
 
+    def lookup_kwargs_with_identifiers(self, bundle, kwargs):
+        # Sessions are identified by key *and* app (code):
+        lookup_kwargs = super(ClientSessionResource,
+                              self).lookup_kwargs_with_identifiers(bundle,
+                                                                   kwargs)
+        if 'app' in kwargs:
+            lookup_kwargs['app'] = bundle.obj.app
+        return lookup_kwargs
+
+    def prepend_urls(self):
+        # Provide the timeline and cluster of each session:
+        timeline_pattern = (r"^(?P<resource_name>{0})/(?P<pk>\d+)/timeline/$"
+                            .format(self._meta.resource_name))
+        cluster_pattern = (r"^(?P<resource_name>{0})/(?P<pk>\d+)/cluster/$"
+                           .format(self._meta.resource_name))
+        return [
+            url(timeline_pattern,
+                self.wrap_view('get_timeline'), name="api_get_timeline"),
+            url(cluster_pattern,
+                self.wrap_view('get_cluster'), name="api_get_cluster"),
+        ]
+
+    def get_readable_session(self, request, pk):
+        object_list = self.get_object_list(request)
+        try:
+            session = object_list.select_related('app').get(pk=pk)
+        except history.ClientSession.DoesNotExist:
+            raise exceptions.ImmediateHttpResponse(http.HttpNotFound())
+        bundle = self.build_bundle(obj=session, request=request)
+        self.authorized_read_detail(object_list, bundle)
+        return session
+
+    def get_cluster(self, request, **kwargs):
+        """Respond with the sessions transitively linked to the session,
+        (including it), along with the URI of the listing of their requests.
+
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        session = self.get_readable_session(request, kwargs['pk'])
+        sessions = list(clusters.cluster_of(session).select_related('app'))
+        session = [obj for obj in sessions if obj.pk == session.pk][0]
+        bundles = [
+            self.full_dehydrate(self.build_bundle(obj=obj, request=request))
+            for obj in sessions
+        ]
+        if session.cluster is None:
+            requests_filter = 'session={0}'.format(session.pk)
+        else:
+            requests_filter = 'session__cluster={0}'.format(session.cluster)
+        data = {
+            'cluster': session.cluster,
+            'objects': bundles,
+            'requests_uri': '{0}?{1}'.format(
+                ClientRequestResource().get_resource_uri(), requests_filter),
+        }
+        self.log_throttled_access(request)
+        return self.create_response(request, data)
+
+    def get_timeline(self, request, **kwargs):
+        """Respond with the session's requests, in order, each with its
+        parameters and response, (see ``timeline.render``).
+
+        Pass ``content=1`` to include the raw content of requests and
+        responses, and ``linked=1`` to include ``linked_sessions``.
+
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        session = self.get_readable_session(request, kwargs['pk'])
+        resource_uris = {
+            'session': self.get_resource_uri,
+            'request': ClientRequestResource().get_resource_uri,
+            'response': ServerResponseResource().get_resource_uri,
+        }
+        chunks = timeline.render(
+            session,
+            resource_uris,
+            content=request.GET.get('content') in ('1', 'true'),
+            linked=request.GET.get('linked') in ('1', 'true'),
+        )
+        self.log_throttled_access(request)
+        return HttpResponse(chunks, content_type='application/json')
+
     class Meta(object):
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         authorization = DjangoAuthorization()
+        paginator_class = CursorPaginator
         queryset = history.ClientSession.objects.all()
+        filtering = {
+            'app': ALL_WITH_RELATIONS,
+            'key': ['exact'],
+            'cluster': ['exact'],
+        }
+
+
+class ClientRequestResource(HeaderFilterMixin, ModelResource):
+
+    session = fields.ToOneField(ClientSessionResource, 'session')
+    content = fields.CharField(attribute='content')
+    # Stored as Dimensions, (which are filtered by value) --
+    host = fields.CharField(attribute='host_dimension__value', readonly=True)
+    path = fields.CharField(attribute='path_dimension__value', readonly=True)
+    user_agent = fields.CharField(attribute='user_agent_dimension__value',
+                                  readonly=True)
+
+    class Meta(object):
+        authentication = CachedApiKeyAuthentication()
+        authorization = DjangoAuthorization()
+        excludes = ['content_blob']
+        paginator_class = CursorPaginator
+        queryset = history.ClientRequest.objects.select_related(
+            'content_blob', 'host_dimension', 'path_dimension',
+            'user_agent_dimension')
+        filtering = {
+            'session': ALL_WITH_RELATIONS,
+            'created': ['exact', 'gt', 'gte', 'lt', 'lte', 'range'],
+            'host': ['exact'],
+        }
+
+    def hydrate_session(self, bundle):
+        # Resolve existing sessions by app code and key, (via the cache);
+        # new sessions are created as usual:
+        data = bundle.data.get('session')
+        if hasattr(data, 'keys') and 'app' in data and 'key' in data:
+            try:
+                app = cache.get_app(data['app'])
+            except history.App.DoesNotExist:
+                raise exceptions.BadRequest("App code missing or invalid")
+            try:
+                session = cache.get_session(app, data['key'])
+            except history.ClientSession.DoesNotExist:
+                pass
+            else:
+                bundle.data['session'] = Bundle(obj=session,
+                                                request=bundle.request)
+        return bundle
+
+    def hydrate_weight(self, bundle):
+        if bundle.data.get('weight') is not None:
+            try:
+                ingest.validate_weight(bundle.data['weight'])
+            except ingest.IngestError as exc:
+                raise exceptions.BadRequest(str(exc))
+        return bundle
+
+    def apply_filters(self, request, applicable_filters):
+        objects = super(ClientRequestResource, self).apply_filters(
+            request, applicable_filters)
+
+        # Allow filtering by (indexed) parameters, given as "key=value":
+        source = request.GET.get('parameter_source') or None
+        if source not in (None, 'query', 'form'):
+            raise exceptions.BadRequest(
+                "Invalid parameter_source '{0}' provided".format(source))
+        for parameter in request.GET.getlist('parameter'):
+            (key, sep, value) = parameter.partition('=')
+            if not sep:
+                raise exceptions.BadRequest(
+                    "Invalid parameter '{0}' provided".format(parameter))
+            objects = objects.with_parameter(key, value, source)
 
+        # Allow full-text search, (ranked, where the backend supports it):
+        query = request.GET.get('q')
+        if query:
+            objects = search.search(objects, query)
+        return objects
 
-class ClientRequestResource(ModelResource):
+    def dehydrate(self, bundle):
+        if hasattr(bundle.obj, 'search_snippet'):
+            bundle.data['search_rank'] = bundle.obj.search_rank
+            bundle.data['search_snippet'] = bundle.obj.search_snippet
+        return bundle
+
+    def prepend_urls(self):
+        # Allow bulk creation of requests (and their responses):
+        batch_pattern = r"^(?P<resource_name>{0})/batch/$".format(
+            self._meta.resource_name)
+        # ...and their export:
+        export_pattern = r"^(?P<resource_name>{0})/export/$".format(
+            self._meta.resource_name)
+        return [
+            url(batch_pattern,
+                self.wrap_view('dispatch_batch'), name="api_dispatch_batch"),
+            url(export_pattern,
+                self.wrap_view('get_export'), name="api_get_export"),
+        ]
+
+    def get_export(self, request, **kwargs):
+        """Stream the export of requests, (see ``export.export``), as NDJSON
+        or, given ``format=csv``, CSV.
+
+        Pass ``fields`` to select the (comma-separated) fields exported, and
+        ``since``, ``until``, ``app`` and ``host`` to filter the requests.
+
+        """
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+
+        object_list = self.get_object_list(request)
+        bundle = self.build_bundle(request=request)
+        self.authorized_read_list(object_list, bundle)
+
+        format = request.GET.get('format', 'ndjson')
+        try:
+            fields = export.parse_fields(request.GET.get('fields'))
+            (since, until) = (
+                request.GET.get(key) and export.parse_time(request.GET[key])
+                for key in ('since', 'until')
+            )
+            requests = export.queryset(since=since, until=until,
+                                       app=request.GET.get('app'),
+                                       host=request.GET.get('host'))
+            chunks = export.export(requests, fields, format)
+        except export.ExportError as exc:
+            raise exceptions.BadRequest(str(exc))
+
+        self.log_throttled_access(request)
+        return HttpResponse(chunks, content_type=export.CONTENT_TYPES[format])
+
+    def authorize_create(self, request):
+        bundle = self.build_bundle(obj=history.ClientRequest(), request=request)
+        self.authorized_create_detail(self.get_object_list(request), bundle)
+
+    def deserialize(self, request, data, format='application/json'):
+        # (Clients may fall back to JSON upon an unsupported format.)
+        try:
+            return super(ClientRequestResource, self).deserialize(
+                request, data, format)
+        except exceptions.UnsupportedFormat as exc:
+            raise exceptions.ImmediateHttpResponse(
+                HttpUnsupportedMediaType(str(exc)))
+
+    def deserialize_post(self, request, batch=False):
+        """Deserialize the posted data, (of a batch, in the compact frames
+        format, (see ``wire``), if ``batch`` is given).
+
+        """
+        content_type = request.META.get('CONTENT_TYPE', 'application/json')
+        if content_type.split(';')[0].strip() == wire.CONTENT_TYPE:
+            if not batch:
+                raise exceptions.ImmediateHttpResponse(
+                    HttpUnsupportedMediaType(
+                        "The frames format is accepted of batches only"))
+            try:
+                return {'objects': wire.decode(request.raw_post_data)}
+            except wire.WireError as exc:
+                raise exceptions.BadRequest(str(exc))
+        return self.deserialize(request, request.raw_post_data,
+                                format=content_type)
+
+    def post_list(self, request, **kwargs):
+        # In asynchronous mode, log the request data for the materializer:
+        if not settings.INGEST_ASYNC:
+            return super(ClientRequestResource, self).post_list(request,
+                                                                **kwargs)
+        self.authorize_create(request)
+        item = self.deserialize_post(request)
+        try:
+            ingest.validate_item(item)
+        except ingest.IngestError as exc:
+            raise exceptions.BadRequest(str(exc))
+        ingest.stamp_received(item)
+        ingestlog.append(item)
+        return http.HttpAccepted()
 
+    def dispatch_batch(self, request, **kwargs):
+        """Create a batch of requests, (and their responses), from a payload
+        of the form:
+
+            {"objects": [{<request data>, "response": {"content": ...}}, ...]}
+
+        Responds with the outcome of each item, in order. (In asynchronous
+        mode, valid items are merely accepted, for later storage.)
+
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+        self.throttle_check(request)
+        self.authorize_create(request)
+
+        deserialized = self.deserialize_post(request, batch=True)
+        try:
+            items = deserialized['objects']
+        except (KeyError, TypeError):
+            raise exceptions.BadRequest("Batch objects missing")
+        if not isinstance(items, list):
+            raise exceptions.BadRequest("Batch objects must be a list")
+
+        results = []
+        if settings.INGEST_ASYNC:
+            for item in items:
+                try:
+                    ingest.validate_item(item)
+                except ingest.IngestError as exc:
+                    results.append({'status': 'error', 'error': str(exc)})
+                else:
+                    ingest.stamp_received(item)
+                    ingestlog.append(item)
+                    results.append({'status': 'accepted'})
+            response_class = http.HttpAccepted
+        else:
+            for (client_request, error) in ingest.ingest_batch(items):
+                if error is None:
+                    results.append({
+                        'status': 'created',
+                        'resource_uri': self.get_resource_uri(client_request),
+                    })
+                else:
+                    results.append({'status': 'error', 'error': str(error)})
+            response_class = HttpResponse
+
+        self.log_throttled_access(request)
+        return self.create_response(request, {'objects': results},
+                                    response_class=response_class)
+
+
+class ServerResponseResource(HeaderFilterMixin, ModelResource):
+
+    request = fields.ToOneField(ClientRequestResource, 'request')
     session = fields.ToOneField(ClientSessionResource, 'session')
+    content = fields.CharField(attribute='content')
 
     class Meta(object):
-        authentication = ApiKeyAuthentication()
+        authentication = CachedApiKeyAuthentication()
         authorization = DjangoAuthorization()
-        queryset = history.ClientRequest.objects.all()
+        excludes = ['content_blob']
+        paginator_class = CursorPaginator
+        # (The request and session are joined for the URIs of each.)
+        queryset = history.ServerResponse.objects.select_related(
+            'content_blob', 'request', 'session')
+        list_allowed_methods = detail_allowed_methods = ['get']
+
+
+class TrafficRollupResource(ModelResource):
+    """Counts of responses per app, host, path and status, by minute, hour
+    or day.
+
+    Minute rollups are retained for HISTORY_ROLLUP_MINUTE_RETENTION seconds,
+    and hour rollups for HISTORY_ROLLUP_HOUR_RETENTION seconds, before their
+    compaction into the next resolution.
+
+    """
+    app = fields.ToOneField(AppResource, 'app')
+
+    class Meta(object):
+        authentication = CachedApiKeyAuthentication()
+        queryset = history.TrafficRollup.objects.all()
+        excludes = ['created', 'modified']
+        list_allowed_methods = detail_allowed_methods = ['get']
+        filtering = {
+            'app': ALL_WITH_RELATIONS,
+            'resolution': ['exact'],
+            'period': ['exact', 'gt', 'gte', 'lt', 'lte', 'range'],
+            'host': ['exact'],
+            'path': ['exact', 'startswith'],
+            'status': ['exact', 'gte', 'lt', 'range'],
+        }
+        ordering = ['period']
@@ -0,0 +1,66 @@
+import copy
+
+from django.contrib.auth.models import User
+from django.db.models import signals
+from django.utils.crypto import constant_time_compare
+from tastypie.authentication import ApiKeyAuthentication
+from tastypie.models import ApiKey
+
+from history.cache import LRUCache
+from history.conf import settings
+
+
+# username: (api key, user)
+credentials = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
+def _detached(user):
+    # Permissions are cached on User objects; these aren't to be shared:
+    user = copy.copy(user)
+    for attr in ('_perm_cache', '_user_perm_cache', '_group_perm_cache'):
+        user.__dict__.pop(attr, None)
+    return user
+
+
+class CachedApiKeyAuthentication(ApiKeyAuthentication):
+    """ApiKeyAuthentication, which caches verified credentials in-process,
+    such that repeat requests needn't query the User and ApiKey tables.
+
+    Cached credentials are invalidated when their User or ApiKey is changed
+    in this process, and otherwise expire after AUTH_CACHE_TTL seconds.
+
+    """
+    def is_authenticated(self, request, **kwargs):
+        try:
+            (username, api_key) = self.extract_credentials(request)
+        except ValueError:
+            return self._unauthorized()
+
+        if username and api_key:
+            cached = credentials.get(username)
+            if cached is not None:
+                (cached_key, user) = cached
+                if constant_time_compare(cached_key, api_key):
+                    request.user = _detached(user)
+                    return True
+
+        result = super(CachedApiKeyAuthentication,
+                       self).is_authenticated(request, **kwargs)
+        if result is True:
+            credentials.set(username, (api_key, _detached(request.user)))
+        return result
+
+
+def _invalidate(user_id):
+    credentials.discard_values(lambda cached: cached[1].pk == user_id)
+
+def _user_changed(sender, instance, **_kws):
+    _invalidate(instance.pk)
+
+def _api_key_changed(sender, instance, **_kws):
+    _invalidate(instance.user_id)
+
+signals.post_save.connect(_user_changed, sender=User)
+signals.post_delete.connect(_user_changed, sender=User)
+signals.post_save.connect(_api_key_changed, sender=ApiKey)
+signals.post_delete.connect(_api_key_changed, sender=ApiKey)
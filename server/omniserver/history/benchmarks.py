@@ -0,0 +1,469 @@
+"""Microbenchmarks of the history app's hot paths.
+
+Run via the management command:
+
+    python manage.py benchmark_history [NAME ...]
+
+Each benchmark is a generator of (label, value, unit) measurements.
+Benchmarks which use the database are run against a test database.
+
+"""
+import collections
+import httplib
+import json
+import random
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from StringIO import StringIO
+
+from django import db
+from django.db import transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from tastypie import serializers
+
+from history import ingest, models as history, reprocess, search, util, wire
+
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(uses_db=False):
+    """Register the decorated function as a benchmark."""
+    def decorator(func):
+        func.uses_db = uses_db
+        BENCHMARKS[func.__name__] = func
+        return func
+    return decorator
+
+
+def timed(func, number):
+    """Return the mean seconds per call of ``func`` over ``number`` calls."""
+    start = time.time()
+    for _count in xrange(number):
+        func()
+    return (time.time() - start) / number
+
+
+def count_queries(func):
+    """Return the number of database queries made by calling ``func``."""
+    connection = db.connections[db.DEFAULT_DB_ALIAS]
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        count0 = len(connection.queries)
+        func()
+        return len(connection.queries) - count0
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        db.reset_queries()
+
+
+# Parsing #
+
+class LegacyRequestHandler(BaseHTTPRequestHandler):
+    """The BaseHTTPRequestHandler shim formerly used to parse requests, kept
+    as the baseline of the parsing benchmark.
+
+    """
+    def __init__(self, request):
+        BaseHTTPRequestHandler.__init__(self, request, None, None)
+
+    def setup(self):
+        self.rfile = StringIO(self.request)
+
+    def handle(self):
+        self.raw_requestline = self.rfile.readline()
+        if self.raw_requestline:
+            self.parse_request()
+
+    def finish(self):
+        pass
+
+
+class LegacySocket(StringIO):
+    """The socket shim formerly used to parse responses with httplib."""
+
+    def makefile(self, *_args, **_kws):
+        return self
+
+
+def legacy_parse_request(content, full_url):
+    parsed_url = urlparse.urlparse(full_url)
+    handler = LegacyRequestHandler(content)
+    urlparse.parse_qsl(parsed_url.query)
+    urlparse.parse_qsl(handler.rfile.read().strip())
+    return handler
+
+
+def legacy_parse_response(content):
+    response = httplib.HTTPResponse(LegacySocket(content))
+    response.begin()
+    response.read()
+    return response
+
+
+def _sample_messages(body_size):
+    body = json.dumps([{'id': index, 'name': 'item {0}'.format(index)}
+                       for index in xrange(body_size // 30 or 1)])
+    request = (
+        'POST /api/items/?page=2 HTTP/1.1\r\n'
+        'Host: example.com\r\n'
+        'User-Agent: Benchmark/1.0\r\n'
+        'Content-Type: application/x-www-form-urlencoded\r\n'
+        'Content-Length: 23\r\n'
+        '\r\n'
+        'the=pay-load&such=such\n'
+    )
+    response = (
+        'HTTP/1.1 200 OK\r\n'
+        'Content-Type: application/json\r\n'
+        'Content-Length: {0}\r\n'
+        '\r\n'
+        '{1}'
+    ).format(len(body), body)
+    return (request, response)
+
+
+@benchmark()
+def parse(number=1000):
+    """Parse requests and responses with the message parser, and with the
+    legacy BaseHTTPRequestHandler/httplib shims.
+
+    """
+    full_url = 'https://example.com/api/items/?page=2'
+    for (size_label, body_size, count) in (
+        ('1KB', 1024, number),
+        ('4MB', 4 * 1024 * 1024, max(1, number // 200)),
+    ):
+        (request, response) = _sample_messages(body_size)
+        for (label, func) in (
+            ('legacy request', lambda: legacy_parse_request(request, full_url)),
+            ('request', lambda: util.parse_request(request, full_url)),
+            ('legacy response', lambda: legacy_parse_response(response)),
+            ('response', lambda: util.parse_response(response)),
+        ):
+            yield ('{0} ({1} body)'.format(label, size_label),
+                   timed(func, count) * 1e6,
+                   'us')
+
+
+# Parameters #
+
+def legacy_post_populate(request):
+    """The former population of parameters: row by row, every time."""
+    parsed = request.parse()
+    request.query_params.all().delete()
+    request.query_params.create_all(parsed.query)
+    request.form_params.all().delete()
+    request.form_params.create_all(parsed.form)
+
+
+@benchmark(uses_db=True)
+def parameters(number=1000):
+    """Count the queries made, and time taken, to store the parameters of a
+    request with 50 form fields.
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    session = history.ClientSession.objects.create(app=app, key='benchmark')
+    form = '&'.join('field{0}=value{0}'.format(index) for index in range(50))
+    content = 'POST /form/?page=1 HTTP/1.1\r\nHost: example.com\r\n\r\n'
+    count = max(1, number // 20)
+
+    def make_request():
+        request = history.ClientRequest(
+            session=session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/form/?page=1',
+            content=content + form,
+        )
+        request.pre_populate()
+        request.save(populate=False)
+        return request
+
+    def populated(request):
+        request.post_populate(created=True)
+
+    def changed(request):
+        populated(request)
+        request.content = content + form.replace('value7', 'changed')
+
+    for (label, prepare, func) in (
+        ('new request (legacy)', None, legacy_post_populate),
+        ('new request', None,
+         lambda request: request.post_populate(created=True)),
+        ('unchanged re-save (legacy)', legacy_post_populate,
+         legacy_post_populate),
+        ('unchanged re-save', populated,
+         lambda request: request.post_populate()),
+        ('re-save with one change', changed,
+         lambda request: request.post_populate()),
+    ):
+        requests = []
+        for _count in xrange(count + 1):
+            request = make_request()
+            if prepare is not None:
+                prepare(request)
+            requests.append(request)
+        yield (label, count_queries(lambda: func(requests.pop())), 'queries')
+        yield (label, timed(lambda: func(requests.pop()), count) * 1e6, 'us')
+
+
+@benchmark(uses_db=True)
+def parameter_lookup(number=1000):
+    """Time the lookup of requests by parameter, with and without the index
+    of parameter keys and value hashes, among ``number`` * 100 parameters
+    (of each type).
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    session = history.ClientSession.objects.create(app=app, key='benchmark')
+    request = history.ClientRequest(session=session,
+                                    remote_addr='127.0.0.1',
+                                    full_url='http://example.com/',
+                                    content='GET / HTTP/1.1\r\n\r\n')
+    request.save(populate=False)
+    history.ClientRequest.objects.bulk_create([
+        history.ClientRequest(session=session,
+                              remote_addr='127.0.0.1',
+                              full_url='http://example.com/',
+                              content_blob_id=request.content_blob_id,
+                              host_dimension_id=request.host_dimension_id,
+                              path_dimension_id=request.path_dimension_id,
+                              user_agent_dimension_id=(
+                                  request.user_agent_dimension_id))
+        for _count in xrange(999)
+    ])
+    request_ids = list(history.ClientRequest.objects.values_list('pk',
+                                                                 flat=True))
+
+    rows = number * 100
+    for model in (history.QueryParameter, history.FormParameter):
+        for start in xrange(0, rows, 10000):
+            model.objects.bulk_create([
+                model(key='key{0}'.format(index % 20),
+                      value='value{0}'.format(index),
+                      position=index,
+                      request_id=request_ids[index % len(request_ids)])
+                for index in xrange(start, min(start + 10000, rows))
+            ], batch_size=500)
+
+    count = max(1, number // 10)
+    def lookup():
+        index = random.randrange(rows)
+        list(history.ClientRequest.objects.with_parameter(
+            'key{0}'.format(index % 20), 'value{0}'.format(index)
+        ).filter(session__app=app).values_list('pk', flat=True))
+
+    label = '{0} parameters'.format(rows)
+    yield ('indexed ({0})'.format(label), timed(lookup, count) * 1e6, 'us')
+
+    cursor = db.connections[db.DEFAULT_DB_ALIAS].cursor()
+    for table in ('history_queryparameter', 'history_formparameter'):
+        cursor.execute('DROP INDEX {0}_key_value_hash'.format(table))
+    yield ('unindexed ({0})'.format(label), timed(lookup, count) * 1e6, 'us')
+
+
+@benchmark(uses_db=True)
+def parameter_storage(number=1000):
+    """Time the insertion of requests with 50 form fields, and count the rows
+    stored, with parameters stored as rows, and compactly, (with one key
+    indexed).
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    session = history.ClientSession.objects.create(app=app, key='benchmark')
+    form = '&'.join('field{0}=value{0}'.format(index) for index in range(50))
+    content = ('POST /form/?page=1 HTTP/1.1\r\nHost: example.com\r\n\r\n' +
+               form)
+    count = max(1, number // 10)
+
+    def create():
+        history.ClientRequest.objects.create(
+            session=session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/form/?page=1',
+            content=content,
+        )
+
+    for storage in ('rows', 'compact'):
+        with override_settings(HISTORY_PARAMETER_STORAGE=storage,
+                               HISTORY_PARAMETER_INDEXED_KEYS=('page',)):
+            yield (storage, timed(create, count) * 1e6, 'us')
+        rows = sum(model.objects.count()
+                   for model in (history.QueryParameter,
+                                 history.FormParameter))
+        yield (storage, rows / float(count), 'rows per request')
+        history.ClientRequest.objects.all().delete()
+
+
+# Dimensions #
+
+@benchmark(uses_db=True)
+def user_agents(number=1000):
+    """Time the count of ``number`` * 100 requests per user agent, grouped by
+    Dimension id, and by (joined) text, (as when user agents were stored on
+    each request).
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    session = history.ClientSession.objects.create(app=app, key='benchmark')
+    request = history.ClientRequest(session=session,
+                                    remote_addr='127.0.0.1',
+                                    full_url='http://example.com/',
+                                    content='GET / HTTP/1.1\r\n\r\n')
+    request.save(populate=False)
+    user_agents = history.UserAgent.objects.intern_all(
+        'Mozilla/5.0 (Benchmark {0}) Gecko/20100101 Firefox/{0}.0'.format(index)
+        for index in range(20))
+    ids = user_agents.values()
+
+    rows = number * 100
+    for start in xrange(0, rows, 10000):
+        history.ClientRequest.objects.bulk_create([
+            history.ClientRequest(session=session,
+                                  remote_addr='127.0.0.1',
+                                  full_url='http://example.com/',
+                                  content_blob_id=request.content_blob_id,
+                                  host_dimension_id=request.host_dimension_id,
+                                  path_dimension_id=request.path_dimension_id,
+                                  user_agent_dimension_id=ids[index % len(ids)])
+            for index in xrange(start, min(start + 10000, rows))
+        ], batch_size=500)
+
+    requests = history.ClientRequest.objects.order_by()
+    count = max(1, number // 100)
+    for (label, field) in (('by id', 'user_agent_dimension'),
+                           ('by text', 'user_agent_dimension__value')):
+        yield ('{0} ({1} requests)'.format(label, rows),
+               timed(lambda: list(requests.values(field)
+                                  .annotate(count=Count('pk'))), count) * 1e6,
+               'us')
+
+
+# Headers #
+
+@benchmark(uses_db=True)
+def header_lookup(number=1000):
+    """Time the lookup of the responses of a given header among ``number``
+    responses, by the stored headers, and by parsing each response, (as
+    before headers were stored).
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    cache_controls = ('no-store', 'no-cache', 'private', 'max-age=60')
+    for start in xrange(0, number, 500):
+        ingest.ingest_batch([
+            {
+                'content': 'GET /page/{0}/ HTTP/1.1\r\n\r\n'.format(index),
+                'full_url': 'http://example.com/page/{0}/'.format(index),
+                'remote_addr': '127.0.0.1',
+                'session': {'app': app.code, 'key': 'benchmark'},
+                'response': {
+                    'content': 'HTTP/1.1 200 OK\r\nCache-Control: {0}\r\n'
+                               'Content-Type: text/html\r\n\r\n'
+                               '<p>Page {1}</p>'.format(
+                                   cache_controls[index % 4], index),
+                },
+            }
+            for index in xrange(start, min(start + 500, number))
+        ])
+
+    def stored():
+        return history.ServerResponse.objects.with_header(
+            'Cache-Control', 'no-store').count()
+
+    def parsed():
+        return sum(
+            1 for response in history.ServerResponse.objects.iterator()
+            if response.parse().header('Cache-Control') == 'no-store'
+        )
+
+    assert stored() == parsed()
+    count = max(1, number // 1000)
+    label = '{0} responses'.format(number)
+    yield ('stored ({0})'.format(label), timed(stored, count) * 1e6, 'us')
+    yield ('parsed ({0})'.format(label), timed(parsed, count) * 1e6, 'us')
+
+
+# Reprocessing #
+
+@benchmark(uses_db=True)
+def reprocessing(number=1000):
+    """Time the reprocessing of ``number`` requests (with responses), in
+    chunks, (in this process), and row by row via ``save``, (as formerly).
+
+    """
+    app = history.App.objects.create(code='benchmark', name='Benchmark')
+    form = '&'.join('field{0}=value{0}'.format(index) for index in range(10))
+    ingest.ingest_batch([
+        {
+            'content': ('POST /form/?page={0} HTTP/1.1\r\nHost: example.com\r\n'
+                        'User-Agent: Benchmark/1.0\r\n\r\n{1}'
+                        .format(index, form)),
+            'full_url': 'http://example.com/form/?page={0}'.format(index),
+            'remote_addr': '127.0.0.1',
+            'session': {'app': app.code, 'key': 'benchmark'},
+            'response': {'content': 'HTTP/1.1 200 OK\r\n'
+                                    'Content-Type: text/html\r\n\r\nOK'},
+        }
+        for index in xrange(number)
+    ])
+
+    def chunked():
+        for kind in reprocess.KINDS:
+            for chunk in reprocess.iter_chunks(kind, 1000):
+                (_kind, _last_pk, results) = reprocess.process_chunk(chunk)
+                with transaction.commit_on_success():
+                    reprocess.store_chunk(kind, results)
+
+    def saved():
+        with search.suspended(), transaction.commit_on_success():
+            for request in history.ClientRequest.objects.select_related(
+                    'content_blob'):
+                request.content = request.content # (Re-populate headers.)
+                request.save()
+            for response in history.ServerResponse.objects.select_related(
+                    'content_blob'):
+                response.content = response.content
+                response.save()
+
+    for (label, func) in (('chunked', chunked), ('saved', saved)):
+        yield (label, timed(func, 1) * 1e6 / (2 * number), 'us per row')
+
+
+# Wire formats #
+
+@benchmark()
+def wire_format(number=1000):
+    """Compare the size on the wire, and the decode time, (as by the batch
+    endpoint), of batches of 100 items in JSON and in the frames format.
+
+    """
+    decoders = {
+        'json': serializers.Serializer().from_json,
+        'frames': wire.decode,
+    }
+    count = max(1, number // 100)
+    for (size_label, body_size) in (('1KB', 1024), ('64KB', 64 * 1024)):
+        (request, response) = _sample_messages(body_size)
+        items = [
+            {
+                'content': request,
+                'full_url': 'https://example.com/api/items/?page={0}'.format(
+                    index),
+                'remote_addr': '127.0.0.1',
+                'session': {'app': 'benchmark', 'key': 'benchmark'},
+                'response': {'content': response},
+            }
+            for index in xrange(100)
+        ]
+        for (label, data) in (('json', json.dumps({'objects': items})),
+                              ('frames', wire.encode(items))):
+            yield ('{0} ({1} bodies)'.format(label, size_label),
+                   len(data) / 1024.0, 'KB per batch')
+            yield ('{0} decode ({1} bodies)'.format(label, size_label),
+                   timed(lambda: decoders[label](data), count) * 1e3,
+                   'ms per batch')
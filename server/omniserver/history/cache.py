@@ -0,0 +1,175 @@
+"""In-process caching of the Apps, ClientSessions and Dimensions resolved by
+ingest.
+
+Cached objects are kept up to date by model signals within this process;
+(other processes' changes are picked up once entries expire).
+
+"""
+import collections
+import copy
+import threading
+import time
+
+from django.db.models import signals
+
+from history import models as history
+from history.conf import settings
+
+
+class LRUCache(object):
+    """A thread-safe mapping of bounded size, whose least-recently-used
+    entries are evicted first, and whose entries expire after ``ttl``
+    seconds.
+
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                (expires, value) = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_values(self, predicate):
+        with self._lock:
+            for (key, (_expires, value)) in self._data.items():
+                if predicate(value):
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits,
+                'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+apps = LRUCache(settings.APP_CACHE_SIZE, settings.APP_CACHE_TTL)
+sessions = LRUCache(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL)
+dimensions = LRUCache(settings.DIMENSION_CACHE_SIZE,
+                      settings.DIMENSION_CACHE_TTL)
+
+
+def get_app(code):
+    """Return the App of the given code, or raise App.DoesNotExist."""
+    app = apps.get(code)
+    if app is None:
+        app = history.App.objects.get(code=code)
+        apps.set(code, app)
+    return app
+
+
+def cached_session(app, key):
+    """Return the cached ClientSession of the given App and key, or None.
+
+    Sessions are returned as copies, which may be modified freely.
+
+    """
+    session = sessions.get((app.pk, key))
+    return None if session is None else copy.copy(session)
+
+
+def get_session(app, key):
+    """Return the ClientSession of the given App and key, or raise
+    ClientSession.DoesNotExist.
+
+    """
+    session = cached_session(app, key)
+    if session is None:
+        session = history.ClientSession.objects.get(app=app, key=key)
+        put_session(session)
+    return session
+
+
+def put_session(session):
+    """Add the given (saved) ClientSession to the cache."""
+    sessions.set((session.app_id, session.key), copy.copy(session))
+
+
+def get_dimension_ids(model, values):
+    """Return a mapping of the given values to the pks of the Dimensions of
+    the given model storing them, creating these if need be.
+
+    """
+    ids = {}
+    uncached = set()
+    for value in values:
+        pk = dimensions.get((model, value))
+        if pk is None:
+            uncached.add(value)
+        else:
+            ids[value] = pk
+    if uncached:
+        interned = model.objects.intern_all(uncached)
+        for (value, pk) in interned.items():
+            dimensions.set((model, value), pk)
+        ids.update(interned)
+    return ids
+
+
+def clear():
+    apps.clear()
+    sessions.clear()
+    dimensions.clear()
+
+
+def stats():
+    """Return the hit/miss counts and sizes of the caches."""
+    return {'apps': apps.stats(), 'sessions': sessions.stats(),
+            'dimensions': dimensions.stats()}
+
+
+# Invalidation #
+
+def _app_changed(sender, instance, **_kws):
+    # Apps rarely change, (and their codes may): start over.
+    apps.clear()
+
+def _session_saved(sender, instance, created, **_kws):
+    if created:
+        sessions.discard((instance.app_id, instance.key))
+    else:
+        # Its key may have changed:
+        sessions.discard_values(lambda session: session.pk == instance.pk)
+
+def _session_deleted(sender, instance, **_kws):
+    sessions.discard_values(lambda session: session.pk == instance.pk)
+
+def _dimension_deleted(sender, instance, **_kws):
+    dimensions.discard_values(lambda pk: pk == instance.pk)
+
+signals.post_save.connect(_app_changed, sender=history.App)
+signals.post_delete.connect(_app_changed, sender=history.App)
+signals.post_save.connect(_session_saved, sender=history.ClientSession)
+signals.post_delete.connect(_session_deleted, sender=history.ClientSession)
+for dimension_model in (history.Host, history.Path, history.UserAgent,
+                        history.Header):
+    signals.post_delete.connect(_dimension_deleted, sender=dimension_model)
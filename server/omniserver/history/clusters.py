@@ -0,0 +1,146 @@
+"""Clusters of transitively linked ClientSessions.
+
+Each session linked, (directly or indirectly), to others is labeled with
+the ``cluster`` of the least pk among them; unlinked sessions have none.
+Labels are maintained by model signals as links are added, (merging
+clusters), and removed, (re-labeling the affected cluster), such that any
+session's whole cluster may be fetched in a single query.
+
+"""
+from django.db.models import Q, signals
+
+from history import cache, models as history
+
+
+Link = history.ClientSession.linked_sessions.through
+
+
+class UnionFind(object):
+    """Disjoint sets of pks, each represented by its least member."""
+
+    def __init__(self, members=()):
+        self.parents = dict((member, member) for member in members)
+
+    def find(self, member):
+        root = self.parents.setdefault(member, member)
+        while self.parents[root] != root:
+            root = self.parents[root]
+        # Compress the path to the root:
+        while member != root:
+            (self.parents[member], member) = (root, self.parents[member])
+        return root
+
+    def union(self, member0, member1):
+        roots = sorted((self.find(member0), self.find(member1)))
+        self.parents[roots[1]] = roots[0]
+
+    def groups(self):
+        """Return a mapping of each set's representative to its members."""
+        groups = {}
+        for member in self.parents:
+            groups.setdefault(self.find(member), []).append(member)
+        return groups
+
+
+def _label(groups, using, batch_size=500):
+    for (root, members) in groups.items():
+        cluster = root if len(members) > 1 else None
+        for start in xrange(0, len(members), batch_size):
+            history.ClientSession.objects.using(using).filter(
+                pk__in=members[start:start + batch_size]
+            ).update(cluster=cluster)
+
+
+def merge(pks, using='default'):
+    """Merge the clusters of the sessions of the given pks, (which have
+    been linked), and return the cluster's label.
+
+    """
+    pks = set(pks)
+    sessions = history.ClientSession.objects.using(using)
+    clusters = set(cluster for cluster in sessions.filter(pk__in=pks)
+                   .values_list('cluster', flat=True) if cluster is not None)
+    cluster = min(pks | clusters)
+    sessions.filter(Q(pk__in=pks) | Q(cluster__in=clusters)).exclude(
+        cluster=cluster).update(cluster=cluster)
+    cache.sessions.discard_values(
+        lambda session: session.pk in pks or session.cluster in clusters)
+    return cluster
+
+
+def split(cluster, using='default'):
+    """Re-label the sessions of the given cluster, (from which links have
+    been removed).
+
+    """
+    members = list(history.ClientSession.objects.using(using)
+                   .filter(cluster=cluster).values_list('pk', flat=True))
+    sets = UnionFind(members)
+    links = Link.objects.using(using).filter(
+        from_clientsession__in=members).values_list('from_clientsession_id',
+                                                    'to_clientsession_id')
+    for (from_pk, to_pk) in links:
+        sets.union(from_pk, to_pk)
+    _label(sets.groups(), using)
+    cache.sessions.discard_values(lambda session: session.cluster == cluster)
+
+
+def rebuild(using='default'):
+    """Label the clusters of all sessions, (e.g. upon installation)."""
+    sets = UnionFind()
+    links = Link.objects.using(using).values_list('from_clientsession_id',
+                                                  'to_clientsession_id')
+    for (from_pk, to_pk) in links.iterator():
+        sets.union(from_pk, to_pk)
+    history.ClientSession.objects.using(using).exclude(
+        pk__in=Link.objects.using(using).values('from_clientsession')
+    ).exclude(cluster=None).update(cluster=None)
+    _label(sets.groups(), using)
+    cache.sessions.clear()
+
+
+def cluster_of(session):
+    """Return a queryset of the sessions of the given session's (current)
+    cluster, including it.
+
+    """
+    sessions = history.ClientSession.objects.all()
+    return sessions.filter(
+        Q(pk=session.pk) |
+        Q(cluster__in=sessions.filter(pk=session.pk).values('cluster'))
+    )
+
+
+def _current_cluster(instance, using):
+    return history.ClientSession.objects.using(using).filter(
+        pk=instance.pk).values_list('cluster', flat=True)[0]
+
+
+def _links_changed(sender, instance, action, reverse, pk_set, using, **_kws):
+    if action == 'post_add' and pk_set:
+        instance.cluster = merge(set(pk_set) | set([instance.pk]), using)
+    elif action == 'pre_clear':
+        instance._cluster_cleared = _current_cluster(instance, using)
+    elif action in ('post_remove', 'post_clear'):
+        if action == 'post_clear':
+            cluster = instance.__dict__.pop('_cluster_cleared', None)
+        else:
+            cluster = _current_cluster(instance, using)
+        if cluster is not None:
+            split(cluster, using)
+        instance.cluster = _current_cluster(instance, using)
+
+
+def _session_deleting(sender, instance, using, **_kws):
+    instance._cluster_deleted = _current_cluster(instance, using)
+
+
+def _session_deleted(sender, instance, using, **_kws):
+    cluster = instance.__dict__.pop('_cluster_deleted', None)
+    if cluster is not None:
+        split(cluster, using)
+
+
+signals.m2m_changed.connect(_links_changed, sender=Link)
+signals.pre_delete.connect(_session_deleting, sender=history.ClientSession)
+signals.post_delete.connect(_session_deleted, sender=history.ClientSession)
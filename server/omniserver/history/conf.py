@@ -0,0 +1,74 @@
+import os.path
+
+import django.conf
+
+
+class Defaults(object):
+
+    # Whether the API should only log ingested requests, (to be stored by
+    # the materialize_history command), rather than store them itself:
+    INGEST_ASYNC = False
+    INGEST_LOG_DIR = os.path.join(os.getcwd(), 'ingest-log')
+    INGEST_LOG_PARTITIONS = 4
+    INGEST_LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+    # Appends are fsync'd in batches, of so many records or seconds:
+    INGEST_LOG_SYNC_EVERY = 100
+    INGEST_LOG_SYNC_INTERVAL = 0.05
+
+    # In-process caching of Apps and ClientSessions resolved during ingest:
+    APP_CACHE_SIZE = 100
+    APP_CACHE_TTL = 300
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL = 60
+
+    # In-process caching of the ids of the Dimensions (hosts, paths and user
+    # agents) resolved during ingest:
+    DIMENSION_CACHE_SIZE = 10000
+    DIMENSION_CACHE_TTL = 3600
+
+    # Headers (by lower-case name) not stored for querying, (being of little
+    # use, or of too many distinct values):
+    HEADER_STORE_EXCLUDED = ('authorization', 'cookie', 'date', 'set-cookie')
+
+    # In-process caching of verified API key credentials:
+    AUTH_CACHE_SIZE = 1000
+    AUTH_CACHE_TTL = 60
+
+    # Full-text search: the dotted path of the backend, (by default, chosen
+    # by database; required of databases other than SQLite and PostgreSQL),
+    # and the number of bytes of each body indexed:
+    SEARCH_BACKEND = None
+    SEARCH_MAX_BODY = 64 * 1024
+
+    # Seconds after which minute and hour traffic rollups are compacted,
+    # (into hour and day rollups, respectively):
+    ROLLUP_MINUTE_RETENTION = 2 * 24 * 60 * 60
+    ROLLUP_HOUR_RETENTION = 60 * 24 * 60 * 60
+
+    # Whether the parameters of requests are stored as 'rows', (one per
+    # parameter), or as 'compact' columns of each request, (along with rows
+    # of only those parameters of the given keys, which remain queryable):
+    PARAMETER_STORAGE = 'rows'
+    PARAMETER_INDEXED_KEYS = ()
+
+    # Batches posted in the compact frames format, (see ``wire``), may
+    # decompress to no more than so many bytes:
+    WIRE_MAX_SIZE = 256 * 1024 * 1024
+
+    # Session timelines are fetched in chunks of so many requests:
+    TIMELINE_CHUNK_SIZE = 500
+
+
+class Settings(Defaults):
+
+    def __getattribute__(self, key):
+        external_key = 'HISTORY_{0}'.format(key)
+        try:
+            return getattr(django.conf.settings, external_key)
+        except AttributeError as error:
+            try:
+                return getattr(type(self), key)
+            except AttributeError:
+                raise error
+
+settings = Settings()
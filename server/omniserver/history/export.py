@@ -0,0 +1,205 @@
+"""Streaming export of captured requests, (and their responses), as NDJSON or
+CSV.
+
+Rows are read in batches, from a server-side cursor where the database
+supports one, (PostgreSQL), and otherwise by keyset, such that exports of
+any size are rendered in constant memory.
+
+"""
+import collections
+import csv
+import datetime
+from cStringIO import StringIO
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils import dateparse, timezone
+
+from history import models as history
+
+
+# Export field: the ClientRequest lookup from which it is read --
+FIELDS = (
+    ('id', 'pk'),
+    ('created', 'created'),
+    ('app', 'session__app__code'),
+    ('session', 'session__key'),
+    ('remote_addr', 'remote_addr'),
+    ('method', 'method'),
+    ('full_url', 'full_url'),
+    ('protocol', 'protocol'),
+    ('host', 'host_dimension__value'),
+    ('path', 'path_dimension__value'),
+    ('user_agent', 'user_agent_dimension__value'),
+    ('status', 'serverresponse__status'),
+    ('reason', 'serverresponse__reason'),
+    ('location', 'serverresponse__location'),
+    ('weight', 'weight'),
+    # Read from Blobs --
+    ('content', 'content_blob'),
+    ('response_content', 'serverresponse__content_blob'),
+)
+LOOKUPS = dict(FIELDS)
+BLOB_FIELDS = ('content', 'response_content')
+DEFAULT_FIELDS = tuple(name for (name, _lookup) in FIELDS
+                       if name not in BLOB_FIELDS)
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_time(value):
+    """Parse the given ISO-8601 date or datetime, (UTC unless specified)."""
+    try:
+        moment = dateparse.parse_datetime(value)
+        if moment is None:
+            date = dateparse.parse_date(value)
+            if date is not None:
+                moment = datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ExportError("Invalid date or time: {0}".format(value))
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, timezone.utc)
+    return moment
+
+
+def parse_fields(value):
+    """Parse the given comma-separated field names, (or, if empty, return
+    the default fields).
+
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    fields = tuple(name.strip() for name in value.split(','))
+    unknown = [name for name in fields if name not in LOOKUPS]
+    if unknown:
+        raise ExportError("Unknown field(s): {0}".format(', '.join(unknown)))
+    return fields
+
+
+def queryset(since=None, until=None, app=None, host=None):
+    """Return the ClientRequests to export, filtered by creation time (at or
+    after ``since``, and before ``until``), app code and host.
+
+    """
+    requests = history.ClientRequest.objects.all()
+    if since is not None:
+        requests = requests.filter(created__gte=since)
+    if until is not None:
+        requests = requests.filter(created__lt=until)
+    if app:
+        requests = requests.filter(session__app__code=app)
+    if host:
+        requests = requests.filter(host_dimension__value=host)
+    return requests
+
+
+def iter_batches(requests, fields, batch_size):
+    """Generate lists of the values of the given fields of the given
+    ClientRequests, in order of primary key.
+
+    """
+    lookups = ['pk'] + [LOOKUPS[name] for name in fields]
+    connection = connections[requests.db]
+
+    if connection.vendor == 'postgresql':
+        (sql, params) = (requests.order_by('pk').values_list(*lookups)
+                         .query.sql_with_params())
+        connection.cursor() # (Ensure the connection is open.)
+        cursor = connection.connection.cursor(name='history_export')
+        cursor.itersize = batch_size
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield [row[1:] for row in rows]
+        finally:
+            cursor.close()
+
+    requests = requests.order_by('pk').values_list(*lookups)
+    last_pk = None
+    while True:
+        batch = requests if last_pk is None else requests.filter(pk__gt=last_pk)
+        rows = list(batch[:batch_size])
+        if not rows:
+            return
+        yield [row[1:] for row in rows]
+        last_pk = rows[-1][0]
+
+
+def iter_records(requests, fields, batch_size):
+    """Generate lists of (field name, value) records of the given
+    ClientRequests, replacing the digests of Blob fields with their content.
+
+    """
+    blob_indices = [index for (index, name) in enumerate(fields)
+                    if name in BLOB_FIELDS]
+    for rows in iter_batches(requests, fields, batch_size):
+        if blob_indices:
+            blobs = history.Blob.objects.in_bulk(set(
+                row[index] for row in rows for index in blob_indices
+                if row[index] is not None
+            ))
+            rows = [
+                tuple(blobs[value].decompress()
+                      if index in blob_indices and value is not None
+                      else value
+                      for (index, value) in enumerate(row))
+                for row in rows
+            ]
+        yield [zip(fields, row) for row in rows]
+
+
+def render_ndjson(records):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for batch in records:
+        yield ''.join(encoder.encode(collections.OrderedDict(record)) + '\n'
+                      for record in batch)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def render_csv(records, fields):
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(fields)
+    for batch in records:
+        for record in batch:
+            writer.writerow([_csv_value(value) for (_name, value) in record])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    if output.tell():
+        yield output.getvalue()
+
+
+def export(requests, fields=DEFAULT_FIELDS, format='ndjson',
+           batch_size=1000):
+    """Generate the export of the given ClientRequests, in pieces of a batch
+    of records each.
+
+    """
+    if format not in FORMATS:
+        raise ExportError("Unknown format: {0}".format(format))
+    records = iter_records(requests, fields, batch_size)
+    if format == 'csv':
+        return render_csv(records, fields)
+    return render_ndjson(records)
@@ -0,0 +1,184 @@
+"""Import of HTTP Archive (HAR) captures.
+
+HAR files are read incrementally, entry by entry, (see ``iter_entries``),
+and each entry is mapped to an ingest item, (see ``ingest.build_item``),
+reconstructing the raw request and response messages which it describes.
+
+"""
+import base64
+import datetime
+import json
+import re
+import urlparse
+
+from history import ingest
+
+
+ENTRIES_START = re.compile(r'"entries"\s*:\s*\[')
+SEPARATOR = re.compile(r'[\s,]*')
+
+# HAR bodies are recorded decoded, and their length may differ from that
+# given, so these headers are not reproduced:
+DECODED_HEADERS = ('content-length', 'transfer-encoding', 'content-encoding')
+
+
+class HarError(ValueError):
+    pass
+
+
+def iter_entries(file_, chunk_size=1024 * 1024,
+                 max_entry_size=512 * 1024 * 1024):
+    """Generate the (decoded) entries of the HAR log in the given file,
+    holding no more than an entry (and chunk) of the file in memory.
+
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        match = ENTRIES_START.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = file_.read(chunk_size)
+        if not chunk:
+            raise HarError("No log entries found")
+        # (Retain enough to match the start of the entries across chunks.)
+        buffer = buffer[-64:] + chunk
+
+    position = 0
+    while True:
+        position = SEPARATOR.match(buffer, position).end()
+        if buffer[position:position + 1] == ']':
+            return
+        try:
+            (entry, position) = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # An incomplete entry: read on, (by at least as much again as
+            # has been read, such that large entries are rescanned in time
+            # linear in their size):
+            buffer = buffer[position:]
+            position = 0
+            if len(buffer) > max_entry_size:
+                raise HarError("Entry exceeds {0} bytes, or is invalid"
+                               .format(max_entry_size))
+            chunk = file_.read(max(chunk_size, len(buffer)))
+            if not chunk:
+                raise HarError("Truncated or invalid log entries")
+            buffer += chunk
+        else:
+            if not isinstance(entry, dict):
+                raise HarError("Invalid log entry: {0!r}".format(entry))
+            yield entry
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _version(value):
+    value = (value or '').upper()
+    return value if value.startswith('HTTP/1') else 'HTTP/1.1'
+
+
+def _message(start_line, headers, body):
+    lines = [start_line]
+    for header in headers:
+        name = header['name']
+        # (Omitting HTTP/2 pseudo-headers.)
+        if name.startswith(':') or name.lower() in DECODED_HEADERS:
+            continue
+        lines.append(u'{0}: {1}'.format(name, header['value']))
+    if body:
+        lines.append(u'Content-Length: {0}'.format(len(body)))
+    return _encode(u'\r\n'.join(lines)) + '\r\n\r\n' + body
+
+
+def request_content(har_request):
+    """Reconstruct the raw content of the given HAR request."""
+    parsed_url = urlparse.urlsplit(har_request['url'])
+    target = parsed_url.path or '/'
+    if parsed_url.query:
+        target += '?' + parsed_url.query
+    post_data = har_request.get('postData') or {}
+    if post_data.get('text') is not None:
+        body = _encode(post_data['text'])
+    else:
+        body = '&'.join(
+            '{0}={1}'.format(_encode(param['name']),
+                             _encode(param.get('value', '')))
+            for param in post_data.get('params') or ()
+        )
+    return _message(
+        u'{0} {1} {2}'.format(har_request['method'], target,
+                              _version(har_request.get('httpVersion'))),
+        har_request.get('headers') or (),
+        body,
+    )
+
+
+def response_content(har_response):
+    """Reconstruct the raw content of the given HAR response."""
+    content = har_response.get('content') or {}
+    body = content.get('text') or ''
+    if content.get('encoding') == 'base64':
+        body = base64.b64decode(body)
+    else:
+        body = _encode(body)
+    return _message(
+        u'{0} {1} {2}'.format(_version(har_response.get('httpVersion')),
+                              har_response['status'],
+                              har_response.get('statusText') or ''),
+        har_response.get('headers') or (),
+        body,
+    )
+
+
+def entry_item(entry, app, session_key, remote_addr):
+    """Map the given HAR entry to an ingest item, (see
+    ``ingest.build_item``).
+
+    """
+    started = ingest.parse_created(entry['startedDateTime'])
+    elapsed = datetime.timedelta(milliseconds=entry.get('time') or 0)
+    item = {
+        'content': request_content(entry['request']),
+        'full_url': entry['request']['url'],
+        'remote_addr': remote_addr,
+        'session': {'app': app, 'key': session_key},
+        'created': started.isoformat(),
+    }
+    har_response = entry.get('response')
+    # (Aborted requests are recorded with a status of 0.)
+    if har_response and har_response.get('status'):
+        item['response'] = {
+            'content': response_content(har_response),
+            'created': (started + elapsed).isoformat(),
+        }
+    return item
+
+
+def build_batch(args):
+    """Map the given batch of HAR entries to ingest items, and build these,
+    (see ``ingest.build_all``).
+
+    Takes a single tuple of (entries, app code, session key, remote address),
+    (such that it may be mapped by a process pool), and returns the pair of
+    lists (items, built).
+
+    """
+    (entries, app, session_key, remote_addr) = args
+    items = []
+    built = []
+    for entry in entries:
+        try:
+            item = entry_item(entry, app, session_key, remote_addr)
+        except (KeyError, TypeError, ValueError) as exc:
+            items.append(None)
+            built.append(ingest.IngestError(
+                "Invalid HAR entry: {0!r}".format(exc)))
+        else:
+            items.append(item)
+            built.extend(ingest.build_all([item]))
+    return (items, built)
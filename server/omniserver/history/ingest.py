@@ -0,0 +1,392 @@
+"""Bulk ingestion of captured ClientRequest/ServerResponse pairs.
+
+Each batch is stored within a single transaction, resolving its apps,
+sessions, Blobs, Dimensions and headers once. Its ClientRequests are saved
+one at a time, each under a savepoint, (such that an item failing to save
+fails alone, and such that its pk is retrieved), at the cost of up to three
+statements per item. The rows derived from them, (parameters, header links,
+responses, search index documents and traffic rollups), are then inserted
+in bulk. Items are validated beforehand against their fields' constraints;
+should the bulk insert fail nonetheless, (and where the database supports
+savepoints), the rows are inserted item by item, each under a savepoint,
+and the requests of items failing so are deleted.
+
+"""
+import math
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import dateparse, timezone
+
+from history import cache, models as history, rollups, search
+
+
+class IngestError(ValueError):
+    pass
+
+
+def _require(data, *keys):
+    if not hasattr(data, 'get'):
+        raise IngestError("Item must be an object")
+    missing = [key for key in keys if data.get(key) in (None, '')]
+    if missing:
+        raise IngestError("Missing field(s): {0}".format(', '.join(missing)))
+
+
+def validate_item(item):
+    """Check that the given item has the form of ingest data, (see
+    ``build_item``), raising IngestError if not.
+
+    The item's content is not parsed.
+
+    """
+    _require(item, 'content', 'full_url', 'remote_addr', 'session')
+    if not all(isinstance(item[key], basestring)
+               for key in ('content', 'full_url', 'remote_addr')):
+        raise IngestError("Content, full_url and remote_addr must be strings")
+    _require(item['session'], 'key', 'app')
+    if not all(isinstance(item['session'][key], basestring)
+               for key in ('key', 'app')):
+        raise IngestError("Session key and app must be strings")
+    if item.get('weight') is not None:
+        validate_weight(item['weight'])
+    if item.get('response') is not None:
+        _require(item['response'], 'content')
+        if not isinstance(item['response']['content'], basestring):
+            raise IngestError("Response content must be a string")
+    for data in (item, item.get('response') or {}):
+        if data.get('created') is not None:
+            parse_created(data['created'])
+
+
+def validate_weight(weight):
+    """Check that the given sampling weight is a positive, finite number,
+    raising IngestError if not.
+
+    """
+    if (isinstance(weight, bool) or
+            not isinstance(weight, (int, long, float)) or
+            math.isinf(weight) or math.isnan(weight) or weight <= 0):
+        raise IngestError("Weight must be a positive number")
+
+
+def stamp_received(item):
+    """Date the given (valid) item, and its response, by the present, where
+    their time of capture is not given, (such that items stored later, as
+    by the materializer, are dated by their receipt).
+
+    """
+    now = timezone.now().isoformat()
+    for data in (item, item.get('response') or {}):
+        if data.get('created') is None:
+            data['created'] = now
+
+
+def parse_created(value):
+    """Parse the given ISO-8601 creation time, (UTC unless specified)."""
+    try:
+        created = dateparse.parse_datetime(value)
+    except (TypeError, ValueError):
+        created = None
+    if created is None:
+        raise IngestError("Invalid creation time: {0!r}".format(value))
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created, timezone.utc)
+    return created
+
+
+def build_item(item):
+    """Construct the (unsaved) ClientRequest and, if any, ServerResponse
+    described by the given item, and populate their derived fields.
+
+    Items take the same form as ClientRequest resource data, optionally
+    including the ``response`` to the request, the time of capture of
+    either, (if not the present), and the ``weight`` of a sampled request,
+    (see ``ClientRequest.weight``):
+
+        {
+            "content": "GET / HTTP/1.1 ...",
+            "full_url": "https://example.com/",
+            "remote_addr": "0.0.0.0",
+            "session": {"key": "01234ABCD", "app": "myapp"},
+            "created": "2013-04-01T12:00:00.000Z",
+            "weight": 10.0,
+            "response": {"content": "HTTP/1.1 200 OK ...",
+                         "created": "2013-04-01T12:00:00.250Z"}
+        }
+
+    Raises IngestError for invalid items.
+
+    """
+    validate_item(item)
+
+    request = history.ClientRequest(
+        content=item['content'],
+        full_url=item['full_url'],
+        remote_addr=item['remote_addr'],
+    )
+    if item.get('weight') is not None:
+        request.weight = item['weight']
+    if item.get('created') is not None:
+        request.created = parse_created(item['created'])
+    response_data = item.get('response')
+    if response_data is None:
+        response = None
+    else:
+        response = history.ServerResponse(content=response_data['content'])
+        if response_data.get('created') is not None:
+            response.created = parse_created(response_data['created'])
+
+    try:
+        request.pre_populate()
+        if response is not None:
+            response.pre_populate()
+    except ValueError as exc:
+        raise IngestError("Unparseable content: {0}".format(exc))
+
+    for obj in (request, response):
+        if obj is not None:
+            validate_fields(obj)
+
+    return request, response
+
+
+def validate_fields(obj):
+    """Check the (populated) values of the given object's non-relational
+    fields against their validators, (e.g. of maximum length), raising
+    IngestError if any is invalid.
+
+    """
+    errors = []
+    for field in obj._meta.fields:
+        if field.rel is None:
+            try:
+                field.run_validators(getattr(obj, field.attname))
+            except ValidationError as exc:
+                errors.append(u'{0}: {1}'.format(field.name,
+                                                 u' '.join(exc.messages)))
+    if errors:
+        raise IngestError(u"Invalid {0}: {1}".format(
+            obj._meta.verbose_name, u'; '.join(errors)))
+
+
+def resolve_sessions(pairs):
+    """Look up or create the ClientSessions identified by the given
+    (app code, session key) pairs.
+
+    Returns a mapping of pair to ClientSession; pairs whose app does not
+    exist are omitted.
+
+    """
+    apps = {}
+    for code in set(code for (code, _key) in pairs):
+        try:
+            apps[code] = cache.get_app(code)
+        except history.App.DoesNotExist:
+            pass
+
+    sessions = {}
+    uncached = set()
+    for (code, key) in pairs:
+        if code not in apps:
+            continue
+        session = cache.cached_session(apps[code], key)
+        if session is None:
+            uncached.add((code, key))
+        else:
+            sessions[(code, key)] = session
+
+    if uncached:
+        existing = history.ClientSession.objects.filter(
+            app__in=[apps[code] for (code, _key) in uncached],
+            key__in=[key for (_code, key) in uncached],
+        ).select_related('app')
+        for session in existing:
+            pair = (session.app.code, session.key)
+            if pair in uncached:
+                cache.put_session(session)
+                sessions[pair] = session
+
+    for pair in uncached:
+        if pair not in sessions:
+            (code, key) = pair
+            # (The session may be created concurrently, by another batch.)
+            savepoint = transaction.savepoint()
+            try:
+                sessions[pair] = history.ClientSession.objects.create(
+                    app=apps[code],
+                    key=key,
+                )
+            except IntegrityError:
+                transaction.savepoint_rollback(savepoint)
+                sessions[pair] = history.ClientSession.objects.get(
+                    app=apps[code],
+                    key=key,
+                )
+            else:
+                transaction.savepoint_commit(savepoint)
+            cache.put_session(sessions[pair])
+
+    return sessions
+
+
+def build_all(items):
+    """Return a list, in the order of ``items``, of the (request, response)
+    pairs built of each item, (see ``build_item``), or the IngestError of
+    each invalid item.
+
+    Building involves no queries, and so may be performed by another process
+    than that which stores the batch.
+
+    """
+    built = []
+    for item in items:
+        try:
+            built.append(build_item(item))
+        except IngestError as exc:
+            built.append(exc)
+    return built
+
+
+@transaction.commit_on_success
+def ingest_batch(items, built=None):
+    """Store a batch of captured requests (and their responses).
+
+    The batch may be given already ``built``, (see ``build_all``).
+
+    Returns a list, in the order of ``items``, of (ClientRequest, error)
+    pairs, where exactly one of the two is None.
+
+    """
+    results = [None] * len(items)
+    if built is None:
+        built = build_all(items)
+    built = dict(enumerate(built))
+    for (index, pair) in built.items():
+        if isinstance(pair, IngestError):
+            results[index] = (None, pair)
+            del built[index]
+
+    session_keys = dict(
+        (index, (items[index]['session']['app'],
+                 items[index]['session']['key']))
+        for index in built
+    )
+    sessions = resolve_sessions(set(session_keys.values()))
+
+    objs = [obj for pair in built.values() for obj in pair if obj is not None]
+    blobs = history.Blob.objects.intern_all(obj.content for obj in objs)
+    for obj in objs:
+        obj.content_blob = blobs[history.Blob.digest_of(obj.content)]
+
+    requests = [request for (request, _response) in built.values()]
+    for field_name in history.ClientRequest.DIMENSIONS:
+        field = history.ClientRequest._meta.get_field(
+            '{0}_dimension'.format(field_name))
+        ids = cache.get_dimension_ids(
+            field.rel.to,
+            set(getattr(request, field_name) for request in requests),
+        )
+        for request in requests:
+            setattr(request, field.attname, ids[getattr(request, field_name)])
+    # (Keyed by identity, as unsaved objects compare equal.)
+    headers = dict((id(obj), history.stored_headers(obj.parse()))
+                   for obj in objs)
+    header_ids = cache.get_dimension_ids(
+        history.Header, set(header for pairs in headers.values()
+                            for header in pairs))
+
+    saved = []
+    for index in sorted(built):
+        (request, response) = built[index]
+        try:
+            request.session = sessions[session_keys[index]]
+        except KeyError:
+            results[index] = (None, IngestError("App code missing or invalid"))
+            continue
+
+        savepoint = transaction.savepoint()
+        try:
+            with search.suspended():
+                request.save(populate=False)
+        except DatabaseError as exc:
+            transaction.savepoint_rollback(savepoint)
+            results[index] = (None, IngestError(str(exc)))
+            continue
+        transaction.savepoint_commit(savepoint)
+
+        if response is not None:
+            response.request = request
+            response.session = request.session
+        saved.append((index, request, response))
+        results[index] = (request, None)
+
+    savepoint = transaction.savepoint()
+    try:
+        store_derived([(request, response)
+                       for (_index, request, response) in saved],
+                      headers, header_ids)
+    except DatabaseError:
+        if not connection.features.uses_savepoints:
+            # (The rows inserted before the failure cannot be rolled back.)
+            raise
+        transaction.savepoint_rollback(savepoint)
+        stored = []
+        for (index, request, response) in saved:
+            savepoint = transaction.savepoint()
+            try:
+                store_derived([(request, response)], headers, header_ids)
+            except DatabaseError as exc:
+                transaction.savepoint_rollback(savepoint)
+                history.ClientRequest.objects.filter(pk=request.pk).delete()
+                results[index] = (None, IngestError(str(exc)))
+            else:
+                transaction.savepoint_commit(savepoint)
+                stored.append((index, request, response))
+        saved = stored
+    else:
+        transaction.savepoint_commit(savepoint)
+    rollups.record([response for (_index, _request, response) in saved
+                    if response is not None])
+
+    return results
+
+
+def store_derived(pairs, headers, header_ids):
+    """Insert in bulk the rows derived from the given (saved) requests and
+    their (unsaved) responses: their parameters, header links, responses and
+    search index documents.
+
+    """
+    params = {history.QueryParameter: [], history.FormParameter: []}
+    request_headers = []
+    responses = []
+    for (request, response) in pairs:
+        for (manager, param_pairs) in request.parameter_rows():
+            params[manager.model].extend(manager.build(param_pairs, request))
+        request_headers.extend(history.header_links(
+            request,
+            [header_ids[header] for header in headers[id(request)]],
+        ))
+        if response is not None:
+            responses.append(response)
+
+    search.get_backend().index(pairs)
+    for (model, model_params) in params.items():
+        model.objects.bulk_create(model_params)
+    history.ClientRequest.headers.through.objects.bulk_create(request_headers)
+    history.ServerResponse.objects.bulk_create(responses)
+    if responses:
+        # (Bulk creation does not retrieve pks.)
+        pks = dict(history.ServerResponse.objects.filter(
+            request__in=[response.request_id for response in responses]
+        ).values_list('request_id', 'pk'))
+        response_headers = []
+        for response in responses:
+            response.pk = pks[response.request_id]
+            response_headers.extend(history.header_links(
+                response,
+                [header_ids[header] for header in headers[id(response)]],
+            ))
+        history.ServerResponse.headers.through.objects.bulk_create(
+            response_headers)
@@ -0,0 +1,295 @@
+"""A durable, segmented, append-only log of ingested payloads.
+
+The log is divided into partitions, (each a directory of numbered segment
+files), such that materializer workers may consume it in parallel, while
+the payloads of any one session are kept in order.
+
+Each record is framed as:
+
+    <4-byte big-endian payload length><4-byte CRC-32 of payload><payload>
+
+and the payload is the JSON-encoded ingest item.
+
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+
+from history.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct('>Ii')
+SEGMENT_SUFFIX = '.log'
+CHECKPOINT = 'checkpoint'
+
+
+def segment_name(number):
+    return '{0:020d}{1}'.format(number, SEGMENT_SUFFIX)
+
+
+def segment_numbers(directory):
+    """Return the sorted numbers of the segments in the given partition
+    directory.
+
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in names
+                  if name.endswith(SEGMENT_SUFFIX))
+
+
+def partition_dir(directory, partition):
+    return os.path.join(directory, 'partition-{0:03d}'.format(partition))
+
+
+def partition_of(item, partitions):
+    """Return the partition to which the given item is logged, (by its
+    session).
+
+    """
+    session = item.get('session') or {}
+    key = u'{0}\0{1}'.format(session.get('app'), session.get('key'))
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % partitions
+
+
+class LogWriter(object):
+    """Appends records to the tail segments of a log's partitions.
+
+    Appends are serialized across processes with a lock file per partition.
+    Writes are flushed to the OS immediately, but fsync'd only after every
+    ``sync_every`` records or ``sync_interval`` seconds.
+
+    """
+    def __init__(self, directory, partitions, segment_size,
+                 sync_every, sync_interval):
+        self.directory = directory
+        self.partitions = partitions
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pid = os.getpid()
+        self._files = {} # partition: (segment number, file)
+        self._pending = {} # partition: (record count, time of first)
+
+    def _open_tail(self, partition):
+        # (Called with the partition locked.)
+        directory = partition_dir(self.directory, partition)
+        (number, file_) = self._files.get(partition, (None, None))
+
+        if file_ is not None and (
+            # Rolled by another process, or due to be rolled:
+            os.path.exists(os.path.join(directory, segment_name(number + 1))) or
+            os.fstat(file_.fileno()).st_size >= self.segment_size
+        ):
+            self._sync(partition, file_)
+            file_.close()
+            file_ = None
+
+        if file_ is None:
+            numbers = segment_numbers(directory)
+            number = numbers[-1] if numbers else 0
+            path = os.path.join(directory, segment_name(number))
+            if (os.path.exists(path) and
+                    os.path.getsize(path) >= self.segment_size):
+                number += 1
+                path = os.path.join(directory, segment_name(number))
+            file_ = open(path, 'ab')
+            self._files[partition] = (number, file_)
+
+        return file_
+
+    def _sync(self, partition, file_):
+        if self._pending.pop(partition, None) is not None:
+            file_.flush()
+            os.fsync(file_.fileno())
+
+    def append(self, item):
+        """Append the given ingest item to the log."""
+        payload = json.dumps(item, separators=(',', ':'))
+        record = FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+        partition = partition_of(item, self.partitions)
+
+        lock_path = os.path.join(partition_dir(self.directory, partition),
+                                 'lock')
+        if not os.path.isdir(os.path.dirname(lock_path)):
+            os.makedirs(os.path.dirname(lock_path))
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                file_ = self._open_tail(partition)
+                file_.write(record)
+                file_.flush()
+
+                (count, since) = self._pending.get(partition, (0, time.time()))
+                self._pending[partition] = (count + 1, since)
+                if (count + 1 >= self.sync_every or
+                        time.time() - since >= self.sync_interval):
+                    self._sync(partition, file_)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def close(self):
+        for (partition, (_number, file_)) in self._files.items():
+            self._sync(partition, file_)
+            file_.close()
+        self._files.clear()
+
+
+_writer = None
+
+
+def get_writer():
+    """Return this process's LogWriter, as configured by settings."""
+    global _writer
+    config = (
+        settings.INGEST_LOG_DIR,
+        settings.INGEST_LOG_PARTITIONS,
+        settings.INGEST_LOG_SEGMENT_SIZE,
+        settings.INGEST_LOG_SYNC_EVERY,
+        settings.INGEST_LOG_SYNC_INTERVAL,
+    )
+    if (_writer is None or _writer.pid != os.getpid() or
+            config != (_writer.directory, _writer.partitions,
+                       _writer.segment_size, _writer.sync_every,
+                       _writer.sync_interval)):
+        if _writer is not None and _writer.pid == os.getpid():
+            _writer.close()
+        _writer = LogWriter(*config)
+    return _writer
+
+
+def append(item):
+    get_writer().append(item)
+
+
+@atexit.register
+def _close_writer():
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close()
+
+
+class LogReader(object):
+    """Reads a partition of the log from its checkpoint.
+
+    Records are delivered at least once: a consumer should ``commit`` the
+    position returned with each batch once that batch is stored; upon
+    restart, reading resumes from the last committed position. Fully
+    consumed segments are deleted upon commit.
+
+    """
+    def __init__(self, directory, partition):
+        self.directory = partition_dir(directory, partition)
+        self.checkpoint_path = os.path.join(self.directory, CHECKPOINT)
+        self.position = self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as file_:
+                data = json.load(file_)
+        except (IOError, ValueError):
+            numbers = segment_numbers(self.directory)
+            return (numbers[0] if numbers else 0, 0)
+        return (data['segment'], data['offset'])
+
+    @staticmethod
+    def _resync(file_, offset):
+        """Return the offset of the first valid record following that at
+        the given offset, (which is corrupt), or None if there is none.
+
+        """
+        file_.seek(offset + 1)
+        data = file_.read()
+        for index in xrange(len(data) - FRAME.size + 1):
+            (length, checksum) = FRAME.unpack_from(data, index)
+            end = index + FRAME.size + length
+            if (length and end <= len(data) and
+                    zlib.crc32(data[index + FRAME.size:end]) == checksum):
+                return offset + 1 + index
+        return None
+
+    def _read_segment(self, path, offset, max_records, sealed):
+        items = []
+        try:
+            file_ = open(path, 'rb')
+        except IOError:
+            return (items, offset)
+        with file_:
+            size = os.fstat(file_.fileno()).st_size
+            file_.seek(offset)
+            while len(items) < max_records:
+                header = file_.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                (length, checksum) = FRAME.unpack(header)
+                # (Payloads are never empty, but zero-filled space, (left by a
+                # crash), would otherwise pass for empty records.)
+                if length and offset + FRAME.size + length <= size:
+                    payload = file_.read(length)
+                    if zlib.crc32(payload) == checksum:
+                        items.append(json.loads(payload))
+                        offset += FRAME.size + length
+                        continue
+                # Incomplete, torn, (e.g. by a crash), or otherwise corrupt; the
+                # length of a corrupt record cannot be trusted, and so the next
+                # valid record is sought:
+                resynced = self._resync(file_, offset)
+                if resynced is None and not sealed:
+                    # (If incomplete, perhaps still being written.)
+                    break
+                logger.error("Skipping corrupt record at %s:%d", path, offset)
+                if resynced is None:
+                    break
+                offset = resynced
+                file_.seek(offset)
+        return (items, offset)
+
+    def read(self, max_records):
+        """Return a list of up to ``max_records`` items following the
+        current position, along with the position following them.
+
+        """
+        items = []
+        (number, offset) = self.position
+        while len(items) < max_records:
+            path = os.path.join(self.directory, segment_name(number))
+            # Where a later segment exists, this one is sealed; (and any
+            # torn record in it will never be completed):
+            later = [later for later in segment_numbers(self.directory)
+                     if later > number]
+            (batch, offset) = self._read_segment(path, offset,
+                                                 max_records - len(items),
+                                                 sealed=bool(later))
+            items.extend(batch)
+            if len(items) >= max_records:
+                break
+            if not later:
+                # Await further appends to the tail segment:
+                break
+            (number, offset) = (later[0], 0)
+
+        return (items, (number, offset))
+
+    def commit(self, position):
+        """Durably record the given position as consumed."""
+        (number, offset) = position
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as file_:
+            json.dump({'segment': number, 'offset': offset}, file_)
+            file_.flush()
+            os.fsync(file_.fileno())
+        os.rename(temp_path, self.checkpoint_path)
+        self.position = position
+
+        for consumed in segment_numbers(self.directory):
+            if consumed >= number:
+                break
+            os.remove(os.path.join(self.directory, segment_name(consumed)))
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from history import benchmarks
+
+
+class Command(BaseCommand):
+
+    args = '[benchmark ...]'
+    help = ("Run the named history benchmarks, (by default all of them): "
+            "{0}".format(', '.join(benchmarks.BENCHMARKS)))
+    option_list = BaseCommand.option_list + (
+        make_option('-n', '--number', type='int', default=1000,
+                    help="Base number of iterations (default: 1000)"),
+    )
+
+    def handle(self, *names, **options):
+        names = names or benchmarks.BENCHMARKS.keys()
+        unknown = [name for name in names if name not in benchmarks.BENCHMARKS]
+        if unknown:
+            raise CommandError("Unknown benchmark(s): {0}".format(
+                ', '.join(unknown)))
+
+        funcs = [(name, benchmarks.BENCHMARKS[name]) for name in names]
+        connection = db.connections[db.DEFAULT_DB_ALIAS]
+        if any(func.uses_db for (_name, func) in funcs):
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0)
+        else:
+            old_name = None
+
+        try:
+            for (name, func) in funcs:
+                for (label, value, unit) in func(number=options['number']):
+                    self.stdout.write("{0}: {1}: {2:.1f} {3}\n".format(
+                        name, label, value, unit))
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from history import rollups
+
+
+class Command(BaseCommand):
+
+    help = ("Compact aged minute and hour traffic rollups into hour and day "
+            "rollups, (see HISTORY_ROLLUP_MINUTE_RETENTION and "
+            "HISTORY_ROLLUP_HOUR_RETENTION).")
+
+    def handle(self, **options):
+        for (resolution, count) in rollups.compact_all():
+            self.stdout.write("Compacted {0} {1} rollup(s)\n".format(
+                count, resolution))
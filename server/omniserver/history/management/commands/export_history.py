@@ -0,0 +1,53 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from history import export
+
+
+class Command(BaseCommand):
+
+    help = ("Export captured requests, (and their responses), as NDJSON or "
+            "CSV, to standard output or the given file.")
+    option_list = BaseCommand.option_list + (
+        make_option('-f', '--format', choices=export.FORMATS, default='ndjson',
+                    help="Output format: ndjson or csv (default: ndjson)"),
+        make_option('--fields',
+                    help="Comma-separated fields to export, of: {0} "
+                         "(default: all but content and response_content)"
+                         .format(', '.join(name for (name, _lookup)
+                                           in export.FIELDS))),
+        make_option('--since', help="Export requests created at or after "
+                                    "this ISO-8601 date or time"),
+        make_option('--until', help="Export requests created before this "
+                                    "ISO-8601 date or time"),
+        make_option('--app', help="Export requests of this app (code) only"),
+        make_option('--host', help="Export requests of this host only"),
+        make_option('-b', '--batch-size', type='int', default=1000,
+                    help="Rows read per batch (default: 1000)"),
+        make_option('-o', '--output', help="Path of the file to write"),
+    )
+
+    def handle(self, **options):
+        try:
+            fields = export.parse_fields(options['fields'])
+            (since, until) = (
+                options[key] and export.parse_time(options[key])
+                for key in ('since', 'until')
+            )
+            requests = export.queryset(since=since, until=until,
+                                       app=options['app'],
+                                       host=options['host'])
+            chunks = export.export(requests, fields, options['format'],
+                                   options['batch_size'])
+        except export.ExportError as exc:
+            raise CommandError(str(exc))
+
+        output = (open(options['output'], 'wb') if options['output']
+                  else self.stdout)
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not self.stdout:
+                output.close()
@@ -0,0 +1,114 @@
+import collections
+import itertools
+import multiprocessing
+import os.path
+import time
+from optparse import make_option
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from history import har, ingest, models as history
+
+
+def iter_batches(paths, batch_size, app, session_key, remote_addr):
+    """Generate the arguments of ``har.build_batch`` for each batch of
+    entries of the HAR files at the given paths.
+
+    """
+    for path in paths:
+        key = session_key or os.path.basename(path)
+        with open(path, 'rb') as file_:
+            entries = har.iter_entries(file_)
+            while True:
+                batch = list(itertools.islice(entries, batch_size))
+                if not batch:
+                    break
+                yield (batch, app, key, remote_addr)
+
+
+def iter_built(batches, workers):
+    """Generate the results of ``har.build_batch`` for the given batches, in
+    order, by the given number of worker processes.
+
+    No more than twice as many batches as workers are read ahead.
+
+    """
+    if workers <= 1:
+        for batch in batches:
+            yield har.build_batch(batch)
+        return
+
+    # Workers must not share the parent's database connection:
+    db.close_connection()
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(har.build_batch, (batch,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class Command(BaseCommand):
+
+    args = 'path [path ...]'
+    help = ("Import the entries of the given HAR files as requests and "
+            "responses of the given app, (which is created if need be).")
+    option_list = BaseCommand.option_list + (
+        make_option('--app', help="The code of the app of the requests"),
+        make_option('--session',
+                    help="The key of the session of the requests "
+                         "(default: the name of each file)"),
+        make_option('--remote-addr', default='127.0.0.1',
+                    help="The address of the client (default: 127.0.0.1)"),
+        make_option('-w', '--workers', type='int',
+                    default=multiprocessing.cpu_count(),
+                    help="Number of parsing processes (default: number of "
+                         "CPUs)"),
+        make_option('-b', '--batch-size', type='int', default=500,
+                    help="Entries stored per transaction (default: 500)"),
+    )
+
+    def handle(self, *paths, **options):
+        if not paths:
+            raise CommandError("No HAR files given")
+        if not options['app']:
+            raise CommandError("--app is required")
+        (app, _created) = history.App.objects.get_or_create(
+            code=options['app'], defaults={'name': options['app']})
+
+        batches = iter_batches(paths, options['batch_size'], app.code,
+                               options['session'], options['remote_addr'])
+        start = time.time()
+        (entries, rows, errors) = (0, 0, 0)
+        try:
+            for (items, built) in iter_built(batches, options['workers']):
+                results = ingest.ingest_batch(items, built)
+                for ((request, error), pair) in zip(results, built):
+                    entries += 1
+                    if error is not None:
+                        errors += 1
+                        if int(options['verbosity']) > 1:
+                            self.stderr.write("Skipped entry: {0}\n"
+                                              .format(error))
+                        continue
+                    (_request, response) = pair
+                    rows += 1 + (response is not None) + sum(
+                        len(pairs) for (_manager, pairs)
+                        in request.parameter_rows())
+                if int(options['verbosity']) > 1:
+                    self.stdout.write("{0} entries...\n".format(entries))
+        except har.HarError as exc:
+            raise CommandError(str(exc))
+
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write(
+            "Imported {0} entries ({1} skipped) as {2} rows in {3:.1f}s: "
+            "{4:.0f} rows/s\n".format(entries, errors, rows, elapsed,
+                                      rows / elapsed))
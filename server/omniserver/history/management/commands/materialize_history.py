@@ -0,0 +1,140 @@
+import logging
+import multiprocessing
+import time
+from optparse import make_option
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+
+from history import ingest, ingestlog
+from history.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds, at most, to wait between retries while the database is unavailable:
+MAX_BACKOFF = 60.0
+
+
+def _database_available():
+    try:
+        db.connection.cursor().execute('SELECT 1')
+    except db.DatabaseError:
+        return False
+    return True
+
+
+def store(items):
+    """Store the given items logged, (see ``ingest.ingest_batch``), and
+    return the list of (ClientRequest, error) pairs of each.
+
+    Should the batch fail, its items are stored one by one, and any which
+    fail are discarded, (and logged), such that no item blocks those logged
+    after it. Raises DatabaseError if the database is unavailable, (the
+    batch then to be retried).
+
+    """
+    try:
+        return ingest.ingest_batch(items)
+    except Exception:
+        if not _database_available():
+            raise db.DatabaseError("Database unavailable")
+        logger.exception("Failed to store batch; storing items one by one")
+    results = []
+    for item in items:
+        try:
+            results.extend(ingest.ingest_batch([item]))
+        except Exception as exc:
+            if not _database_available():
+                raise db.DatabaseError("Database unavailable")
+            logger.exception("Discarding unstorable item")
+            results.append((None, exc))
+    return results
+
+
+def materialize(partitions, batch_size, poll_interval, once):
+    """Store the items logged to the given partitions of the ingest log,
+    until interrupted, (or, given ``once``, until all have been consumed).
+
+    While the database is unavailable, batches are retried, backing off
+    (unless ``once``, in which case DatabaseError is raised).
+
+    """
+    readers = [ingestlog.LogReader(settings.INGEST_LOG_DIR, partition)
+               for partition in partitions]
+    backoff = poll_interval
+    while True:
+        idle = True
+        for reader in readers:
+            (items, position) = reader.read(batch_size)
+            if items:
+                idle = False
+                try:
+                    results = store(items)
+                except db.DatabaseError:
+                    if once:
+                        raise
+                    # Leave the batch uncommitted, to retry:
+                    logger.exception("Failed to store batch from %s; "
+                                     "retrying in %.1fs", reader.directory,
+                                     backoff)
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                    continue
+                backoff = poll_interval
+                for (_request, error) in results:
+                    if error is not None:
+                        logger.warning("Discarding invalid item: %s", error)
+            if position != reader.position:
+                reader.commit(position)
+        if idle:
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+
+    help = ("Store the requests logged by the API in asynchronous ingest "
+            "mode (HISTORY_INGEST_ASYNC), resuming from the last checkpoint.")
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int', default=1,
+                    help="Number of worker processes (default: 1)"),
+        make_option('-b', '--batch-size', type='int', default=500,
+                    help="Maximum items stored per transaction (default: 500)"),
+        make_option('--poll-interval', type='float', default=0.5,
+                    help="Seconds to wait for new items (default: 0.5)"),
+        make_option('--once', action='store_true', default=False,
+                    help="Exit once the log has been consumed"),
+    )
+
+    def handle(self, **options):
+        partitions = settings.INGEST_LOG_PARTITIONS
+        workers = min(options['workers'], partitions)
+        if workers < 1:
+            raise CommandError("At least one worker is required")
+        args = (options['batch_size'], options['poll_interval'],
+                options['once'])
+
+        if workers == 1:
+            materialize(range(partitions), *args)
+            return
+
+        # Each worker owns a disjoint subset of the partitions:
+        db.close_connection() # (Not to be shared with the children)
+        processes = [
+            multiprocessing.Process(
+                target=materialize,
+                args=(range(worker, partitions, workers),) + args,
+            )
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,48 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from history import models as history, search
+
+
+class Command(BaseCommand):
+
+    help = "Create the full-text search index, and (re-)index all requests."
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', type='int', default=500,
+                    help="Requests indexed per query (default: 500)"),
+    )
+
+    def handle(self, **options):
+        backend = search.get_backend()
+        backend.install()
+
+        requests = history.ClientRequest.objects.select_related(
+            'content_blob').order_by('pk')
+        last_pk = 0
+        count = 0
+        while True:
+            batch = list(
+                requests.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            responses = dict(
+                (response.request_id, response)
+                for response in history.ServerResponse.objects.filter(
+                    request__in=batch).select_related('content_blob')
+            )
+            pairs = []
+            for request in batch:
+                response = responses.get(request.pk)
+                try:
+                    request.parse()
+                    if response is not None:
+                        response.parse()
+                except ValueError:
+                    continue
+                pairs.append((request, response))
+            backend.index(pairs)
+            count += len(pairs)
+            last_pk = batch[-1].pk
+
+        self.stdout.write("Indexed {0} request(s)\n".format(count))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from history import clusters, models as history
+
+
+class Command(BaseCommand):
+
+    help = ("Label the clusters of transitively linked sessions afresh, "
+            "(e.g. upon installation).")
+
+    @transaction.commit_on_success
+    def handle(self, **options):
+        clusters.rebuild()
+        count = history.ClientSession.objects.exclude(cluster=None).count()
+        self.stdout.write("Labeled {0} linked session(s)\n".format(count))
@@ -0,0 +1,94 @@
+import collections
+import multiprocessing
+import time
+from optparse import make_option
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from history import reprocess
+
+
+def iter_processed(chunks, workers):
+    """Generate the results of ``reprocess.process_chunk`` for the given
+    chunks, in order, by the given number of worker processes.
+
+    No more than twice as many chunks as workers are read ahead.
+
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield reprocess.process_chunk(chunk)
+        return
+
+    # Workers must not share the parent's database connection:
+    db.close_connection()
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(reprocess.process_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class Command(BaseCommand):
+
+    args = '[requests|responses ...]'
+    help = ("Recompute the fields, parameters and headers derived from the "
+            "content of stored requests and/or responses (default: both), "
+            "resuming from the checkpoint of an interrupted run.")
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int',
+                    default=multiprocessing.cpu_count(),
+                    help="Number of parsing processes (default: number of "
+                         "CPUs)"),
+        make_option('-c', '--chunk-size', type='int', default=1000,
+                    help="Rows stored per transaction (default: 1000)"),
+        make_option('--checkpoint', default='reprocess_history.checkpoint',
+                    help="The file recording progress (default: "
+                         "reprocess_history.checkpoint)"),
+        make_option('--restart', action='store_true', default=False,
+                    help="Start over, disregarding the checkpoint"),
+    )
+
+    def handle(self, *kinds, **options):
+        kinds = kinds or reprocess.KINDS
+        for kind in kinds:
+            if kind not in reprocess.KINDS:
+                raise CommandError("Unknown kind: {0}".format(kind))
+        checkpoint = reprocess.Checkpoint(options['checkpoint'])
+        if options['restart']:
+            checkpoint.clear()
+
+        for kind in kinds:
+            chunks = reprocess.iter_chunks(kind, options['chunk_size'],
+                                           checkpoint.get(kind))
+            start = time.time()
+            (rows, errors) = (0, 0)
+            processed = iter_processed(chunks, options['workers'])
+            for (_kind, last_pk, results) in processed:
+                with transaction.commit_on_success():
+                    stored = reprocess.store_chunk(kind, results)
+                checkpoint.commit(kind, last_pk)
+                rows += stored
+                errors += len(results) - stored
+                if int(options['verbosity']) > 1:
+                    for result in results:
+                        if 'error' in result:
+                            self.stderr.write("Failed {0} {1}: {2}\n".format(
+                                kind[:-1], result['pk'], result['error']))
+                    self.stdout.write("{0} {1}...\n".format(rows, kind))
+
+            elapsed = max(time.time() - start, 1e-6)
+            self.stdout.write(
+                "Reprocessed {0} {1} ({2} failed) in {3:.1f}s: {4:.0f} "
+                "rows/s\n".format(rows, kind, errors, elapsed, rows / elapsed))
+        # (Done: a further run starts over.)
+        checkpoint.clear()
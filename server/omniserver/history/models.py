@@ -1,18 +1,41 @@
-import httplib
+import base64
+import hashlib
+import struct
 import urllib
 import urlparse
+import zlib
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.encoding import force_unicode
 from tastypie.models import create_api_key
 
 from history import util
+from history.conf import settings
+
+
+class CreationTimeField(models.DateTimeField):
+    """A DateTimeField set to the current time upon insertion, (like
+    ``auto_now_add``), unless a value is already given, (e.g. by an import of
+    historical data).
+
+    """
+    def __init__(self, *args, **kws):
+        kws.setdefault('editable', False)
+        kws.setdefault('blank', True)
+        super(CreationTimeField, self).__init__(*args, **kws)
+
+    def pre_save(self, model_instance, add):
+        if add and getattr(model_instance, self.attname) is None:
+            setattr(model_instance, self.attname, timezone.now())
+        return super(CreationTimeField, self).pre_save(model_instance, add)
 
 
 class BaseModel(models.Model):
 
-    created = models.DateTimeField(auto_now_add=True)
+    created = CreationTimeField()
     modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -22,6 +45,182 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class BlobManager(models.Manager):
+
+    def intern(self, content):
+        """Return the Blob storing the given content, creating it if need be.
+        """
+        digest = Blob.digest_of(content)
+        try:
+            return self.get(digest=digest)
+        except Blob.DoesNotExist:
+            pass
+        blob = Blob.compress(content)
+        savepoint = transaction.savepoint()
+        try:
+            blob.save(force_insert=True)
+        except IntegrityError:
+            # Inserted concurrently:
+            transaction.savepoint_rollback(savepoint)
+            return self.get(digest=digest)
+        transaction.savepoint_commit(savepoint)
+        return blob
+
+    def intern_all(self, contents):
+        """Return a mapping of digest to the Blobs storing the given contents,
+        creating these in bulk if need be.
+
+        """
+        blobs = dict((Blob.digest_of(content), content) for content in contents)
+        existing = self.filter(digest__in=blobs.keys()).only('digest')
+        existing = dict((blob.digest, blob) for blob in existing)
+        missing = [Blob.compress(content)
+                   for (digest, content) in blobs.items()
+                   if digest not in existing]
+        savepoint = transaction.savepoint()
+        try:
+            self.bulk_create(missing)
+        except IntegrityError:
+            # Some inserted concurrently:
+            transaction.savepoint_rollback(savepoint)
+            missing = [self.intern(blobs[blob.digest]) for blob in missing]
+        else:
+            transaction.savepoint_commit(savepoint)
+        existing.update((blob.digest, blob) for blob in missing)
+        return existing
+
+
+class Blob(BaseModel):
+    """Raw message content, stored compressed and keyed by its SHA-1 digest,
+    such that identical content is stored only once.
+
+    """
+    digest = models.CharField(max_length=40, primary_key=True)
+    size = models.PositiveIntegerField(help_text="The uncompressed size")
+    data = models.TextField(help_text="The base64-encoded, zlib-compressed "
+                                      "UTF-8 content")
+
+    objects = BlobManager()
+
+    def __unicode__(self):
+        return u'{0} ({1} bytes)'.format(self.digest, self.size)
+
+    @staticmethod
+    def _encode(content):
+        if isinstance(content, unicode):
+            return content.encode('utf-8')
+        return content or ''
+
+    @classmethod
+    def digest_of(cls, content):
+        return hashlib.sha1(cls._encode(content)).hexdigest()
+
+    @classmethod
+    def compress(cls, content):
+        """Construct an (unsaved) Blob of the given content."""
+        encoded = cls._encode(content)
+        return cls(
+            digest=hashlib.sha1(encoded).hexdigest(),
+            size=len(encoded),
+            data=base64.b64encode(zlib.compress(encoded)),
+        )
+
+    def decompress(self):
+        """Return the stored content."""
+        content = zlib.decompress(base64.b64decode(self.data))
+        try:
+            return content.decode('utf-8')
+        except UnicodeDecodeError:
+            # Content need not be text:
+            return content
+
+
+def blob_property(field_name, doc=None):
+    """Construct a property, which proxies the content of the Blob referred to
+    by the named ForeignKey.
+
+    Content is decompressed lazily, on first access; assigned content is
+    stored, (see ``intern_blob``), upon save.
+
+    """
+    cache_name = '_{0}_content'.format(field_name)
+    attname = '{0}_id'.format(field_name)
+
+    def get_content(self):
+        try:
+            return getattr(self, cache_name)
+        except AttributeError:
+            pass
+        if getattr(self, attname) is None:
+            content = None
+        else:
+            content = getattr(self, field_name).decompress()
+        setattr(self, cache_name, content)
+        return content
+
+    def set_content(self, content):
+        setattr(self, cache_name, content)
+        # Detach the (possibly stale) Blob:
+        setattr(self, attname, None)
+        self.__dict__.pop('_{0}_cache'.format(field_name), None)
+
+    return property(get_content, set_content, doc=doc)
+
+
+def intern_blob(instance, field_name, content):
+    """Ensure the named Blob ForeignKey of the given instance refers to the
+    given content.
+
+    """
+    if getattr(instance, '{0}_id'.format(field_name)) is None:
+        setattr(instance, field_name, Blob.objects.intern(content))
+
+
+def dimension_property(field_name, doc=None):
+    """Construct a property, which proxies the value of the Dimension
+    referred to by the named ForeignKey.
+
+    Values are fetched lazily, on first access; assigned values are interned,
+    (see ``intern_dimension``), upon save.
+
+    """
+    cache_name = '_{0}_value'.format(field_name)
+    attname = '{0}_id'.format(field_name)
+
+    def get_value(self):
+        try:
+            return getattr(self, cache_name)
+        except AttributeError:
+            pass
+        if getattr(self, attname) is None:
+            value = None
+        else:
+            value = getattr(self, field_name).value
+        setattr(self, cache_name, value)
+        return value
+
+    def set_value(self, value):
+        if cache_name in self.__dict__ and self.__dict__[cache_name] == value:
+            return
+        setattr(self, cache_name, value)
+        # Detach the (possibly stale) Dimension:
+        setattr(self, attname, None)
+        self.__dict__.pop('_{0}_cache'.format(field_name), None)
+
+    return property(get_value, set_value, doc=doc)
+
+
+def intern_dimension(instance, field_name, value):
+    """Ensure the named Dimension ForeignKey of the given instance refers to
+    the given value.
+
+    """
+    if getattr(instance, '{0}_id'.format(field_name)) is None:
+        model = instance._meta.get_field(field_name).rel.to
+        setattr(instance, '{0}_id'.format(field_name),
+                model.objects.intern(value))
+
+
 class App(BaseModel):
 
     code = models.SlugField(unique=True)
@@ -46,7 +245,11 @@ class Client(BaseModel):
 class ClientSession(BaseModel):
 
     key = models.CharField(max_length=255, db_index=True)
-    linked_sessions = models.ManyToManyField('history.ClientSession') # TODO: 16
+    linked_sessions = models.ManyToManyField('history.ClientSession')
+    # Maintained by history.clusters --
+    cluster = models.PositiveIntegerField(null=True, db_index=True,
+        help_text="The least pk of the sessions transitively linked to this "
+                  "one, (and it), if any")
     app = models.ForeignKey('history.App', related_name='sessions')
     client = models.ForeignKey('history.Client',
                                null=True, related_name='sessions') # TODO
@@ -58,6 +261,239 @@ class ClientSession(BaseModel):
         return u'{0} on {1}'.format(self.key, self.app)
 
 
+class DimensionManager(models.Manager):
+
+    def intern(self, value):
+        """Return the pk of the row of the given value, creating it if need
+        be.
+
+        """
+        return self.intern_all([value])[value]
+
+    def intern_all(self, values):
+        """Return a mapping of the given values to the pks of their rows,
+        creating these in bulk if need be.
+
+        """
+        values = set(values)
+        keys = dict((self.model.key_of(value), value or u'')
+                    for value in values)
+        lookup = '{0}__in'.format(self.model.KEY_FIELD)
+        ids = dict(self.filter(**{lookup: keys.keys()})
+                   .values_list(self.model.KEY_FIELD, 'pk'))
+        missing = [key for key in keys if key not in ids]
+        if missing:
+            savepoint = transaction.savepoint()
+            try:
+                self.bulk_create([self.model.build(keys[key])
+                                  for key in missing])
+            except IntegrityError:
+                # Some inserted concurrently:
+                transaction.savepoint_rollback(savepoint)
+                for key in missing:
+                    self.get_or_create(**self.model.build_kws(keys[key]))
+            else:
+                transaction.savepoint_commit(savepoint)
+            # (Bulk creation does not retrieve pks.)
+            ids.update(self.filter(**{lookup: missing})
+                       .values_list(self.model.KEY_FIELD, 'pk'))
+        return dict((value, ids[self.model.key_of(value)]) for value in values)
+
+
+class Dimension(BaseModel):
+    """A distinct value, (e.g. a host), stored once, and referred to by the
+    requests having it.
+
+    """
+    # The unique field by which values are looked up --
+    KEY_FIELD = 'value'
+
+    objects = DimensionManager()
+
+    class Meta(object):
+        abstract = True
+
+    def __unicode__(self):
+        return self.value
+
+    @classmethod
+    def key_of(cls, value):
+        return force_unicode(value or u'')
+
+    @classmethod
+    def build_kws(cls, value):
+        return {'value': value}
+
+    @classmethod
+    def build(cls, value):
+        return cls(**cls.build_kws(value))
+
+
+class Host(Dimension):
+
+    value = models.CharField(max_length=255, unique=True)
+
+
+class Path(Dimension):
+
+    value = models.CharField(max_length=255, unique=True)
+
+
+class UserAgent(Dimension):
+
+    # (User agents may be too long to index, and so are looked up by their
+    # digest.)
+    KEY_FIELD = 'digest'
+
+    digest = models.CharField(max_length=40, unique=True)
+    value = models.TextField()
+
+    @classmethod
+    def key_of(cls, value):
+        return hashlib.sha1(force_unicode(value or u'').encode('utf-8')
+                            ).hexdigest()
+
+    @classmethod
+    def build_kws(cls, value):
+        return {'digest': cls.key_of(value), 'value': value}
+
+
+class Header(Dimension):
+    """A header, (name and value), of any number of requests and responses.
+
+    Names are stored in lower case.
+
+    """
+    KEY_FIELD = 'digest'
+
+    digest = models.CharField(max_length=40, unique=True)
+    name = models.CharField(max_length=255, db_index=True)
+    value = models.TextField()
+
+    def __unicode__(self):
+        return u'{0}: {1}'.format(self.name, self.value)
+
+    @staticmethod
+    def normalize(header):
+        (name, value) = header
+        return (force_unicode(name, errors='replace').lower(),
+                force_unicode(value, errors='replace'))
+
+    @classmethod
+    def key_of(cls, header):
+        return hashlib.sha1(u'{0}\n{1}'.format(*cls.normalize(header))
+                            .encode('utf-8')).hexdigest()
+
+    @classmethod
+    def build_kws(cls, header):
+        (name, value) = cls.normalize(header)
+        return {'digest': cls.key_of(header), 'name': name, 'value': value}
+
+
+def stored_headers(parsed):
+    """Return the (name, value) pairs of the headers of the given parsed
+    request or response which are stored, (see HEADER_STORE_EXCLUDED).
+
+    """
+    excluded = settings.HEADER_STORE_EXCLUDED
+    return [(name, value) for (name, value) in parsed.headers
+            if name.lower() not in excluded]
+
+
+def header_links(instance, ids):
+    """Return the (unsaved) rows linking the given (saved) request or
+    response to the Headers of the given pks.
+
+    """
+    field = instance._meta.get_field('headers')
+    through = field.rel.through
+    return [through(**{field.m2m_column_name(): instance.pk,
+                       field.m2m_reverse_name(): pk})
+            for pk in set(ids)]
+
+
+def store_headers(instance, created=False):
+    """Associate the given (saved) request or response with the Headers of
+    its content; those of a newly ``created`` one are simply inserted.
+
+    """
+    ids = Header.objects.intern_all(stored_headers(instance.parse())).values()
+    if created:
+        instance._meta.get_field('headers').rel.through.objects.bulk_create(
+            header_links(instance, ids))
+        return
+    existing = set(instance.headers.values_list('pk', flat=True))
+    ids = set(ids)
+    if existing - ids:
+        instance.headers.remove(*(existing - ids))
+    if ids - existing:
+        instance.headers.add(*(ids - existing))
+
+
+class HeaderQuerySetMixin(object):
+
+    def with_header(self, name, value=None):
+        """Filter for objects having the given header, (of the given value,
+        if any).
+
+        """
+        field = self.model._meta.get_field('headers')
+        headers = field.rel.through.objects.all()
+        if value is None:
+            headers = headers.filter(header__name=name.lower())
+        else:
+            headers = headers.filter(
+                header__digest=Header.key_of((name, value)))
+        return self.filter(pk__in=headers.values(field.m2m_field_name()))
+
+
+class ClientRequestQuerySet(HeaderQuerySetMixin, QuerySet):
+
+    def with_parameter(self, key, value, source=None):
+        """Filter for requests having sent the given parameter, in their
+        query string or form data, or (given ``source``) in the one or the
+        other, ('query' or 'form').
+
+        Parameters are looked up by index of key and hash of value. (Where
+        parameters are stored compactly, only those of the
+        PARAMETER_INDEXED_KEYS may be found.)
+
+        """
+        sources = {'query': QueryParameter, 'form': FormParameter}
+        if source is None:
+            parameter_models = sources.values()
+        else:
+            parameter_models = [sources[source]]
+
+        # (A single subquery, which databases may probe by primary key, (the
+        # OR of subqueries is not so planned):
+        qn = connection.ops.quote_name
+        subqueries = [
+            "SELECT {0} FROM {1} WHERE {2} = %s AND {3} = %s AND {4} = %s"
+            .format(qn('request_id'), qn(model._meta.db_table), qn('key'),
+                    qn('value_hash'), qn('value'))
+            for model in parameter_models
+        ]
+        return self.extra(
+            where=["{0}.{1} IN ({2})".format(qn(self.model._meta.db_table),
+                                             qn('id'),
+                                             ' UNION ALL '.join(subqueries))],
+            params=[key, value_hash(value), value] * len(subqueries),
+        )
+
+
+class ClientRequestManager(models.Manager):
+
+    def get_query_set(self):
+        return ClientRequestQuerySet(self.model, using=self._db)
+
+    def with_parameter(self, key, value, source=None):
+        return self.get_query_set().with_parameter(key, value, source)
+
+    def with_header(self, name, value=None):
+        return self.get_query_set().with_header(name, value)
+
+
 class ClientRequest(BaseModel):
 
     PROTOCOLS = (
@@ -69,13 +505,39 @@ class ClientRequest(BaseModel):
                                 related_name='requests')
     remote_addr = models.GenericIPAddressField(db_index=True)
     full_url = models.CharField(max_length=255)
-    content = models.TextField()
+    content_blob = models.ForeignKey('history.Blob', related_name='+',
+                                     on_delete=models.PROTECT)
+    content = blob_property('content_blob', "The raw, complete request content")
+    weight = models.FloatField(
+        default=1.0,
+        help_text="The number of requests which the capture represents, (the "
+                  "inverse of the rate at which the client sampled it)",
+    )
     # Filled in by save() from full_url, etc. (along with params) --
     method = models.CharField(max_length=10)
     protocol = models.CharField(choices=PROTOCOLS, max_length=5)
-    host = models.CharField(max_length=255, db_index=True)
-    path = models.CharField(max_length=255, db_index=True)
-    user_agent = models.TextField()
+    host_dimension = models.ForeignKey('history.Host',
+                                       related_name='requests',
+                                       on_delete=models.PROTECT)
+    host = dimension_property('host_dimension')
+    path_dimension = models.ForeignKey('history.Path',
+                                       related_name='requests',
+                                       on_delete=models.PROTECT)
+    path = dimension_property('path_dimension')
+    user_agent_dimension = models.ForeignKey('history.UserAgent',
+                                             related_name='requests',
+                                             on_delete=models.PROTECT)
+    user_agent = dimension_property('user_agent_dimension')
+    headers = models.ManyToManyField('history.Header', related_name='requests')
+    # Parameters stored compactly, (see ``encode_pairs``), rather than as
+    # rows, if PARAMETER_STORAGE is 'compact' --
+    query_data = models.TextField(null=True, editable=False)
+    form_data = models.TextField(null=True, editable=False)
+
+    objects = ClientRequestManager()
+
+    # Attributes stored as Dimensions, (see ``dimension_property``) --
+    DIMENSIONS = ('host', 'path', 'user_agent')
 
     class Meta(object):
         get_latest_by = 'created'
@@ -84,18 +546,18 @@ class ClientRequest(BaseModel):
         return u'[{0}] {1}'.format(self.remote_addr, self.full_url)
 
     def parse(self):
-        """Parse the raw request content and return the request handler object.
+        """Parse the raw request ``content`` and ``full_url``, and return the
+        resulting ``util.ParsedRequest`` record.
 
-        The handler object has the following attributes of note:
-
-            command: the method of the request
-            path: the requested resource path
-            request_version: the HTTP version of the request
-            headers: a mapping object of the request's headers
-            rfile: the raw request buffer
+        The record is cached on the object, and is only rebuilt when
+        ``content`` or ``full_url`` change.
 
         """
-        return util.DumbHTTPRequestHandler(self.content)
+        key = (self.content, self.full_url)
+        cached = getattr(self, '_parsed', None)
+        if cached is None or cached[0] != key:
+            cached = self._parsed = (key, util.parse_request(*key))
+        return cached[1]
 
     def pre_populate(self):
         """Fill in / update field data derived from ``full_url`` and
@@ -103,43 +565,102 @@ class ClientRequest(BaseModel):
 
             ``protocol``, ``host``, ``path``, ``method`` and ``user_agent``
 
-        """
-        parsed_url = urlparse.urlparse(self.full_url)
-        self.protocol = parsed_url.scheme
-        self.host = parsed_url.hostname
-        self.path = parsed_url.path
+        and, if parameters are stored compactly, ``query_data`` and
+        ``form_data``.
 
-        parsed_content = self.parse()
-        self.method = parsed_content.command
-        self.user_agent = parsed_content.headers.get('User-Agent', '')
+        """
+        parsed = self.parse()
+        self.protocol = parsed.protocol
+        self.host = parsed.host
+        self.path = parsed.path
+        self.method = parsed.method
+        self.user_agent = parsed.header('User-Agent', '')
+        if settings.PARAMETER_STORAGE == 'compact':
+            self.query_data = util.encode_pairs(parsed.query)
+            self.form_data = util.encode_pairs(parsed.form)
+        else:
+            self.query_data = self.form_data = None
+
+    def parameter_rows(self):
+        """Return the pairs (parameter manager, list of (key, value) pairs)
+        of the parameters to be stored as rows: all of them, or, where stored
+        compactly, only those of the PARAMETER_INDEXED_KEYS, (such that these
+        remain queryable).
 
-    def post_populate(self):
+        """
+        parsed = self.parse()
+        rows = []
+        for (manager, data, pairs) in (
+            (QueryParameter.objects, self.query_data, parsed.query),
+            (FormParameter.objects, self.form_data, parsed.form),
+        ):
+            if data is not None:
+                keys = settings.PARAMETER_INDEXED_KEYS
+                pairs = [pair for pair in pairs if pair[0] in keys]
+            rows.append((manager, pairs))
+        return rows
+
+    def post_populate(self, created=False, headers=True):
         """Fill in / update associated data derived from ``full_url`` and
-        ``content``, namely QueryParameters and FormParameters.
+        ``content``, namely QueryParameters and FormParameters, (see
+        ``parameter_rows``), and Headers, (see ``store_headers``).
 
         These data require a ``request_id`` for association, and therefore
         may not be populated prior to insertion, and are handled separately
-        from ``pre_populate``.
+        from ``pre_populate``. The parameters of a newly ``created`` request
+        are simply inserted; otherwise, they are synchronized.
 
         """
-        parsed = urlparse.urlparse(self.full_url)
-        self.query_params.all().delete()
-        self.query_params.parse_create(parsed.query)
-
-        additional_payload = self.parse().rfile.read().strip()
-        self.form_params.all().delete()
-        self.form_params.parse_create(additional_payload)
+        for (manager, pairs) in self.parameter_rows():
+            if created:
+                manager.bulk_create(manager.build(pairs, self))
+            else:
+                manager.sync(pairs, self)
+        if headers:
+            store_headers(self, created)
 
     def save(self, *args, **kws):
         """Insert/update the object row in the database table.
 
         Automatically fills in / updates derived fields. (See pre_ and
-        post_populate.)
+        post_populate.) Pass ``populate=False`` to skip this, (e.g. where
+        derived data are populated in bulk).
 
         """
-        self.pre_populate()
+        populate = kws.pop('populate', True)
+        if populate:
+            self.pre_populate()
+        # (Headers need only be stored of new content.)
+        headers = self.content_blob_id is None
+        intern_blob(self, 'content_blob', self.content)
+        for field_name in self.DIMENSIONS:
+            intern_dimension(self, '{0}_dimension'.format(field_name),
+                             getattr(self, field_name))
+        created = self.pk is None
         super(ClientRequest, self).save(*args, **kws)
-        self.post_populate()
+        if populate:
+            self.post_populate(created, headers)
+
+
+def value_hash(value):
+    """Return the signed 64-bit hash of the given parameter value."""
+    digest = hashlib.sha1(force_unicode(value).encode('utf-8')).digest()
+    return struct.unpack('>q', digest[:8])[0]
+
+
+class ValueHashField(models.BigIntegerField):
+    """The hash of a parameter's ``value``, (see ``value_hash``), set upon
+    each save, (including bulk creation).
+
+    """
+    def __init__(self, *args, **kws):
+        kws.setdefault('editable', False)
+        super(ValueHashField, self).__init__(*args, **kws)
+
+    def pre_save(self, model_instance, add):
+        value = value_hash(model_instance.value)
+        setattr(model_instance, self.attname, value)
+        return value
 
 
 class ParameterQuerySet(QuerySet):
@@ -147,28 +668,82 @@ class ParameterQuerySet(QuerySet):
     def urlencoded(self):
         return urllib.urlencode(self.values_list('key', 'value'))
 
+    def matching(self, key, value):
+        # (Filtering by value as well guards against hash collisions.)
+        return self.filter(key=key, value_hash=value_hash(value), value=value)
+
 
 class ParameterManager(models.Manager):
 
     def get_query_set(self):
         return ParameterQuerySet(self.model, using=self._db)
 
-    def parse_create(self, unparsed, request=None):
-        parsed = urlparse.parse_qsl(unparsed)
+    def build(self, pairs, request=None):
+        """Return a list of unsaved parameters from the given (key, value)
+        pairs.
+
+        """
+        return [self.model(key=key,
+                           value=value,
+                           position=position,
+                           request=request)
+            for position, (key, value) in enumerate(pairs)]
+
+    def sync(self, pairs, request):
+        """Make the parameters of the given request match the given (key,
+        value) pairs, updating, deleting and (bulk) inserting only those rows
+        which differ.
+
+        """
+        existing = dict((param.position, param)
+                        for param in self.filter(request=request))
+        new = []
+        for (position, (key, value)) in enumerate(pairs):
+            (key, value) = (force_unicode(key), force_unicode(value))
+            try:
+                param = existing.pop(position)
+            except KeyError:
+                new.append(self.model(key=key,
+                                      value=value,
+                                      position=position,
+                                      request=request))
+            else:
+                if (param.key, param.value) != (key, value):
+                    self.filter(pk=param.pk).update(
+                        key=key,
+                        value=value,
+                        value_hash=value_hash(value),
+                        modified=timezone.now(),
+                    )
+        if existing:
+            self.filter(pk__in=[param.pk for param in existing.values()]
+                        ).delete()
+        if new:
+            self.bulk_create(new)
+
+    def create_all(self, pairs, request=None):
         return [self.create(key=key,
                             value=value,
                             position=position,
                             request=request)
-            for position, (key, value) in enumerate(parsed)]
+            for position, (key, value) in enumerate(pairs)]
+
+    def parse_create(self, unparsed, request=None):
+        return self.create_all(urlparse.parse_qsl(unparsed), request)
 
     def urlencoded(self):
         return self.get_query_set().urlencoded()
 
+    def matching(self, key, value):
+        return self.get_query_set().matching(key, value)
+
 
 class RequestParameter(BaseModel):
 
     key = models.CharField(max_length=255)
     value = models.CharField(max_length=255)
+    # Indexed with key, (see sql/) --
+    value_hash = ValueHashField()
     position = models.PositiveIntegerField()
 
     objects = ParameterManager()
@@ -199,64 +774,263 @@ class FormParameter(RequestParameter):
         unique_together = ('request', 'position')
 
 
+class ParameterList(list):
+    """The parameters of a request, decoded from their compact storage,
+    (as unsaved parameter objects).
+
+    """
+    def all(self):
+        return self
+
+    def urlencoded(self):
+        return urllib.urlencode([(param.key, param.value) for param in self])
+
+
+class CompactParameters(object):
+    """Stands in for the related manager of a request's parameters, where
+    these are stored compactly, (such that ``all`` and ``urlencoded``
+    needn't query).
+
+    """
+    def __init__(self, manager, params):
+        self.manager = manager
+        self.params = params
+
+    def all(self):
+        return self.params
+
+    def urlencoded(self):
+        return self.params.urlencoded()
+
+    def get_prefetch_query_set(self, instances):
+        # (Prefetching is left to the related manager, for any instances
+        # whose parameters are stored as rows.)
+        return self.manager.get_prefetch_query_set(instances)
+
+
+class ParametersDescriptor(object):
+    """Wraps the descriptor of a request's related parameters, (e.g.
+    ``query_params``), with their decoding from the named compact field,
+    where set.
+
+    """
+    def __init__(self, related, model, field_name):
+        self.related = related
+        self.model = model
+        self.field_name = field_name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.related
+        manager = self.related.__get__(instance, owner)
+        data = getattr(instance, self.field_name)
+        if data is None:
+            return manager
+        params = ParameterList(
+            self.model(key=key, value=value, position=position,
+                       request=instance)
+            for (position, (key, value)) in enumerate(util.decode_pairs(data))
+        )
+        return CompactParameters(manager, params)
+
+    def __set__(self, instance, value):
+        self.related.__set__(instance, value)
+
+
+ClientRequest.query_params = ParametersDescriptor(
+    ClientRequest.query_params, QueryParameter, 'query_data')
+ClientRequest.form_params = ParametersDescriptor(
+    ClientRequest.form_params, FormParameter, 'form_data')
+
+
+class ServerResponseQuerySet(HeaderQuerySetMixin, QuerySet):
+    pass
+
+
+class ServerResponseManager(models.Manager):
+
+    def get_query_set(self):
+        return ServerResponseQuerySet(self.model, using=self._db)
+
+    def with_header(self, name, value=None):
+        return self.get_query_set().with_header(name, value)
+
+
 class ServerResponse(BaseModel):
 
     request = models.OneToOneField('history.ClientRequest')
     # Server may initiate new session via response:
     session = models.ForeignKey('history.ClientSession',
                                 related_name='responses')
-    content = models.TextField(help_text="The raw, complete response content")
+    content_blob = models.ForeignKey('history.Blob', related_name='+',
+                                     on_delete=models.PROTECT)
+    content = blob_property('content_blob',
+                            "The raw, complete response content")
     # Filled in by save() from content --
     status = models.PositiveIntegerField(db_index=True)
     reason = models.CharField(max_length=100)
-    body = models.TextField()
     location = models.CharField(max_length=255, null=True, db_index=True,
         help_text="The resource to which the client was redirected, if any")
+    headers = models.ManyToManyField('history.Header',
+                                     related_name='responses')
     # Attached asynchronously --
     captured = models.ImageField(
         upload_to='captures', # TODO
         help_text='The path to an image capture of the rendered response',
     )
 
+    objects = ServerResponseManager()
+
     def __unicode__(self):
         return u'{0} {1} {2}'.format(self.request, self.status, self.reason)
 
     def parse(self):
-        """Parse the raw response content and return an httplib response object.
-
-        The response object has the following methods and attributes of note:
+        """Parse the raw response ``content``, and return the resulting
+        ``util.ParsedResponse`` record.
 
-            getheaders(): return a mapping of the response headers
-            read(): read and return the response payload
-            status: the response status code
-            reason: the response status reason
+        The record is cached on the object, and is only rebuilt when
+        ``content`` changes.
 
         """
-        socket = util.FakeSocket(self.content)
-        response = httplib.HTTPResponse(socket)
-        response.begin()
-        return response
+        cached = getattr(self, '_parsed', None)
+        if cached is None or cached[0] != self.content:
+            cached = self._parsed = (self.content,
+                                     util.parse_response(self.content))
+        return cached[1]
 
     def pre_populate(self):
         """Fill in / update field data derived from ``content``, namely:
 
-            ``status``, ``reason``, ``body`` and ``location``
+            ``status``, ``reason`` and ``location``
 
         """
-        response = self.parse()
-        self.status = response.status
-        self.reason = response.reason
-        self.body = response.read()
-        self.location = dict(response.getheaders()).get('Location')
+        parsed = self.parse()
+        self.status = parsed.status
+        self.reason = parsed.reason
+        self.location = parsed.location
+
+    @property
+    def body(self):
+        """The response payload, as derived from ``content``."""
+        return self.parse().body
 
     def save(self, *args, **kws):
         """Insert/update the object row in the database table.
 
-        Automatically fills in / updates derived fields. (See pre_populate.)
+        Automatically fills in / updates derived fields and Headers. (See
+        pre_populate and ``store_headers``.) Pass ``populate=False`` to skip
+        this.
 
         """
-        self.pre_populate()
+        populate = kws.pop('populate', True)
+        if populate:
+            self.pre_populate()
+        # (Headers need only be stored of new content.)
+        headers = self.content_blob_id is None
+        intern_blob(self, 'content_blob', self.content)
+        created = self.pk is None
         super(ServerResponse, self).save(*args, **kws)
+        if populate and headers:
+            store_headers(self, created)
+
+
+class TrafficRollupManager(models.Manager):
+
+    def increment(self, counts, chunk_size=200):
+        """Add the given counts, a mapping of (resolution, period, app_id,
+        host, path, status) to (weighted) number of responses, to their
+        rollups, creating these (in bulk) if need be.
+
+        Each chunk of keys takes one SELECT, an UPDATE per distinct count
+        added to existing rollups, and a bulk INSERT of the missing ones.
+
+        """
+        counts = counts.items()
+        for start in xrange(0, len(counts), chunk_size):
+            chunk = dict(counts[start:start + chunk_size])
+            lookup = dict(
+                ('{0}__in'.format(name), set(key[index] for key in chunk))
+                for (index, name) in enumerate(TrafficRollup.KEY)
+            )
+            missing = dict(chunk)
+            existing = {} # count: [pk, ...]
+            for rollup in self.filter(**lookup):
+                count = missing.pop(rollup.key(), None)
+                if count is not None:
+                    existing.setdefault(count, []).append(rollup.pk)
+            for (count, pks) in existing.items():
+                self.filter(pk__in=pks).update(count=models.F('count') + count)
+
+            savepoint = transaction.savepoint()
+            try:
+                self.bulk_create([
+                    TrafficRollup(count=count, **dict(zip(TrafficRollup.KEY,
+                                                          key)))
+                    for (key, count) in missing.items()
+                ])
+            except IntegrityError:
+                # Some inserted concurrently:
+                transaction.savepoint_rollback(savepoint)
+                for (key, count) in missing.items():
+                    self.increment_one(key, count)
+            else:
+                transaction.savepoint_commit(savepoint)
+
+    def increment_one(self, key, count):
+        lookup = dict(zip(TrafficRollup.KEY, key))
+        if self.filter(**lookup).update(count=models.F('count') + count):
+            return
+        savepoint = transaction.savepoint()
+        try:
+            self.create(count=count, **lookup)
+        except IntegrityError:
+            # Inserted concurrently:
+            transaction.savepoint_rollback(savepoint)
+            self.filter(**lookup).update(count=models.F('count') + count)
+        else:
+            transaction.savepoint_commit(savepoint)
+
+
+class TrafficRollup(BaseModel):
+    """The number of responses of an app's host, path and status, per period
+    of a given resolution, (weighted by the sampling of their requests, see
+    ``ClientRequest.weight``).
+
+    Rollups are additive: minute rollups are maintained as responses are
+    saved, and compacted into hour and then day rollups as they age.
+
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTIONS = (
+        (MINUTE, 'Minute'),
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+    KEY = ('resolution', 'period', 'app_id', 'host', 'path', 'status')
+
+    resolution = models.CharField(choices=RESOLUTIONS, max_length=6)
+    period = models.DateTimeField(help_text="The start of the period")
+    app = models.ForeignKey('history.App', related_name='rollups')
+    host = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    status = models.PositiveIntegerField()
+    count = models.FloatField(default=0)
+
+    objects = TrafficRollupManager()
+
+    class Meta(object):
+        unique_together = ('resolution', 'period', 'app', 'host', 'path',
+                           'status')
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.KEY)
+
+    def __unicode__(self):
+        return u'{0} {1} {2}{3} {4}: {5}'.format(
+            self.resolution, self.period, self.host, self.path, self.status,
+            self.count)
 
 
 # Automatically create an api key for each new User:
@@ -0,0 +1,140 @@
+"""Keyset (cursor) pagination of history resources.
+
+Deep offset pages and the total count of large tables are expensive; rather,
+when the ``cursor`` parameter is given, (empty for the first page), listings
+are ordered by ``(created, id)`` and paged relative to the opaque token of
+the last (or first) object seen:
+
+    /api/clientrequest/?cursor=
+    /api/clientrequest/?cursor=WyJuIiwgIjIwMTMtMDQtMDFUMTI6MDA6MDBaIiwgNDJd
+
+The total count is omitted, though on PostgreSQL, unfiltered listings report
+the table's ``estimated_count`` from the planner's statistics.
+
+"""
+import base64
+import json
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import dateparse
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, obj):
+    payload = json.dumps([direction, obj.created.isoformat(), obj.pk])
+    return base64.urlsafe_b64encode(payload)
+
+
+def decode_cursor(token):
+    """Return the (direction, created, pk) encoded by the given token,
+    raising BadRequest if it is invalid.
+
+    """
+    try:
+        (direction, created, pk) = json.loads(
+            base64.urlsafe_b64decode(token.encode('ascii')))
+        created = dateparse.parse_datetime(created)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        created = None
+    if created is None or direction not in (NEXT, PREVIOUS):
+        raise BadRequest("Invalid cursor '{0}' provided".format(token))
+    return (direction, created, pk)
+
+
+class CursorPaginator(Paginator):
+    """A Paginator which, when the ``cursor`` parameter is given, pages by
+    keyset rather than by offset, (see the module docstring).
+
+    """
+    ordering = ('created', 'pk')
+
+    def get_estimated_count(self):
+        """Return the planner's estimate of the number of objects, where it
+        is readily available, otherwise None.
+
+        """
+        query = getattr(self.objects, 'query', None)
+        if query is None or query.where.children:
+            return None
+        connection = connections[self.objects.db]
+        if connection.vendor != 'postgresql':
+            return None
+        cursor = connection.cursor()
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s",
+                       [self.objects.model._meta.db_table])
+        row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    def get_cursor_slice(self, limit, token):
+        """Return the page of up to ``limit`` objects indicated by the given
+        cursor token, (ascending), along with whether further objects lie
+        beyond it, (in the direction of the cursor).
+
+        """
+        if token:
+            (direction, created, pk) = decode_cursor(token)
+            if direction == NEXT:
+                objects = self.objects.filter(
+                    Q(created__gt=created) | Q(created=created, pk__gt=pk))
+            else:
+                objects = self.objects.filter(
+                    Q(created__lt=created) | Q(created=created, pk__lt=pk))
+        else:
+            (direction, objects) = (NEXT, self.objects)
+
+        if direction == NEXT:
+            objects = objects.order_by(*self.ordering)
+        else:
+            objects = objects.order_by(*('-' + field
+                                         for field in self.ordering))
+
+        page = list(objects[:limit + 1])
+        more = len(page) > limit
+        page = page[:limit]
+        if direction == PREVIOUS:
+            page.reverse()
+        return (page, direction, more)
+
+    def _generate_cursor_uri(self, cursor):
+        if self.resource_uri is None:
+            return None
+        request_params = self.request_data.copy()
+        request_params['cursor'] = cursor
+        return '{0}?{1}'.format(self.resource_uri, request_params.urlencode())
+
+    def page(self):
+        if 'cursor' not in self.request_data:
+            return super(CursorPaginator, self).page()
+        if self.request_data.get('order_by'):
+            raise BadRequest("Cursor pagination does not support order_by")
+        if 'offset' in self.request_data:
+            raise BadRequest("Cursor pagination does not support offset")
+
+        limit = self.get_limit() or self.max_limit or 1000
+        token = self.request_data['cursor']
+        (objects, direction, more) = self.get_cursor_slice(limit, token)
+
+        meta = {'limit': limit, 'previous': None, 'next': None}
+        if objects:
+            if more or direction == PREVIOUS:
+                meta['next'] = self._generate_cursor_uri(
+                    encode_cursor(NEXT, objects[-1]))
+            if token and (more or direction == NEXT):
+                meta['previous'] = self._generate_cursor_uri(
+                    encode_cursor(PREVIOUS, objects[0]))
+
+        estimated_count = self.get_estimated_count()
+        if estimated_count is not None:
+            meta['estimated_count'] = estimated_count
+
+        return {
+            self.collection_name: objects,
+            'meta': meta,
+        }
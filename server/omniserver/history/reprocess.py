@@ -0,0 +1,217 @@
+"""Reprocessing of stored requests and responses: the recomputation of the
+fields, parameters and headers derived from their content, (e.g. after a
+change to parsing, or the addition of derived fields).
+
+Rows are read in chunks of ascending pk, and their (compressed) content is
+handed to ``process_chunk``, which decompresses and parses it, (and which
+makes no queries, and so may be run by a pool of worker processes). The
+results of each chunk are then written back in bulk, in one transaction,
+after which progress may be checkpointed, (see ``Checkpoint``).
+
+"""
+import json
+import os
+import zlib
+
+from django.db import connections
+from django.db.models import sql
+from django.utils import timezone
+
+from history import cache, models as history
+
+
+KINDS = ('requests', 'responses')
+
+# The derived fields of each kind written back, (Dimensions by their pks) --
+REQUEST_FIELDS = (('method', 'protocol', 'query_data', 'form_data') +
+                  history.ClientRequest.DIMENSIONS)
+RESPONSE_FIELDS = ('status', 'reason', 'location')
+
+
+class Checkpoint(object):
+    """The last pk reprocessed of each kind, recorded durably in the JSON
+    file at the given path.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as file_:
+                self.positions = json.load(file_)
+        except IOError:
+            self.positions = {}
+
+    def get(self, kind):
+        return self.positions.get(kind, 0)
+
+    def commit(self, kind, pk):
+        self.positions[kind] = pk
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file_:
+            json.dump(self.positions, file_)
+            file_.flush()
+            os.fsync(file_.fileno())
+        os.rename(temp_path, self.path)
+
+    def clear(self):
+        self.positions = {}
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def iter_chunks(kind, chunk_size, after=0):
+    """Generate the chunks of rows to reprocess of the given kind, each a
+    pair (kind, list of rows), where rows are tuples of the pk, (the
+    ``full_url`` of requests), and the compressed data of the content Blob.
+
+    """
+    if kind == 'requests':
+        objects = history.ClientRequest.objects.values_list(
+            'pk', 'full_url', 'content_blob')
+    else:
+        objects = history.ServerResponse.objects.values_list(
+            'pk', 'content_blob')
+    objects = objects.order_by('pk')
+    while True:
+        rows = list(objects.filter(pk__gt=after)[:chunk_size])
+        if not rows:
+            return
+        blobs = dict(history.Blob.objects.filter(
+            digest__in=set(row[-1] for row in rows)).values_list('digest',
+                                                                 'data'))
+        yield (kind, [row[:-1] + (blobs[row[-1]],) for row in rows])
+        after = rows[-1][0]
+
+
+def _decompress(data):
+    return history.Blob(data=data).decompress()
+
+
+def process_chunk(chunk):
+    """Parse the content of the given chunk of rows, (see ``iter_chunks``),
+    and return the tuple (kind, last pk, list of the derived data of each
+    row), the data being ``{'pk': pk, 'error': message}`` for rows whose
+    content is invalid, or whose Blob is corrupt.
+
+    """
+    (kind, rows) = chunk
+    results = []
+    for row in rows:
+        try:
+            if kind == 'requests':
+                (pk, full_url, data) = row
+                obj = history.ClientRequest(pk=pk, full_url=full_url,
+                                            content=_decompress(data))
+                obj.pre_populate()
+                results.append({
+                    'pk': pk,
+                    'fields': dict((name, getattr(obj, name))
+                                   for name in REQUEST_FIELDS),
+                    'params': [(manager.model, pairs)
+                               for (manager, pairs) in obj.parameter_rows()],
+                    'headers': history.stored_headers(obj.parse()),
+                })
+            else:
+                (pk, data) = row
+                obj = history.ServerResponse(pk=pk, content=_decompress(data))
+                obj.pre_populate()
+                results.append({
+                    'pk': pk,
+                    'fields': dict((name, getattr(obj, name))
+                                   for name in RESPONSE_FIELDS),
+                    'headers': history.stored_headers(obj.parse()),
+                })
+        except (TypeError, ValueError, zlib.error) as exc:
+            # (TypeError and zlib.error are raised for corrupt Blobs.)
+            results.append({'pk': row[0], 'error': str(exc)})
+    return (kind, rows[-1][0], results)
+
+
+def _bulk_update(model, columns, rows, using):
+    """Update the given columns of the rows of the given model, from the
+    given tuples of their values, followed by the pk.
+
+    """
+    qn = connections[using].ops.quote_name
+    statement = 'UPDATE {0} SET {1} WHERE {2} = %s'.format(
+        qn(model._meta.db_table),
+        ', '.join('{0} = %s'.format(qn(column)) for column in columns),
+        qn(model._meta.pk.column),
+    )
+    connections[using].cursor().executemany(statement, rows)
+
+
+def _bulk_delete(model, field_name, values, using):
+    """Delete the rows of the given model whose named field has any of the
+    given values, (without first collecting them, as ``delete`` would).
+
+    """
+    sql.DeleteQuery(model).delete_batch(values, using,
+                                        model._meta.get_field(field_name))
+
+
+def store_chunk(kind, results, using='default'):
+    """Write back the given results of ``process_chunk``, (in the current
+    transaction), and return the number of rows updated.
+
+    """
+    results = [result for result in results if 'error' not in result]
+    if not results:
+        return 0
+    model = (history.ClientRequest if kind == 'requests'
+             else history.ServerResponse)
+    pks = [result['pk'] for result in results]
+    now = connections[using].ops.value_to_db_datetime(timezone.now())
+
+    if kind == 'requests':
+        columns = ['method', 'protocol', 'query_data', 'form_data']
+        for field_name in model.DIMENSIONS:
+            field = model._meta.get_field('{0}_dimension'.format(field_name))
+            ids = cache.get_dimension_ids(
+                field.rel.to,
+                set(result['fields'][field_name] for result in results),
+            )
+            for result in results:
+                result['fields'][field.attname] = ids[
+                    result['fields'][field_name]]
+            columns.append(field.attname)
+    else:
+        columns = list(RESPONSE_FIELDS)
+    _bulk_update(model, columns + ['modified'], [
+        tuple(result['fields'][column] for column in columns) +
+        (now, result['pk'])
+        for result in results
+    ], using)
+
+    # Parameters and header links are replaced wholesale:
+    if kind == 'requests':
+        params = dict((param_model, []) for (param_model, _pairs)
+                      in results[0]['params'])
+        for result in results:
+            for (param_model, pairs) in result['params']:
+                params[param_model].extend(
+                    param_model(key=key, value=value, position=position,
+                                request_id=result['pk'])
+                    for (position, (key, value)) in enumerate(pairs)
+                )
+        for (param_model, objs) in params.items():
+            _bulk_delete(param_model, 'request', pks, using)
+            param_model.objects.using(using).bulk_create(objs)
+
+    header_ids = cache.get_dimension_ids(
+        history.Header,
+        set(header for result in results for header in result['headers']),
+    )
+    field = model._meta.get_field('headers')
+    _bulk_delete(field.rel.through, field.m2m_field_name(), pks, using)
+    links = []
+    for result in results:
+        links.extend(history.header_links(
+            model(pk=result['pk']),
+            [header_ids[header] for header in result['headers']],
+        ))
+    field.rel.through.objects.using(using).bulk_create(links)
+
+    return len(results)
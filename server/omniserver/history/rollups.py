@@ -0,0 +1,106 @@
+"""Traffic rollups: counts of responses per app, host, path and status,
+(weighted by the sampling of their requests, such that they estimate the
+whole of the traffic).
+
+Minute rollups are incremented as ServerResponses are saved, (by model
+signals within this process, or in bulk by ingestion), and compacted into
+hour and then day rollups by the ``compact_rollups`` command, such that the
+cost of reading them is independent of the volume of raw history.
+
+"""
+import collections
+import datetime
+
+from django.db import transaction
+from django.db.models import signals
+from django.utils import timezone
+
+from history import models as history
+from history.conf import settings
+
+
+TIERS = (
+    # (resolution, compacted into, after seconds setting)
+    (history.TrafficRollup.MINUTE, history.TrafficRollup.HOUR,
+     'ROLLUP_MINUTE_RETENTION'),
+    (history.TrafficRollup.HOUR, history.TrafficRollup.DAY,
+     'ROLLUP_HOUR_RETENTION'),
+)
+
+
+def truncate(moment, resolution):
+    """Return the start of the period of the given resolution containing the
+    given datetime, (in UTC, if aware).
+
+    """
+    if timezone.is_aware(moment):
+        moment = moment.astimezone(timezone.utc)
+    moment = moment.replace(second=0, microsecond=0)
+    if resolution in (history.TrafficRollup.HOUR, history.TrafficRollup.DAY):
+        moment = moment.replace(minute=0)
+    if resolution == history.TrafficRollup.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def record(responses):
+    """Count the given saved ServerResponses, (by the weights of their
+    requests), in their minute rollups.
+
+    """
+    counts = collections.Counter()
+    for response in responses:
+        request = response.request
+        period = truncate(response.created or timezone.now(),
+                          history.TrafficRollup.MINUTE)
+        counts[(history.TrafficRollup.MINUTE, period, response.session.app_id,
+                 request.host, request.path, response.status)] += request.weight
+    history.TrafficRollup.objects.increment(counts)
+
+
+@transaction.commit_on_success
+def compact(resolution, into, before):
+    """Merge the rollups of the given resolution whose periods precede
+    ``before`` into those of the coarser resolution ``into``.
+
+    Returns the number of rollups merged.
+
+    """
+    rollups = history.TrafficRollup.objects.filter(resolution=resolution,
+                                                   period__lt=before)
+    counts = collections.Counter()
+    pks = []
+    for rollup in rollups.iterator():
+        counts[(into, truncate(rollup.period, into), rollup.app_id,
+                rollup.host, rollup.path, rollup.status)] += rollup.count
+        pks.append(rollup.pk)
+    history.TrafficRollup.objects.increment(counts)
+    for start in xrange(0, len(pks), 500):
+        history.TrafficRollup.objects.filter(pk__in=pks[start:start + 500]
+                                             ).delete()
+    return len(pks)
+
+
+def compact_all(now=None):
+    """Compact all rollups older than their tier's retention setting.
+
+    Returns a list of (resolution, number compacted) pairs.
+
+    """
+    now = now or timezone.now()
+    results = []
+    for (resolution, into, retention_setting) in TIERS:
+        retention = datetime.timedelta(
+            seconds=getattr(settings, retention_setting))
+        # Compact whole periods of the coarser resolution only:
+        before = truncate(now - retention, into)
+        results.append((resolution, compact(resolution, into, before)))
+    return results
+
+
+def _response_saved(sender, instance, created, raw=False, **_kws):
+    if created and not raw:
+        record([instance])
+
+
+signals.post_save.connect(_response_saved, sender=history.ServerResponse)
@@ -0,0 +1,327 @@
+"""Full-text search of captured traffic.
+
+Each ClientRequest is indexed as a document of its URL, its request head
+and body, and its response head and body, (textual bodies only, and those
+truncated to ``SEARCH_MAX_BODY`` bytes). Documents are kept up to date by
+model signals within this process; bulk ingestion indexes its batches
+itself, (see ``suspended``).
+
+The backend is configurable by ``HISTORY_SEARCH_BACKEND``, (a dotted path);
+by default, SQLite databases use an FTS5 index, and PostgreSQL databases a
+GIN-indexed tsvector column. Other databases require the setting, (which
+may select the unindexed ``SearchBackend``, matching URLs only).
+
+"""
+import contextlib
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import signals
+from django.utils import importlib
+from django.utils.datastructures import SortedDict
+
+from history import models as history, util
+from history.conf import settings
+
+
+TEXTUAL_TYPES = ('text/', 'json', 'xml', 'javascript', 'x-www-form-urlencoded')
+
+
+def _text(value):
+    if isinstance(value, unicode):
+        return value
+    return value.decode('utf-8', 'replace')
+
+
+def _message_text(start_line, parsed):
+    lines = [start_line]
+    lines.extend(u'{0}: {1}'.format(_text(name), _text(value))
+                 for (name, value) in parsed.headers)
+    content_type = parsed.header('Content-Type', 'text/plain').lower()
+    if any(textual in content_type for textual in TEXTUAL_TYPES):
+        lines.append(u'')
+        lines.append(_text(parsed.body[:settings.SEARCH_MAX_BODY]))
+    return u'\n'.join(lines)
+
+
+def document(request, response=None):
+    """Return the (url, request, response) texts by which the given
+    ClientRequest, (and its ServerResponse), are indexed.
+
+    """
+    parsed = request.parse()
+    request_text = _message_text(
+        u' '.join(_text(word) for word in (parsed.method, parsed.target,
+                                           parsed.version)),
+        parsed,
+    )
+    if response is None:
+        response_text = u''
+    else:
+        parsed = response.parse()
+        response_text = _message_text(
+            u'{0} {1} {2}'.format(_text(parsed.version), parsed.status,
+                                  _text(parsed.reason)),
+            parsed,
+        )
+    return (request.full_url, request_text, response_text)
+
+
+class SearchBackend(object):
+    """The fallback backend, which maintains no index, and matches search
+    terms against request URLs only.
+
+    """
+    ranked = False
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def execute(self, sql, params=()):
+        cursor = connections[self.alias].cursor()
+        cursor.execute(sql, params)
+        transaction.commit_unless_managed(using=self.alias)
+        return cursor
+
+    def install(self):
+        """Create the index, if need be."""
+        pass
+
+    def index(self, pairs):
+        """Index the given (ClientRequest, ServerResponse or None) pairs."""
+        pass
+
+    def remove(self, pks):
+        """Remove the ClientRequests of the given pks from the index."""
+        pass
+
+    def search(self, queryset, query):
+        """Filter the given ClientRequest queryset by the given query, (of
+        whitespace-separated terms, all of which must match).
+
+        """
+        for term in query.split():
+            queryset = queryset.filter(full_url__icontains=term)
+        return queryset
+
+
+class SqliteSearchBackend(SearchBackend):
+    """Indexes documents in an SQLite FTS5 virtual table.
+
+    Search results are ordered by rank, and annotated with a
+    ``search_snippet`` of the text matched.
+
+    """
+    ranked = True
+    table = 'history_search'
+
+    def install(self):
+        self.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+                     "url, request, response)".format(self.table))
+
+    def index(self, pairs):
+        rows = [(request.pk,) + document(request, response)
+                for (request, response) in pairs]
+        if rows:
+            cursor = connections[self.alias].cursor()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO {0} (rowid, url, request, response) "
+                "VALUES (%s, %s, %s, %s)".format(self.table),
+                rows,
+            )
+            transaction.commit_unless_managed(using=self.alias)
+
+    def remove(self, pks):
+        for pk in pks:
+            self.execute("DELETE FROM {0} WHERE rowid = %s".format(self.table),
+                         [pk])
+
+    @staticmethod
+    def match_expression(query):
+        # Match each term as a phrase, such that no input is interpreted as
+        # (invalid) FTS5 syntax:
+        return u' '.join(u'"{0}"'.format(term.replace(u'"', u'""'))
+                         for term in query.split())
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.extra(
+            tables=[self.table],
+            where=['{0}.rowid = {1}.id'.format(self.table,
+                                               queryset.model._meta.db_table),
+                   '{0} MATCH %s'.format(self.table)],
+            params=[expression],
+            select={
+                'search_rank': 'bm25({0})'.format(self.table),
+                'search_snippet': ("snippet({0}, -1, '<mark>', '</mark>', "
+                                   "'...', 16)".format(self.table)),
+            },
+            order_by=['search_rank'],
+        )
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Indexes documents in a table of tsvectors, under a GIN index.
+
+    Documents are parsed by the "simple" text search configuration, (which
+    neither stems words nor drops stop words, as suits URLs and headers).
+    Search results are ordered by rank, and annotated with a
+    ``search_snippet`` of the text matched.
+
+    """
+    ranked = True
+    table = 'history_search'
+    config = 'simple'
+
+    def install(self):
+        self.execute("CREATE TABLE IF NOT EXISTS {0} ("
+                     "request_id integer PRIMARY KEY, url text NOT NULL, "
+                     "request text NOT NULL, response text NOT NULL, "
+                     "document tsvector NOT NULL)".format(self.table))
+        self.execute("CREATE INDEX IF NOT EXISTS {0}_document ON {0} "
+                     "USING gin (document)".format(self.table))
+
+    def index(self, pairs):
+        rows = [(request.pk,) + document(request, response)
+                for (request, response) in pairs]
+        if rows:
+            cursor = connections[self.alias].cursor()
+            cursor.execute(
+                "DELETE FROM {0} WHERE request_id IN ({1})".format(
+                    self.table, ', '.join(['%s'] * len(rows))),
+                [row[0] for row in rows],
+            )
+            cursor.executemany(
+                "INSERT INTO {0} (request_id, url, request, response, "
+                "document) VALUES (%s, %s, %s, %s, to_tsvector(%s::regconfig, "
+                "%s))".format(self.table),
+                [row + (self.config, u'\n'.join(row[1:])) for row in rows],
+            )
+            transaction.commit_unless_managed(using=self.alias)
+
+    def remove(self, pks):
+        if pks:
+            self.execute(
+                "DELETE FROM {0} WHERE request_id IN ({1})".format(
+                    self.table, ', '.join(['%s'] * len(pks))),
+                list(pks),
+            )
+
+    def search(self, queryset, query):
+        # (plainto_tsquery matches all terms, and interprets no input as
+        # tsquery syntax.)
+        if not query.split():
+            return queryset.none()
+        tsquery = 'plainto_tsquery(%s::regconfig, %s)'
+        return queryset.extra(
+            tables=[self.table],
+            where=['{0}.request_id = {1}.id'.format(
+                       self.table, queryset.model._meta.db_table),
+                   '{0}.document @@ {1}'.format(self.table, tsquery)],
+            params=[self.config, query],
+            select=SortedDict([
+                ('search_rank', 'ts_rank({0}.document, {1})'.format(
+                    self.table, tsquery)),
+                ('search_snippet', (
+                    "ts_headline(%s::regconfig, {0}.url || E'\\n' || "
+                    "{0}.request || E'\\n' || {0}.response, {1}, "
+                    "'StartSel=<mark>, StopSel=</mark>, MaxWords=16')"
+                ).format(self.table, tsquery)),
+            ]),
+            select_params=[self.config, query,
+                           self.config, self.config, query],
+            order_by=['-search_rank'],
+        )
+
+
+# The default backends, by database vendor:
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(alias='default'):
+    """Return the search backend configured for the given database, raising
+    ImproperlyConfigured if there is none.
+
+    """
+    path = settings.SEARCH_BACKEND
+    if path is None:
+        vendor = connections[alias].vendor
+        try:
+            return BACKENDS[vendor](alias)
+        except KeyError:
+            raise ImproperlyConfigured(
+                "No full-text search backend for {0} databases: set "
+                "HISTORY_SEARCH_BACKEND".format(vendor))
+    (module_name, class_name) = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)(alias)
+
+
+def search(queryset, query):
+    return get_backend(queryset.db).search(queryset, query)
+
+
+def response_of(request):
+    try:
+        return request.serverresponse
+    except history.ServerResponse.DoesNotExist:
+        return None
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def suspended():
+    """Suspend indexing by model signals within this thread, (for callers
+    which index their changes themselves).
+
+    """
+    previous = getattr(_local, 'suspended', False)
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def _request_saved(sender, instance, created, using, raw=False, **_kws):
+    if raw or getattr(_local, 'suspended', False):
+        return
+    response = None if created else response_of(instance)
+    try:
+        get_backend(using).index([(instance, response)])
+    except util.ParseError:
+        pass
+
+
+def _response_saved(sender, instance, using, raw=False, **_kws):
+    if raw or getattr(_local, 'suspended', False):
+        return
+    try:
+        get_backend(using).index([(instance.request, instance)])
+    except util.ParseError:
+        pass
+
+
+def _request_deleted(sender, instance, using, **_kws):
+    get_backend(using).remove([instance.pk])
+
+
+def _response_deleted(sender, instance, using, **_kws):
+    try:
+        request = instance.request
+    except history.ClientRequest.DoesNotExist:
+        return
+    _request_saved(history.ClientRequest, request, False, using)
+
+
+signals.post_save.connect(_request_saved, sender=history.ClientRequest)
+signals.post_save.connect(_response_saved, sender=history.ServerResponse)
+signals.post_delete.connect(_request_deleted, sender=history.ClientRequest)
+signals.post_delete.connect(_response_deleted, sender=history.ServerResponse)
@@ -0,0 +1,2 @@
+CREATE TABLE IF NOT EXISTS history_search (request_id integer PRIMARY KEY, url text NOT NULL, request text NOT NULL, response text NOT NULL, document tsvector NOT NULL);
+CREATE INDEX IF NOT EXISTS history_search_document ON history_search USING gin (document);
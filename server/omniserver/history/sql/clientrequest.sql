@@ -0,0 +1 @@
+CREATE INDEX history_clientrequest_created_id ON history_clientrequest (created, id);
@@ -0,0 +1 @@
+CREATE VIRTUAL TABLE IF NOT EXISTS history_search USING fts5(url, request, response);
@@ -0,0 +1 @@
+CREATE INDEX history_clientsession_created_id ON history_clientsession (created, id);
@@ -0,0 +1 @@
+CREATE INDEX history_formparameter_key_value_hash ON history_formparameter (key, value_hash, request_id);
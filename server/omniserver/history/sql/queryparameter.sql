@@ -0,0 +1 @@
+CREATE INDEX history_queryparameter_key_value_hash ON history_queryparameter (key, value_hash, request_id);
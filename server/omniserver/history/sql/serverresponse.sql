@@ -0,0 +1 @@
+CREATE INDEX history_serverresponse_created_id ON history_serverresponse (created, id);
@@ -0,0 +1 @@
+CREATE INDEX history_trafficrollup_app_period ON history_trafficrollup (app_id, resolution, period);
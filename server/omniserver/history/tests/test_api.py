@@ -1,17 +1,33 @@
 import json
+import shutil
+import tempfile
 import textwrap
 
 from django.contrib.auth import models as auth
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone, unittest
 from tastypie.test import ResourceTestCase
 
-from history import models as history
+from history import authentication, cache, ingest, models as history, wire
+
+try:
+    from omniclient.django.middleware import OmnispectiveMiddleware
+except ImportError:
+    # (The client is installed separately.)
+    OmnispectiveMiddleware = None
 
 
 class ApiTestCase(ResourceTestCase):
 
     def setUp(self):
         super(ApiTestCase, self).setUp()
+        cache.clear()
+        authentication.credentials.clear()
         self.user = auth.User.objects.create(username='client')
         self.apikey_credentials = self.create_apikey(self.user.username,
                                                      self.user.api_key.key)
@@ -246,6 +262,33 @@ class TestClientRequestApi(ApiTestCase):
         self.assertEqual(client_request.session.key, '01234ABCD')
         self.assertEqual(client_request.session.app, self.app)
 
+    def test_post_request_existing_session(self):
+        ''' Test asserting that requests may be added to an existing session,
+        which is resolved from the cache
+        '''
+        data = {
+            'content': self.get_mypath,
+            'full_url': 'https://example.com/mypath/?key=value',
+            'remote_addr': '0.0.0.0',
+            'session': {
+                'key': '01234ABCD',
+                'app': self.app.code,
+            },
+        }
+        for _count in range(3):
+            response = self.api_client.post(
+                self.base_url,
+                format='json',
+                data=data,
+                authentication=self.apikey_credentials,
+            )
+            self.assertHttpCreated(response)
+
+        self.assertEqual(history.ClientRequest.objects.count(), 3)
+        session = history.ClientSession.objects.get()
+        self.assertEqual(session.requests.count(), 3)
+        self.assertTrue(cache.sessions.hits >= 1)
+
     def test_invalid_app_name(self):
         ''' Test asserting that a proper app name must be provided when
         submitting a client's request to the ClientRequest API endpoint
@@ -267,3 +310,677 @@ class TestClientRequestApi(ApiTestCase):
         content = json.loads(response.content)
         self.assertHttpBadRequest(response)
         self.assertEqual(content['error'], 'App code missing or invalid')
+
+    def test_invalid_weight(self):
+        ''' Test asserting that the sampling weight of a request must be a
+        positive, finite number
+        '''
+        for weight in (-1, 0, 'Infinity'):
+            response = self.api_client.post(
+                self.base_url,
+                format='json',
+                data={
+                    'content': self.get_mypath,
+                    'full_url': 'https://example.com/mypath/?key=value',
+                    'remote_addr': '0.0.0.0',
+                    'session': {'key': '01234ABCD', 'app': self.app.code},
+                    'weight': float(weight),
+                },
+                authentication=self.apikey_credentials,
+            )
+            self.assertHttpBadRequest(response)
+        self.assertEqual(history.ClientRequest.objects.count(), 0)
+
+
+class TestClientRequestBatchApi(ApiTestCase):
+
+    def setUp(self):
+        super(TestClientRequestBatchApi, self).setUp()
+        self.batch_url = reverse('api_dispatch_batch',
+                                 kwargs={'resource_name': 'clientrequest'})
+        self.post_mypath = textwrap.dedent('''\
+            POST /mypath/?get=query HTTP/1.0
+            User-Agent: Test/0.1
+
+            the=pay-load&such=%26such
+            ''')
+        self.ok_mypath = textwrap.dedent('''\
+            HTTP/1.0 302 Found
+            Location: /otherpath/
+            Content-Length: 5
+
+            hello''')
+        for codename in ('add_clientrequest', 'add_clientsession'):
+            self.user.user_permissions.add(auth.Permission.objects.get(
+                content_type__app_label='history',
+                codename=codename,
+            ))
+
+    def make_item(self, session_key='01234ABCD', app=None):
+        return {
+            'content': self.post_mypath,
+            'full_url': 'http://example.com/mypath/?get=query',
+            'remote_addr': '192.0.1.2',
+            'session': {
+                'key': session_key,
+                'app': app or self.app.code,
+            },
+            'response': {'content': self.ok_mypath},
+        }
+
+    def test_post_batch_unauthorized(self):
+        ''' Test asserting that we block unauthorized users from posting a
+        batch of ClientRequests
+        '''
+        response = self.api_client.post(
+            self.batch_url,
+            format='json',
+            data={'objects': [self.make_item()]},
+        )
+        self.assertHttpUnauthorized(response)
+        self.assertEqual(history.ClientRequest.objects.count(), 0)
+
+    def test_post_batch_json(self):
+        ''' Testing the ability to create many ClientRequest and
+        ServerResponse objects via a single post to the batch endpoint
+        '''
+        response = self.api_client.post(
+            self.batch_url,
+            format='json',
+            data={'objects': [
+                self.make_item(),
+                self.make_item(session_key='56789EFGH'),
+                self.make_item(),
+            ]},
+            authentication=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created'] * 3)
+
+        self.assertEqual(history.ClientRequest.objects.count(), 3)
+        self.assertEqual(history.ClientSession.objects.count(), 2)
+        self.assertEqual(history.ServerResponse.objects.count(), 3)
+
+        client_request = history.ClientRequest.objects.latest()
+        self.assertEqual(client_request.method, 'POST')
+        self.assertEqual(client_request.host, 'example.com')
+        self.assertEqual(client_request.query_params.urlencoded(), 'get=query')
+        self.assertEqual(
+            list(client_request.form_params.values_list('key', 'value')),
+            [('the', 'pay-load'), ('such', '&such')]
+        )
+        self.assertEqual(client_request.serverresponse.status, 302)
+        self.assertEqual(client_request.serverresponse.location, '/otherpath/')
+        self.assertEqual(client_request.serverresponse.body, 'hello')
+        self.assertEqual(client_request.serverresponse.session,
+                         client_request.session)
+
+    def test_post_batch_frames(self):
+        ''' Test asserting that batches may be posted in the compact frames
+        format, and that unsupported formats are reported as such
+        '''
+        response = self.client.post(
+            self.batch_url,
+            data=wire.encode([self.make_item(), self.make_item()]),
+            content_type=wire.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created'] * 2)
+        client_request = history.ClientRequest.objects.latest()
+        self.assertEqual(client_request.content, self.post_mypath)
+        self.assertEqual(client_request.serverresponse.body, 'hello')
+
+        response = self.client.post(
+            self.batch_url,
+            data='bogus',
+            content_type=wire.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=self.apikey_credentials,
+        )
+        self.assertHttpBadRequest(response)
+
+        response = self.client.post(
+            self.batch_url,
+            data='bogus',
+            content_type='application/x-bogus',
+            HTTP_AUTHORIZATION=self.apikey_credentials,
+        )
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(history.ClientRequest.objects.count(), 2)
+
+        # The frames format is accepted of batches only:
+        response = self.client.post(
+            reverse('api_dispatch_list',
+                    kwargs={'resource_name': 'clientrequest'}),
+            data=wire.encode([self.make_item()]),
+            content_type=wire.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=self.apikey_credentials,
+        )
+        self.assertEqual(response.status_code, 415)
+        with override_settings(HISTORY_INGEST_ASYNC=True):
+            response = self.client.post(
+                reverse('api_dispatch_list',
+                        kwargs={'resource_name': 'clientrequest'}),
+                data=wire.encode([self.make_item()]),
+                content_type=wire.CONTENT_TYPE,
+                HTTP_AUTHORIZATION=self.apikey_credentials,
+            )
+        self.assertEqual(response.status_code, 415)
+        self.assertEqual(history.ClientRequest.objects.count(), 2)
+
+    @unittest.skipIf(OmnispectiveMiddleware is None,
+                     "Missing dependency 'omniclient'")
+    @override_settings(OMNISPECTIVE_APP='myapp')
+    def test_post_batch_client_item(self):
+        ''' Test asserting that the batch items captured by the client
+        middleware are accepted
+        '''
+        request = RequestFactory().post(
+            '/mypath/?get=query',
+            'the=pay-load',
+            content_type='application/x-www-form-urlencoded',
+            HTTP_COOKIE='sessionid=01234ABCD',
+        )
+        item = OmnispectiveMiddleware.batch_item(
+            request, HttpResponse('hello\xff', status=404))
+        response = self.client.post(
+            self.batch_url,
+            data=wire.encode([item]),
+            content_type=wire.CONTENT_TYPE,
+            HTTP_AUTHORIZATION=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created'])
+
+        client_request = history.ClientRequest.objects.get()
+        self.assertEqual(client_request.method, 'POST')
+        self.assertEqual(client_request.full_url,
+                         'http://testserver/mypath/?get=query')
+        self.assertEqual(client_request.session.key, '01234ABCD')
+        self.assertEqual(
+            list(client_request.form_params.values_list('key', 'value')),
+            [('the', 'pay-load')]
+        )
+        self.assertEqual(client_request.serverresponse.status, 404)
+        self.assertEqual(client_request.serverresponse.body, 'hello\xff')
+
+    def test_post_batch_partial_failure(self):
+        ''' Test asserting that invalid items in a batch are reported without
+        preventing the storage of valid items
+        '''
+        invalid = self.make_item()
+        del invalid['full_url']
+        response = self.api_client.post(
+            self.batch_url,
+            format='json',
+            data={'objects': [
+                invalid,
+                self.make_item(),
+                self.make_item(app='bogus'),
+            ]},
+            authentication=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['error', 'created', 'error'])
+        self.assertEqual(results[2]['error'], 'App code missing or invalid')
+        self.assertEqual(history.ClientRequest.objects.count(), 1)
+
+    def test_post_batch_concurrent_session(self):
+        ''' Test asserting that a session created concurrently with that of
+        a batch is used by the batch
+        '''
+        objects = history.ClientSession.objects
+        def create(**kwargs):
+            # (Another batch creates the session first.)
+            history.ClientSession(**kwargs).save()
+            return type(objects).create(objects, **kwargs)
+        objects.create = create
+        try:
+            response = self.api_client.post(
+                self.batch_url,
+                format='json',
+                data={'objects': [self.make_item()]},
+                authentication=self.apikey_credentials,
+            )
+        finally:
+            del objects.create
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created'])
+        session = history.ClientSession.objects.get()
+        self.assertEqual(history.ClientRequest.objects.get().session, session)
+
+    def test_post_batch_invalid_response(self):
+        ''' Test asserting that an item whose response fails validation is
+        reported, without failing the rest of the batch
+        '''
+        invalid = self.make_item()
+        invalid['response'] = {
+            'content': 'HTTP/1.0 200 {0}\r\n\r\n'.format('O' * 101)}
+        response = self.api_client.post(
+            self.batch_url,
+            format='json',
+            data={'objects': [self.make_item(), invalid, self.make_item()]},
+            authentication=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'error', 'created'])
+        self.assertTrue(results[1]['error'].startswith(
+            'Invalid server response: reason:'))
+        self.assertEqual(history.ServerResponse.objects.count(), 2)
+
+    @unittest.skipUnless(connection.features.uses_savepoints,
+                         "Database does not support savepoints")
+    def test_post_batch_unstorable_response(self):
+        ''' Test asserting that an item whose response cannot be stored
+        is reported, without failing the rest of the batch
+        '''
+        unstorable = self.make_item(session_key='56789EFGH')
+        unstorable['response'] = {'content': 'HTTP/1.0 500 Oops\r\n\r\n'}
+        objects = history.ServerResponse.objects
+        def bulk_create(responses):
+            if any(response.status == 500 for response in responses):
+                raise DatabaseError("Unstorable")
+            return type(objects).bulk_create(objects, responses)
+        objects.bulk_create = bulk_create
+        try:
+            response = self.api_client.post(
+                self.batch_url,
+                format='json',
+                data={'objects': [self.make_item(), unstorable,
+                                  self.make_item()]},
+                authentication=self.apikey_credentials,
+            )
+        finally:
+            del objects.bulk_create
+        self.assertValidJSONResponse(response)
+        results = json.loads(response.content)['objects']
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'error', 'created'])
+        self.assertEqual(results[1]['error'], 'Unstorable')
+        self.assertEqual(history.ClientRequest.objects.count(), 2)
+        self.assertEqual(history.ServerResponse.objects.count(), 2)
+
+
+class TestAsyncIngestApi(ApiTestCase):
+
+    def setUp(self):
+        super(TestAsyncIngestApi, self).setUp()
+        self.log_dir = tempfile.mkdtemp()
+        self.settings = override_settings(HISTORY_INGEST_ASYNC=True,
+                                          HISTORY_INGEST_LOG_DIR=self.log_dir)
+        self.settings.enable()
+        self.base_url = reverse('api_dispatch_list',
+                                kwargs={'resource_name': 'clientrequest'})
+        self.user.user_permissions.add(auth.Permission.objects.get(
+            content_type__app_label='history',
+            codename='add_clientrequest',
+        ))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.log_dir)
+        super(TestAsyncIngestApi, self).tearDown()
+
+    def test_post_request_accepted(self):
+        ''' Test asserting that, in asynchronous mode, posted requests are
+        accepted, and stored only once materialized
+        '''
+        response = self.api_client.post(
+            self.base_url,
+            format='json',
+            data={
+                'content': 'GET /mypath/?key=value HTTP/1.0\n',
+                'full_url': 'https://example.com/mypath/?key=value',
+                'remote_addr': '0.0.0.0',
+                'session': {
+                    'key': '01234ABCD',
+                    'app': self.app.code,
+                },
+            },
+            authentication=self.apikey_credentials,
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(history.ClientRequest.objects.count(), 0)
+        received = timezone.now()
+
+        call_command('materialize_history', once=True)
+        client_request = history.ClientRequest.objects.get()
+        self.assertEqual(client_request.path, '/mypath/')
+        self.assertEqual(client_request.query_params.urlencoded(), 'key=value')
+        # Requests are dated by their receipt, not their materialization:
+        self.assertTrue(client_request.created <= received)
+
+        # Items are consumed only once:
+        call_command('materialize_history', once=True)
+        self.assertEqual(history.ClientRequest.objects.count(), 1)
+
+    def test_post_request_invalid(self):
+        ''' Test asserting that, in asynchronous mode, posted requests are
+        validated
+        '''
+        response = self.api_client.post(
+            self.base_url,
+            format='json',
+            data={'content': 'GET /mypath/ HTTP/1.0\n'},
+            authentication=self.apikey_credentials,
+        )
+        self.assertHttpBadRequest(response)
+
+        response = self.api_client.post(
+            self.base_url,
+            format='json',
+            data={
+                'content': 123,
+                'full_url': 'https://example.com/mypath/',
+                'remote_addr': '0.0.0.0',
+                'session': {'key': '01234ABCD', 'app': self.app.code},
+            },
+            authentication=self.apikey_credentials,
+        )
+        self.assertHttpBadRequest(response)
+
+    def test_unstorable_item(self):
+        ''' Test asserting that an item which cannot be stored is discarded,
+        without blocking the items logged after it
+        '''
+        items = [
+            {
+                'content': 'GET /mypath/{0}/ HTTP/1.0\n'.format(index),
+                'full_url': 'https://example.com/mypath/{0}/'.format(index),
+                'remote_addr': '0.0.0.0',
+                'session': {'key': '01234ABCD', 'app': self.app.code},
+            }
+            for index in range(3)
+        ]
+        for item in items:
+            self.api_client.post(self.base_url, format='json', data=item,
+                                 authentication=self.apikey_credentials)
+
+        ingest_batch = ingest.ingest_batch
+        def failing_ingest_batch(batch):
+            if items[1]['full_url'] in [item['full_url'] for item in batch]:
+                raise ValueError("Unstorable")
+            return ingest_batch(batch)
+        ingest.ingest_batch = failing_ingest_batch
+        try:
+            call_command('materialize_history', once=True)
+        finally:
+            ingest.ingest_batch = ingest_batch
+        self.assertEqual(
+            sorted(history.ClientRequest.objects.values_list('full_url',
+                                                             flat=True)),
+            [items[0]['full_url'], items[2]['full_url']])
+
+        # The log was consumed past the item:
+        call_command('materialize_history', once=True)
+        self.assertEqual(history.ClientRequest.objects.count(), 2)
+
+
+class TestCursorPagination(ApiTestCase):
+
+    def setUp(self):
+        super(TestCursorPagination, self).setUp()
+        self.base_url = reverse('api_dispatch_list',
+                                kwargs={'resource_name': 'clientsession'})
+        self.sessions = [
+            history.ClientSession.objects.create(app=self.app, key=str(index))
+            for index in range(5)
+        ]
+        # Keyset ordering must break ties in creation time:
+        history.ClientSession.objects.filter(
+            pk__in=[session.pk for session in self.sessions[1:4]]
+        ).update(created=self.sessions[1].created)
+
+    def get_page(self, url, **data):
+        response = self.api_client.get(url, format='json', data=data,
+                                       authentication=self.apikey_credentials)
+        self.assertValidJSONResponse(response)
+        return json.loads(response.content)
+
+    def keys(self, data):
+        return [obj['key'] for obj in data['objects']]
+
+    def test_pages(self):
+        ''' Test asserting that a cursor pages forward and back through the
+        list of ClientSession objects, without a total count
+        '''
+        data = self.get_page(self.base_url, cursor='', limit=2)
+        self.assertEqual(self.keys(data), ['0', '1'])
+        self.assertNotIn('total_count', data['meta'])
+        self.assertIsNone(data['meta']['previous'])
+
+        data = self.get_page(data['meta']['next'])
+        self.assertEqual(self.keys(data), ['2', '3'])
+        data = self.get_page(data['meta']['next'])
+        self.assertEqual(self.keys(data), ['4'])
+        self.assertIsNone(data['meta']['next'])
+
+        data = self.get_page(data['meta']['previous'])
+        self.assertEqual(self.keys(data), ['2', '3'])
+        data = self.get_page(data['meta']['previous'])
+        self.assertEqual(self.keys(data), ['0', '1'])
+        self.assertIsNone(data['meta']['previous'])
+        self.assertIsNotNone(data['meta']['next'])
+
+    def test_offset_by_default(self):
+        ''' Test asserting that lists are paginated by offset, (with a total
+        count), unless a cursor is requested
+        '''
+        data = self.get_page(self.base_url, limit=2)
+        self.assertEqual(data['meta']['total_count'], 5)
+
+    def test_invalid_cursor(self):
+        ''' Test asserting that an invalid cursor is a bad request
+        '''
+        response = self.api_client.get(self.base_url, format='json',
+                                       data={'cursor': 'bogus'},
+                                       authentication=self.apikey_credentials)
+        self.assertHttpBadRequest(response)
+
+
+class TestParameterFilter(ApiTestCase):
+
+    def setUp(self):
+        super(TestParameterFilter, self).setUp()
+        self.url = reverse('api_dispatch_list',
+                           kwargs={'resource_name': 'clientrequest'})
+        session = history.ClientSession.objects.create(app=self.app,
+                                                       key='01234')
+        self.requests = [
+            history.ClientRequest.objects.create(
+                session=session,
+                remote_addr='127.0.0.1',
+                full_url='http://example.com/page/?' + query,
+                content='GET /page/?{0} HTTP/1.1\r\n\r\n'.format(query),
+            )
+            for query in ('user=1&next=a', 'user=1&next=b', 'user=2')
+        ]
+
+    def get_list(self, **data):
+        return self.api_client.get(self.url, format='json', data=data,
+                                   authentication=self.apikey_credentials)
+
+    def pks(self, response):
+        self.assertValidJSONResponse(response)
+        return sorted(int(obj['id'])
+                      for obj in json.loads(response.content)['objects'])
+
+    def test_parameter(self):
+        ''' Test asserting that a list of ClientRequest objects may be filtered
+        by parameters, of either or a given source
+        '''
+        response = self.get_list(parameter='user=1')
+        self.assertEqual(self.pks(response),
+                         [request.pk for request in self.requests[:2]])
+
+        response = self.get_list(parameter=['user=1', 'next=b'],
+                                 parameter_source='query',
+                                 session__app__code='myapp')
+        self.assertEqual(self.pks(response), [self.requests[1].pk])
+
+        response = self.get_list(parameter='user=1', parameter_source='form')
+        self.assertEqual(self.pks(response), [])
+
+    def test_invalid_parameter(self):
+        ''' Test asserting that invalid parameter filters are a bad request
+        '''
+        self.assertHttpBadRequest(self.get_list(parameter='user'))
+        self.assertHttpBadRequest(self.get_list(parameter='user=1',
+                                                parameter_source='body'))
+
+
+class TestHeaderFilter(ApiTestCase):
+
+    def setUp(self):
+        super(TestHeaderFilter, self).setUp()
+        self.results = ingest.ingest_batch([
+            {
+                'content': 'GET /page/ HTTP/1.1\r\n\r\n',
+                'full_url': 'http://example.com/page/',
+                'remote_addr': '127.0.0.1',
+                'session': {'app': self.app.code, 'key': '01234'},
+                'response': {'content': 'HTTP/1.1 200 OK\r\n'
+                                        'Cache-Control: {0}\r\n\r\n'
+                                        .format(cache_control)},
+            }
+            for cache_control in ('no-store', 'max-age=60')
+        ])
+
+    def get_list(self, resource_name, **data):
+        response = self.api_client.get(
+            reverse('api_dispatch_list',
+                    kwargs={'resource_name': resource_name}),
+            format='json', data=data, authentication=self.apikey_credentials)
+        return response
+
+    def test_header(self):
+        ''' Test asserting that a list of ServerResponse objects may be
+        filtered by header name, and value
+        '''
+        response = self.get_list('serverresponse',
+                                 header='Cache-Control: no-store')
+        self.assertValidJSONResponse(response)
+        objects = json.loads(response.content)['objects']
+        self.assertEqual([obj['id'] for obj in objects],
+                         [self.results[0][0].serverresponse.pk])
+
+        response = self.get_list('serverresponse', header='cache-control')
+        self.assertEqual(len(json.loads(response.content)['objects']), 2)
+        response = self.get_list('clientrequest', header='cache-control')
+        self.assertEqual(json.loads(response.content)['objects'], [])
+
+    def test_list_queries(self):
+        ''' Test asserting that a list of ServerResponse objects is retrieved
+        in two queries, with their requests' URIs
+        '''
+        # Authenticate, (and so cache credentials), ahead of counting:
+        self.get_list('serverresponse')
+        # One query for the count, and one for the page of responses:
+        with self.assertNumQueries(2):
+            response = self.get_list('serverresponse')
+        objects = json.loads(response.content)['objects']
+        self.assertEqual(
+            [obj['request'] for obj in objects],
+            [reverse('api_dispatch_detail',
+                     kwargs={'resource_name': 'clientrequest',
+                             'pk': request.pk})
+             for (request, _error) in self.results])
+
+    def test_invalid_header(self):
+        ''' Test asserting that an invalid header filter is a bad request
+        '''
+        self.assertHttpBadRequest(self.get_list('serverresponse',
+                                                header=':no-store'))
+
+
+class TestSessionTimelineApi(ApiTestCase):
+
+    def setUp(self):
+        super(TestSessionTimelineApi, self).setUp()
+        self.session = history.ClientSession.objects.create(app=self.app,
+                                                            key='01234')
+        self.linked = history.ClientSession.objects.create(app=self.app,
+                                                           key='56789')
+        self.session.linked_sessions.add(self.linked)
+        self.url = reverse('api_get_timeline',
+                           kwargs={'resource_name': 'clientsession',
+                                   'pk': self.session.pk})
+        for index in range(3):
+            request = history.ClientRequest.objects.create(
+                session=self.session,
+                remote_addr='127.0.0.1',
+                full_url='http://example.com/page/?index={0}'.format(index),
+                content=('POST /page/?index={0} HTTP/1.1\r\n\r\n'
+                         'field=value').format(index),
+            )
+            if index < 2:
+                history.ServerResponse.objects.create(
+                    request=request,
+                    session=self.session,
+                    content='HTTP/1.1 200 OK\r\n\r\nPage {0}'.format(index),
+                )
+        # Authenticate, (and so cache credentials), ahead of counting:
+        self.get_timeline()
+
+    def get_timeline(self, **data):
+        response = self.api_client.get(self.url, data=data,
+                                       authentication=self.apikey_credentials)
+        # (The streamed content may be read only once.)
+        self.assertHttpOK(response)
+        self.assertTrue(response['Content-Type'].startswith('application/json'))
+        return json.loads(response.content)
+
+    def test_get_timeline(self):
+        ''' Test asserting that a session's timeline is streamed, by chunk of
+        requests, without content or linked sessions by default
+        '''
+        # One query for the session, and four per chunk of requests:
+        with self.settings(HISTORY_TIMELINE_CHUNK_SIZE=2):
+            with self.assertNumQueries(9):
+                data = self.get_timeline()
+        self.assertEqual(data['session']['key'], '01234')
+        self.assertNotIn('linked_sessions', data)
+        requests = data['requests']
+        self.assertEqual([request['query_params'] for request in requests],
+                         [[['index', str(index)]] for index in range(3)])
+        self.assertEqual(requests[0]['form_params'], [['field', 'value']])
+        self.assertEqual(requests[1]['response']['status'], 200)
+        self.assertNotIn('content', requests[1]['response'])
+        self.assertIsNone(requests[2]['response'])
+
+    def test_get_timeline_content_linked(self):
+        ''' Test asserting that a session's timeline includes content and
+        linked sessions on request
+        '''
+        data = self.get_timeline(content='1', linked='1')
+        self.assertEqual(
+            data['linked_sessions'],
+            [reverse('api_dispatch_detail',
+                     kwargs={'resource_name': 'clientsession',
+                             'pk': self.linked.pk})])
+        self.assertEqual(data['requests'][1]['response']['content'],
+                         'HTTP/1.1 200 OK\r\n\r\nPage 1')
+        self.assertTrue(data['requests'][2]['content'].endswith('field=value'))
+
+    def test_get_timeline_not_found(self):
+        ''' Test asserting that the timeline of a nonexistent session is not
+        found
+        '''
+        self.url = reverse('api_get_timeline',
+                           kwargs={'resource_name': 'clientsession',
+                                   'pk': 999})
+        response = self.api_client.get(self.url,
+                                       authentication=self.apikey_credentials)
+        self.assertHttpNotFound(response)
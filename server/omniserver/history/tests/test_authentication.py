@@ -0,0 +1,51 @@
+from django.contrib.auth import models as auth
+from django.test import TestCase
+from django.test.client import RequestFactory
+from tastypie.http import HttpUnauthorized
+
+from history import authentication
+
+
+class TestCachedApiKeyAuthentication(TestCase):
+
+    def setUp(self):
+        authentication.credentials.clear()
+        self.auth = authentication.CachedApiKeyAuthentication()
+        self.user = auth.User.objects.create(username='client')
+        self.factory = RequestFactory()
+
+    def make_request(self, key=None):
+        return self.factory.get('/', HTTP_AUTHORIZATION='ApiKey {0}:{1}'.format(
+            self.user.username, key or self.user.api_key.key))
+
+    def test_cached(self):
+        ''' Test asserting that repeated authentication with the same
+        credentials makes no queries
+        '''
+        self.assertIs(self.auth.is_authenticated(self.make_request()), True)
+        request = self.make_request()
+        with self.assertNumQueries(0):
+            self.assertIs(self.auth.is_authenticated(request), True)
+        self.assertEqual(request.user, self.user)
+
+    def test_wrong_key(self):
+        ''' Test asserting that a wrong key is rejected, though the user's
+        credentials are cached
+        '''
+        self.assertIs(self.auth.is_authenticated(self.make_request()), True)
+        self.assertIsInstance(
+            self.auth.is_authenticated(self.make_request('bogus')),
+            HttpUnauthorized,
+        )
+
+    def test_invalidated(self):
+        ''' Test asserting that cached credentials are invalidated by the
+        deletion of the user's ApiKey
+        '''
+        self.assertIs(self.auth.is_authenticated(self.make_request()), True)
+        key = self.user.api_key.key
+        self.user.api_key.delete()
+        self.assertIsInstance(
+            self.auth.is_authenticated(self.make_request(key)),
+            HttpUnauthorized,
+        )
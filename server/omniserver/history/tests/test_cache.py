@@ -0,0 +1,79 @@
+from django.test import TestCase
+
+from history import cache, models as history
+
+
+class TestLRUCache(TestCase):
+
+    def test_eviction(self):
+        ''' Test asserting that the least recently used entry is evicted once
+        the cache is full
+        '''
+        lru = cache.LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        # 'b' was least recently used:
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(lru.stats(), {'size': 2, 'hits': 3, 'misses': 1})
+
+    def test_expiry(self):
+        ''' Test asserting that entries are not returned once expired
+        '''
+        lru = cache.LRUCache(maxsize=2, ttl=-1)
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), None)
+
+
+class TestModelCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.app = history.App.objects.create(code='myapp', name='My App')
+        self.session = history.ClientSession.objects.create(app=self.app,
+                                                            key='01234ABCD')
+
+    def test_get_app(self):
+        ''' Test asserting that an App is retrieved once by code, and retrieved
+        again once saved
+        '''
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_app('myapp'), self.app)
+            self.assertEqual(cache.get_app('myapp'), self.app)
+        self.app.name = 'Renamed'
+        self.app.save()
+        self.assertEqual(cache.get_app('myapp').name, 'Renamed')
+        self.assertRaises(history.App.DoesNotExist, cache.get_app, 'bogus')
+
+    def test_get_session(self):
+        ''' Test asserting that a ClientSession is retrieved once by key, and
+        no longer returned under its old key once saved or deleted
+        '''
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get_session(self.app, '01234ABCD'),
+                             self.session)
+            self.assertEqual(cache.get_session(self.app, '01234ABCD'),
+                             self.session)
+        self.session.key = '56789EFGH'
+        self.session.save()
+        self.assertRaises(history.ClientSession.DoesNotExist,
+                          cache.get_session, self.app, '01234ABCD')
+        self.session.delete()
+        self.assertEqual(cache.cached_session(self.app, '56789EFGH'), None)
+
+    def test_get_dimension_ids(self):
+        ''' Test asserting that dimension values are created as needed, and
+        their ids cached
+        '''
+        with self.assertNumQueries(3):
+            # (Select, insert, and select of the inserted pks.)
+            ids = cache.get_dimension_ids(history.Host, ['a.com', 'b.com'])
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                cache.get_dimension_ids(history.Host, ['a.com', 'b.com']),
+                ids)
+        self.assertEqual(history.Host.objects.get(pk=ids['a.com']).value,
+                         'a.com')
@@ -0,0 +1,105 @@
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+
+from history import clusters, models as history
+from history.tests.test_api import ApiTestCase
+
+
+class TestClusters(ApiTestCase):
+
+    def setUp(self):
+        super(TestClusters, self).setUp()
+        self.sessions = [
+            history.ClientSession.objects.create(app=self.app, key=str(index))
+            for index in range(5)
+        ]
+
+    def labels(self):
+        return list(history.ClientSession.objects.order_by('pk')
+                    .values_list('cluster', flat=True))
+
+    def test_union_find(self):
+        ''' Test asserting that unions group members under their least root
+        '''
+        sets = clusters.UnionFind(range(6))
+        for (member0, member1) in ((5, 4), (4, 3), (3, 1), (2, 0)):
+            sets.union(member0, member1)
+        self.assertEqual(dict((root, sorted(members)) for (root, members)
+                              in sets.groups().items()),
+                         {0: [0, 2], 1: [1, 3, 4, 5]})
+
+    def test_link(self):
+        ''' Test asserting that linking sessions merges their clusters
+        '''
+        (s0, s1, s2, s3, s4) = self.sessions
+        s3.linked_sessions.add(s4)
+        self.assertEqual(self.labels(), [None, None, None, s3.pk, s3.pk])
+        s1.linked_sessions.add(s2)
+        s2.linked_sessions.add(s4)
+        self.assertEqual(self.labels(),
+                         [None, s1.pk, s1.pk, s1.pk, s1.pk])
+        self.assertEqual(set(clusters.cluster_of(s4)),
+                         set(self.sessions[1:]))
+        self.assertEqual(list(clusters.cluster_of(s0)), [s0])
+
+    def test_unlink(self):
+        ''' Test asserting that unlinking sessions splits their clusters
+        '''
+        (s0, s1, s2, s3, s4) = self.sessions
+        s0.linked_sessions.add(s1, s2)
+        s2.linked_sessions.add(s3)
+        s3.linked_sessions.add(s4)
+        self.assertEqual(self.labels(), [s0.pk] * 5)
+
+        s2.linked_sessions.remove(s3)
+        self.assertEqual(self.labels(),
+                         [s0.pk, s0.pk, s0.pk, s3.pk, s3.pk])
+        s0.linked_sessions.clear()
+        self.assertEqual(self.labels(), [None, None, None, s3.pk, s3.pk])
+        s4.delete()
+        self.assertEqual(self.labels(), [None, None, None, None])
+
+    def test_rebuild(self):
+        ''' Test asserting that the rebuild_session_clusters command relabels
+        all sessions
+        '''
+        (s0, s1, s2, s3, s4) = self.sessions
+        s1.linked_sessions.add(s3)
+        history.ClientSession.objects.update(cluster=None)
+        history.ClientSession.objects.filter(pk=s4.pk).update(cluster=99)
+        call_command('rebuild_session_clusters', stdout=StringIO())
+        self.assertEqual(self.labels(), [None, s1.pk, None, s1.pk, None])
+
+    def test_api(self):
+        ''' Test asserting that a session's cluster, and its requests, may be
+        retrieved via the API
+        '''
+        (s0, s1, s2, s3, s4) = self.sessions
+        s1.linked_sessions.add(s3)
+        request = history.ClientRequest.objects.create(
+            session=s3,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/',
+            content='GET / HTTP/1.1\r\n\r\n',
+        )
+        response = self.api_client.get(
+            reverse('api_get_cluster', kwargs={'resource_name': 'clientsession',
+                                               'pk': s3.pk}),
+            format='json',
+            authentication=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        data = json.loads(response.content)
+        self.assertEqual(data['cluster'], s1.pk)
+        self.assertEqual(sorted(obj['key'] for obj in data['objects']),
+                         ['1', '3'])
+
+        response = self.api_client.get(data['requests_uri'], format='json',
+                                       authentication=self.apikey_credentials)
+        self.assertValidJSONResponse(response)
+        self.assertEqual([obj['id'] for obj
+                          in json.loads(response.content)['objects']],
+                         [request.pk])
@@ -0,0 +1,107 @@
+import collections
+import csv
+import datetime
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from history import export, models as history
+from history.tests.test_api import ApiTestCase
+
+
+class TestExport(ApiTestCase):
+
+    def setUp(self):
+        super(TestExport, self).setUp()
+        session = history.ClientSession.objects.create(app=self.app,
+                                                       key='01234')
+        self.requests = []
+        for (index, host) in enumerate(['example.com', 'example.org'] * 2):
+            request = history.ClientRequest.objects.create(
+                session=session,
+                remote_addr='127.0.0.1',
+                full_url='http://{0}/page/{1}/'.format(host, index),
+                content='GET /page/{0}/ HTTP/1.1\r\n\r\n'.format(index),
+            )
+            self.requests.append(request)
+        history.ServerResponse.objects.create(
+            request=self.requests[0],
+            session=session,
+            content='HTTP/1.1 404 Not Found\r\n\r\n',
+        )
+
+    def test_ndjson(self):
+        ''' Test asserting that filtered requests are exported as NDJSON, in
+        batches
+        '''
+        requests = export.queryset(host='example.com')
+        lines = ''.join(export.export(requests, batch_size=1)).splitlines()
+        records = [json.loads(line, object_pairs_hook=collections.OrderedDict)
+                   for line in lines]
+        self.assertEqual([record['path'] for record in records],
+                         ['/page/0/', '/page/2/'])
+        self.assertEqual(records[0]['status'], 404)
+        self.assertEqual(records[0]['app'], 'myapp')
+        self.assertIsNone(records[1]['status'])
+        self.assertEqual(records[0].keys(), list(export.DEFAULT_FIELDS))
+
+    def test_csv_content(self):
+        ''' Test asserting that requests are exported as CSV, with the content
+        of their responses
+        '''
+        chunks = export.export(export.queryset(),
+                               fields=('id', 'content', 'response_content'),
+                               format='csv', batch_size=3)
+        rows = list(csv.reader(StringIO(''.join(chunks))))
+        self.assertEqual(rows[0], ['id', 'content', 'response_content'])
+        self.assertEqual(rows[1], [str(self.requests[0].pk),
+                                   self.requests[0].content,
+                                   'HTTP/1.1 404 Not Found\r\n\r\n'])
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[4][2], '')
+
+    def test_filter_time(self):
+        ''' Test asserting that exported requests may be filtered by time, and
+        that invalid times are rejected
+        '''
+        history.ClientRequest.objects.filter(pk=self.requests[0].pk).update(
+            created=timezone.now() - datetime.timedelta(days=2))
+        since = export.parse_time(
+            (timezone.now() - datetime.timedelta(days=1)).date().isoformat())
+        self.assertEqual(export.queryset(since=since).count(), 3)
+        self.assertRaises(export.ExportError, export.parse_time, 'yesterday')
+        self.assertRaises(export.ExportError, export.parse_fields, 'id,bogus')
+
+    def test_command(self):
+        ''' Test asserting that the export_history command writes the export
+        '''
+        output = StringIO()
+        call_command('export_history', format='csv', fields='id,host',
+                     app='myapp', stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[1],
+                         '{0},example.com'.format(self.requests[0].pk))
+
+    def test_api(self):
+        ''' Test asserting that requests may be exported via the API, and that
+        unknown fields are a bad request
+        '''
+        url = reverse('api_get_export',
+                      kwargs={'resource_name': 'clientrequest'})
+        response = self.api_client.get(
+            url,
+            data={'fields': 'id,host', 'host': 'example.org'},
+            authentication=self.apikey_credentials,
+        )
+        self.assertHttpOK(response)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in response.content.splitlines()],
+            [{'id': request.pk, 'host': 'example.org'}
+             for request in self.requests[1::2]])
+
+        response = self.api_client.get(url, data={'fields': 'bogus'},
+                                       authentication=self.apikey_credentials)
+        self.assertHttpBadRequest(response)
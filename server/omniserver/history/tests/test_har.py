@@ -0,0 +1,130 @@
+import base64
+import json
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from history import cache, har, models as history
+
+
+def make_entry(index, **response):
+    entry = {
+        'startedDateTime': '2013-04-01T12:00:0{0}.000+02:00'.format(index),
+        'time': 250,
+        'request': {
+            'method': 'POST',
+            'url': 'https://example.com/form/?index={0}'.format(index),
+            'httpVersion': 'h2',
+            'headers': [
+                {'name': ':authority', 'value': 'example.com'},
+                {'name': 'Content-Type',
+                 'value': 'application/x-www-form-urlencoded'},
+                {'name': 'Content-Length', 'value': '999'},
+            ],
+            'postData': {'mimeType': 'application/x-www-form-urlencoded',
+                         'text': u'name=\u2603'},
+        },
+        'response': {
+            'status': 200,
+            'statusText': 'OK',
+            'httpVersion': 'HTTP/1.1',
+            'headers': [{'name': 'Content-Encoding', 'value': 'gzip'}],
+            'content': {'text': 'Page {0}'.format(index)},
+        },
+    }
+    entry['response'].update(response)
+    return entry
+
+
+class TestIterEntries(TestCase):
+
+    def test_streamed(self):
+        ''' Test asserting that a HAR file's entries are read incrementally
+        '''
+        entries = [make_entry(index) for index in range(5)]
+        content = json.dumps({'log': {'version': '1.2',
+                                      'pages': [{'title': 'entries'}],
+                                      'entries': entries}}, indent=1)
+        self.assertEqual(list(har.iter_entries(StringIO(content),
+                                               chunk_size=7)),
+                         entries)
+
+    def test_invalid(self):
+        ''' Test asserting that truncated and entry-less HAR files are rejected
+        '''
+        entries = har.iter_entries(StringIO('{"log": {"entries": [{"a": '),
+                                   chunk_size=4)
+        self.assertRaises(har.HarError, list, entries)
+        entries = har.iter_entries(StringIO('{"log": {}}'))
+        self.assertRaises(har.HarError, list, entries)
+
+
+class TestEntryItem(TestCase):
+
+    def test_item(self):
+        ''' Test asserting that a HAR entry is converted to a batch item of raw
+        messages
+        '''
+        item = har.entry_item(make_entry(1), 'myapp', 'session', '10.0.0.1')
+        self.assertEqual(item['content'],
+                         'POST /form/?index=1 HTTP/1.1\r\n'
+                         'Content-Type: application/x-www-form-urlencoded\r\n'
+                         'Content-Length: 8\r\n'
+                         '\r\n'
+                         'name=\xe2\x98\x83')
+        self.assertEqual(item['created'], '2013-04-01T12:00:01+02:00')
+        self.assertEqual(item['response']['created'],
+                         '2013-04-01T12:00:01.250000+02:00')
+        self.assertEqual(item['response']['content'],
+                         'HTTP/1.1 200 OK\r\nContent-Length: 6\r\n\r\nPage 1')
+
+    def test_base64_aborted(self):
+        ''' Test asserting that base64-encoded content is decoded, and that
+        aborted entries have no response
+        '''
+        entry = make_entry(1, content={'text': base64.b64encode('\x89PNG'),
+                                       'encoding': 'base64'})
+        item = har.entry_item(entry, 'myapp', 'session', '10.0.0.1')
+        self.assertTrue(item['response']['content'].endswith('\r\n\x89PNG'))
+
+        entry = make_entry(1, status=0)
+        item = har.entry_item(entry, 'myapp', 'session', '10.0.0.1')
+        self.assertNotIn('response', item)
+
+
+class TestImportHar(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        (fd, self.path) = tempfile.mkstemp(suffix='.har')
+        entries = [make_entry(index) for index in range(3)]
+        del entries[1]['startedDateTime']
+        with os.fdopen(fd, 'w') as file_:
+            json.dump({'log': {'entries': entries}}, file_)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_import(self):
+        ''' Test asserting that the import_har command ingests a HAR file's
+        entries, skipping those which are invalid
+        '''
+        output = StringIO()
+        call_command('import_har', self.path, app='myapp', workers=1,
+                     batch_size=2, stdout=output)
+        self.assertIn('Imported 3 entries (1 skipped) as 8 rows',
+                      output.getvalue())
+
+        session = history.ClientSession.objects.get(
+            app__code='myapp', key=os.path.basename(self.path))
+        requests = session.requests.order_by('created')
+        self.assertEqual([request.path for request in requests],
+                         ['/form/', '/form/'])
+        self.assertEqual(requests[0].created.second, 0)
+        self.assertEqual([param.value
+                          for param in requests[1].form_params.all()],
+                         [u'\u2603'])
+        self.assertEqual(requests[1].serverresponse.parse().body, 'Page 2')
@@ -0,0 +1,107 @@
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from history import ingestlog
+
+
+class TestIngestLog(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = ingestlog.LogWriter(self.directory,
+                                          partitions=1,
+                                          segment_size=100,
+                                          sync_every=2,
+                                          sync_interval=60)
+
+    def tearDown(self):
+        self.writer.close()
+        shutil.rmtree(self.directory)
+
+    def make_item(self, number):
+        return {'content': 'GET /{0}/ HTTP/1.0\n'.format(number),
+                'session': {'app': 'myapp', 'key': '01234ABCD'}}
+
+    def test_append_read(self):
+        ''' Test asserting that appended items are read back in order, resuming
+        from the committed checkpoint, and that read segments are removed
+        '''
+        items = [self.make_item(number) for number in range(5)]
+        for item in items:
+            self.writer.append(item)
+        partition = ingestlog.partition_dir(self.directory, 0)
+        # Segments are rolled at (about) 100 bytes:
+        self.assertTrue(len(ingestlog.segment_numbers(partition)) > 1)
+
+        reader = ingestlog.LogReader(self.directory, 0)
+        (read, position) = reader.read(3)
+        self.assertEqual(read, items[:3])
+        reader.commit(position)
+
+        # Reading resumes from the checkpoint:
+        reader = ingestlog.LogReader(self.directory, 0)
+        (read, position) = reader.read(10)
+        self.assertEqual(read, items[3:])
+        reader.commit(position)
+        self.assertEqual(reader.read(10), ([], position))
+        self.assertEqual(ingestlog.segment_numbers(partition), [position[0]])
+
+    def test_incomplete_record(self):
+        ''' Test asserting that a partially written record is left unread, to
+        be completed by its writer
+        '''
+        self.writer.append(self.make_item(0))
+        (number, file_) = self.writer._files[0]
+        file_.write(ingestlog.FRAME.pack(10, 0) + 'abc')
+        file_.flush()
+
+        reader = ingestlog.LogReader(self.directory, 0)
+        (read, position) = reader.read(10)
+        self.assertEqual(read, [self.make_item(0)])
+        # The incomplete record is left to be completed:
+        path = os.path.join(ingestlog.partition_dir(self.directory, 0),
+                            ingestlog.segment_name(number))
+        self.assertTrue(position[1] < os.path.getsize(path))
+
+    def test_corrupt_record(self):
+        ''' Test asserting that reading resumes at the next valid record
+        following a corrupt record, whose length cannot be trusted
+        '''
+        writer = ingestlog.LogWriter(self.directory, partitions=1,
+                                     segment_size=1024, sync_every=2,
+                                     sync_interval=60)
+        writer.append(self.make_item(0))
+        (number, file_) = writer._files[0]
+        # A corrupt header, (claiming a length beyond the segment), and a
+        # torn record:
+        file_.write(ingestlog.FRAME.pack(1000, 0) + 'abc')
+        file_.write(ingestlog.FRAME.pack(10, 0) + '\x00' * 20)
+        file_.flush()
+        writer.append(self.make_item(1))
+        writer.append(self.make_item(2))
+        writer.close()
+
+        reader = ingestlog.LogReader(self.directory, 0)
+        (read, position) = reader.read(10)
+        self.assertEqual(read, [self.make_item(index) for index in range(3)])
+        path = os.path.join(ingestlog.partition_dir(self.directory, 0),
+                            ingestlog.segment_name(number))
+        self.assertEqual(position, (number, os.path.getsize(path)))
+
+    def test_torn_sealed_segment(self):
+        ''' Test asserting that a torn record at the end of a sealed
+        segment is skipped, rather than awaited
+        '''
+        self.writer.append(self.make_item(0))
+        (number, file_) = self.writer._files[0]
+        file_.write(ingestlog.FRAME.pack(200, 0) + 'abc' * 10)
+        file_.flush()
+        self.writer.append(self.make_item(1))
+        self.assertEqual(self.writer._files[0][0], number + 1)
+
+        reader = ingestlog.LogReader(self.directory, 0)
+        (read, position) = reader.read(10)
+        self.assertEqual(read, [self.make_item(0), self.make_item(1)])
+        self.assertEqual(position[0], number + 1)
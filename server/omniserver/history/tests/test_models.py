@@ -0,0 +1,388 @@
+import textwrap
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from history import models as history, search
+
+
+class TestClientRequestParse(TestCase):
+
+    def setUp(self):
+        self.request = history.ClientRequest(
+            full_url='http://example.com/mypath/?get=query',
+            content=textwrap.dedent('''\
+                POST /mypath/?get=query HTTP/1.0
+                User-Agent: Test/0.1
+
+                the=pay-load&such=%26such
+                '''),
+        )
+
+    def test_parse(self):
+        ''' Test asserting that a ClientRequest's content is parsed into its
+        method, target, headers, URL components and parameters
+        '''
+        parsed = self.request.parse()
+        self.assertEqual(parsed.method, 'POST')
+        self.assertEqual(parsed.target, '/mypath/?get=query')
+        self.assertEqual(parsed.header('user-agent'), 'Test/0.1')
+        self.assertEqual(parsed.protocol, 'http')
+        self.assertEqual(parsed.host, 'example.com')
+        self.assertEqual(parsed.path, '/mypath/')
+        self.assertEqual(parsed.query, (('get', 'query'),))
+        self.assertEqual(parsed.form, (('the', 'pay-load'), ('such', '&such')))
+        self.assertEqual(self.request.content[parsed.body_offset:],
+                         parsed.body)
+
+    def test_parse_cached(self):
+        ''' Test asserting that a ClientRequest's parse is cached, until its
+        content or full_url change
+        '''
+        parsed = self.request.parse()
+        self.assertIs(self.request.parse(), parsed)
+        self.request.full_url = 'https://example.com/mypath/'
+        reparsed = self.request.parse()
+        self.assertIsNot(reparsed, parsed)
+        self.assertEqual(reparsed.protocol, 'https')
+        self.assertEqual(reparsed.query, ())
+
+
+class TestServerResponseParse(TestCase):
+
+    def test_parse(self):
+        ''' Test asserting that a ServerResponse's content is parsed, once,
+        into its status, reason, headers and body
+        '''
+        response = history.ServerResponse(content=textwrap.dedent('''\
+            HTTP/1.1 302 Found
+            Location: /otherpath/
+            Content-Length: 5
+
+            hello'''))
+        parsed = response.parse()
+        self.assertIs(response.parse(), parsed)
+        self.assertEqual(parsed.status, 302)
+        self.assertEqual(parsed.reason, 'Found')
+        self.assertEqual(parsed.location, '/otherpath/')
+        self.assertEqual(parsed.body, 'hello')
+
+
+class TestParameterSync(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        session = history.ClientSession.objects.create(app=app, key='01234')
+        self.request = history.ClientRequest(
+            session=session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/mypath/',
+            content=self.content('a=1&b=2&c=3'),
+        )
+        self.request.save()
+
+    def content(self, form):
+        return 'POST /mypath/ HTTP/1.0\r\n\r\n' + form
+
+    def form(self):
+        return [(param.key, param.value)
+                for param in self.request.form_params.order_by('position')]
+
+    def test_created(self):
+        ''' Test asserting that a saved request's parameters are stored in
+        order
+        '''
+        self.assertEqual(self.form(), [('a', '1'), ('b', '2'), ('c', '3')])
+
+    def test_unchanged(self):
+        ''' Test asserting that re-saving a request of unchanged content leaves
+        its parameter rows in place
+        '''
+        pks = set(self.request.form_params.values_list('pk', flat=True))
+        with search.suspended(), self.assertNumQueries(4):
+            # (Request update, and one select per parameter type; nothing
+            # further, save for search indexing.)
+            self.request.save()
+        self.assertEqual(
+            set(self.request.form_params.values_list('pk', flat=True)), pks)
+
+    def test_changed(self):
+        ''' Test asserting that re-saving a request of changed content updates,
+        removes and adds its parameters
+        '''
+        self.request.content = self.content('a=1&b=two')
+        self.request.save()
+        self.assertEqual(self.form(), [('a', '1'), ('b', 'two')])
+
+        self.request.content = self.content('a=1&b=two&c=3&d=4')
+        self.request.save()
+        self.assertEqual(self.form(),
+                         [('a', '1'), ('b', 'two'), ('c', '3'), ('d', '4')])
+
+
+class TestParameterLookup(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        session = history.ClientSession.objects.create(app=app, key='01234')
+        self.requests = [
+            history.ClientRequest.objects.create(
+                session=session,
+                remote_addr='127.0.0.1',
+                full_url='http://example.com/mypath/?' + query,
+                content='POST /mypath/?{0} HTTP/1.0\r\n\r\n{1}'.format(
+                    query, form),
+            )
+            for (query, form) in (('user=1', 'next=a'),
+                                  ('user=2', 'user=1'),
+                                  ('next=b', 'user=3'))
+        ]
+
+    def pks(self, requests):
+        return sorted(request.pk for request in requests)
+
+    def test_value_hash(self):
+        ''' Test asserting that a parameter's value hash is stored, and updated
+        with its value
+        '''
+        param = self.requests[0].query_params.get()
+        self.assertEqual(param.value_hash, history.value_hash('1'))
+
+        self.requests[0].full_url = 'http://example.com/mypath/?user=4'
+        self.requests[0].save()
+        param = self.requests[0].query_params.get()
+        self.assertEqual(param.value_hash, history.value_hash('4'))
+
+    def test_with_parameter(self):
+        ''' Test asserting that requests are found by parameter key and value,
+        of either or a given source
+        '''
+        requests = history.ClientRequest.objects.with_parameter('user', '1')
+        self.assertEqual(self.pks(requests), self.pks(self.requests[:2]))
+
+        requests = history.ClientRequest.objects.with_parameter(
+            'user', '1', source='form')
+        self.assertEqual(self.pks(requests), [self.requests[1].pk])
+
+        requests = history.ClientRequest.objects.with_parameter('user', 'a')
+        self.assertEqual(list(requests), [])
+
+
+@override_settings(HISTORY_PARAMETER_STORAGE='compact',
+                   HISTORY_PARAMETER_INDEXED_KEYS=('user',))
+class TestCompactParameters(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        self.session = history.ClientSession.objects.create(app=app,
+                                                            key='01234')
+        self.request = self.create('user=1&next=%2Fhome', 'a=1&user=2')
+
+    def create(self, query, form):
+        return history.ClientRequest.objects.create(
+            session=self.session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/mypath/?' + query,
+            content='POST /mypath/?{0} HTTP/1.0\r\n\r\n{1}'.format(query,
+                                                                   form),
+        )
+
+    def test_stored(self):
+        ''' Test asserting that parameters are stored compactly, but for rows
+        of the indexed keys, by which requests are still found
+        '''
+        request = history.ClientRequest.objects.get(pk=self.request.pk)
+        self.assertEqual(
+            [(param.key, param.value) for param in request.query_params.all()],
+            [('user', '1'), ('next', '/home')])
+        self.assertEqual(request.form_params.urlencoded(), 'a=1&user=2')
+        # Only the indexed keys are stored as rows:
+        self.assertEqual(
+            list(history.QueryParameter.objects.values_list('key', 'value')),
+            [('user', '1')])
+        self.assertEqual(
+            list(history.FormParameter.objects.values_list('key', 'value')),
+            [('user', '2')])
+        self.assertEqual(
+            list(history.ClientRequest.objects.with_parameter('user', '2')),
+            [request])
+
+    def test_prefetch(self):
+        ''' Test asserting that prefetched compact parameters are decoded
+        without query, alongside those stored as rows
+        '''
+        with self.settings(HISTORY_PARAMETER_STORAGE='rows'):
+            rows_request = self.create('user=3&page=2', '')
+        requests = history.ClientRequest.objects.order_by('pk')
+        # (Compact parameters are decoded without query.)
+        with self.assertNumQueries(2):
+            requests = list(requests.prefetch_related('query_params'))
+            self.assertEqual(
+                [[param.key for param in request.query_params.all()]
+                 for request in requests],
+                [['user', 'next'], ['user', 'page']])
+        self.assertEqual(requests[1], rows_request)
+
+    def test_resave_as_rows(self):
+        ''' Test asserting that re-saving a request under row storage replaces
+        its compact parameters
+        '''
+        with self.settings(HISTORY_PARAMETER_STORAGE='rows'):
+            self.request.save()
+        request = history.ClientRequest.objects.get(pk=self.request.pk)
+        self.assertIsNone(request.query_data)
+        self.assertEqual(request.query_params.urlencoded(),
+                         'user=1&next=%2Fhome')
+
+
+class TestDimensions(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        self.session = history.ClientSession.objects.create(app=app,
+                                                            key='01234')
+
+    def create(self, host, user_agent):
+        return history.ClientRequest.objects.create(
+            session=self.session,
+            remote_addr='127.0.0.1',
+            full_url='http://{0}/mypath/'.format(host),
+            content='GET /mypath/ HTTP/1.0\r\nUser-Agent: {0}\r\n\r\n'
+                    .format(user_agent),
+        )
+
+    def test_interned(self):
+        ''' Test asserting that requests' hosts, paths and user agents are
+        interned, and that requests are found by them
+        '''
+        user_agent = 'Test/0.1 ' + 'x' * 500
+        requests = [self.create('example.com', user_agent),
+                    self.create('example.com', 'Other/1.0'),
+                    self.create('example.org', user_agent)]
+        self.assertEqual(history.Host.objects.count(), 2)
+        self.assertEqual(history.Path.objects.count(), 1)
+        self.assertEqual(history.UserAgent.objects.count(), 2)
+        self.assertEqual(requests[0].host_dimension_id,
+                         requests[1].host_dimension_id)
+
+        request = history.ClientRequest.objects.get(pk=requests[2].pk)
+        self.assertEqual(request.host, 'example.org')
+        self.assertEqual(request.path, '/mypath/')
+        self.assertEqual(request.user_agent, user_agent)
+        self.assertEqual(
+            list(history.ClientRequest.objects.filter(
+                host_dimension__value='example.org')),
+            [request])
+
+    def test_reassigned(self):
+        ''' Test asserting that changing a request's URL reassigns its host
+        '''
+        request = self.create('example.com', 'Test/0.1')
+        request.full_url = 'http://example.org/mypath/'
+        request.save()
+        request = history.ClientRequest.objects.get(pk=request.pk)
+        self.assertEqual(request.host, 'example.org')
+        self.assertEqual(history.Host.objects.count(), 2)
+
+
+class TestHeaders(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        session = history.ClientSession.objects.create(app=app, key='01234')
+        self.request = history.ClientRequest.objects.create(
+            session=session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com/mypath/',
+            content='GET /mypath/ HTTP/1.1\r\n'
+                    'X-Requested-With: XMLHttpRequest\r\n'
+                    'Cookie: secret=1\r\n\r\n',
+        )
+        self.response = history.ServerResponse.objects.create(
+            request=self.request,
+            session=session,
+            content='HTTP/1.1 200 OK\r\n'
+                    'Cache-Control: no-store\r\n\r\nhello',
+        )
+
+    def test_stored(self):
+        ''' Test asserting that headers are stored, but for those excluded, and
+        that messages are found by them
+        '''
+        self.assertEqual(
+            [unicode(header) for header in self.request.headers.all()],
+            [u'x-requested-with: XMLHttpRequest'])
+        self.assertEqual(
+            list(history.ClientRequest.objects.with_header('X-Requested-With')),
+            [self.request])
+        self.assertEqual(
+            list(history.ServerResponse.objects.with_header(
+                'cache-control', 'no-store')),
+            [self.response])
+        self.assertEqual(
+            list(history.ServerResponse.objects.with_header(
+                'cache-control', 'no-cache')),
+            [])
+        # Excluded headers are not stored:
+        self.assertEqual(
+            list(history.ClientRequest.objects.with_header('cookie')), [])
+
+    def test_changed(self):
+        ''' Test asserting that headers are re-stored only when a message's
+        content changes
+        '''
+        with search.suspended(), self.assertNumQueries(2):
+            # (Response update; headers of unchanged content are not
+            # re-stored.)
+            self.response.save()
+        self.response.content = ('HTTP/1.1 200 OK\r\n'
+                                 'Cache-Control: no-cache\r\n\r\nhello')
+        self.response.save()
+        self.assertEqual(
+            [header.value for header in self.response.headers.all()],
+            [u'no-cache'])
+
+
+class TestBlobContent(TestCase):
+
+    def setUp(self):
+        app = history.App.objects.create(code='myapp', name='My App')
+        self.session = history.ClientSession.objects.create(app=app,
+                                                            key='01234ABCD')
+        self.content = u'GET /mypath/ HTTP/1.0\nUser-Agent: Test/\u2603\n'
+
+    def make_request(self):
+        return history.ClientRequest.objects.create(
+            session=self.session,
+            remote_addr='0.0.0.0',
+            full_url='http://example.com/mypath/',
+            content=self.content,
+        )
+
+    def test_deduplicated(self):
+        ''' Test asserting that requests of identical content share a single
+        Blob
+        '''
+        requests = [self.make_request(), self.make_request()]
+        self.assertEqual(history.Blob.objects.count(), 1)
+        self.assertEqual(requests[0].content_blob_id,
+                         requests[1].content_blob_id)
+
+    def test_lazy_content(self):
+        ''' Test asserting that a retrieved request's content is loaded from
+        its Blob only once accessed
+        '''
+        request = history.ClientRequest.objects.get(pk=self.make_request().pk)
+        self.assertFalse(hasattr(request, '_content_blob_content'))
+        self.assertEqual(request.content, self.content)
+        self.assertEqual(request.user_agent, u'Test/\u2603')
+
+    def test_reassigned_content(self):
+        ''' Test asserting that changing a request's content stores a new Blob
+        '''
+        request = self.make_request()
+        request.content = 'GET /otherpath/ HTTP/1.0\n'
+        request.save()
+        self.assertEqual(history.Blob.objects.count(), 2)
+        request = history.ClientRequest.objects.get(pk=request.pk)
+        self.assertEqual(request.content, 'GET /otherpath/ HTTP/1.0\n')
@@ -0,0 +1,93 @@
+import base64
+import os.path
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from history import models as history, reprocess
+
+
+class TestReprocess(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint_path = os.path.join(self.directory, 'checkpoint')
+        app = history.App.objects.create(code='myapp', name='My App')
+        session = history.ClientSession.objects.create(app=app, key='01234')
+        self.requests = []
+        for index in range(3):
+            request = history.ClientRequest.objects.create(
+                session=session,
+                remote_addr='127.0.0.1',
+                full_url='http://example.com/page/?index={0}'.format(index),
+                content=('POST /page/?index={0} HTTP/1.1\r\n'
+                         'X-Index: {0}\r\n\r\nfield=value').format(index),
+            )
+            history.ServerResponse.objects.create(
+                request=request,
+                session=session,
+                content='HTTP/1.1 404 Not Found\r\n\r\n',
+            )
+            self.requests.append(request)
+
+        # Lose the derived data:
+        history.ClientRequest.objects.update(method='', protocol='')
+        history.ServerResponse.objects.update(status=0, reason='')
+        history.QueryParameter.objects.all().delete()
+        history.ClientRequest.headers.through.objects.all().delete()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reprocess(self, *kinds):
+        call_command('reprocess_history', *kinds, workers=1, chunk_size=2,
+                     checkpoint=self.checkpoint_path, verbosity=0)
+
+    def test_reprocess(self):
+        ''' Test asserting that stored requests are reparsed, and their derived
+        rows rebuilt
+        '''
+        self.reprocess()
+        request = history.ClientRequest.objects.get(pk=self.requests[1].pk)
+        self.assertEqual((request.method, request.protocol), ('POST', 'http'))
+        self.assertEqual(request.query_params.urlencoded(), 'index=1')
+        self.assertEqual(request.form_params.urlencoded(), 'field=value')
+        self.assertEqual([unicode(header) for header in request.headers.all()],
+                         [u'x-index: 1'])
+        self.assertEqual(
+            set(history.ServerResponse.objects.values_list('status', 'reason')),
+            set([(404, 'Not Found')]))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_corrupt_blob(self):
+        ''' Test asserting that a request of corrupt content is reported, and
+        does not fail its chunk
+        '''
+        history.Blob.objects.filter(
+            digest=self.requests[0].content_blob_id).update(
+            data=base64.b64encode('not compressed'))
+        (_kind, _last_pk, results) = reprocess.process_chunk(
+            next(reprocess.iter_chunks('requests', 10)))
+        self.assertEqual(results[0]['pk'], self.requests[0].pk)
+        self.assertIn('error', results[0])
+
+        self.reprocess('requests')
+        self.assertEqual(
+            list(history.ClientRequest.objects.order_by('pk')
+                 .values_list('method', flat=True)),
+            ['', 'POST', 'POST'])
+
+    def test_resume(self):
+        ''' Test asserting that reprocessing resumes from its checkpoint
+        '''
+        checkpoint = reprocess.Checkpoint(self.checkpoint_path)
+        checkpoint.commit('requests', self.requests[1].pk)
+        self.reprocess('requests')
+        self.assertEqual(
+            list(history.ClientRequest.objects.order_by('pk')
+                 .values_list('method', flat=True)),
+            ['', '', 'POST'])
+        self.assertEqual(history.ServerResponse.objects.filter(status=0)
+                         .count(), 3)
@@ -0,0 +1,160 @@
+import datetime
+import json
+
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from history import ingest, models as history, rollups
+from history.tests.test_api import ApiTestCase
+
+
+def counts(**filters):
+    return sorted(
+        (rollup.resolution, rollup.period, rollup.path, rollup.status,
+         rollup.count)
+        for rollup in history.TrafficRollup.objects.filter(**filters)
+    )
+
+
+class TestRollups(ApiTestCase):
+
+    def setUp(self):
+        super(TestRollups, self).setUp()
+        self.session = history.ClientSession.objects.create(app=self.app,
+                                                            key='01234')
+
+    def respond(self, path, status):
+        request = history.ClientRequest.objects.create(
+            session=self.session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com{0}'.format(path),
+            content='GET {0} HTTP/1.1\r\n\r\n'.format(path),
+        )
+        return history.ServerResponse.objects.create(
+            request=request,
+            session=self.session,
+            content='HTTP/1.1 {0} Whatever\r\n\r\n'.format(status),
+        )
+
+    def test_saved(self):
+        ''' Test asserting that saved responses are counted by minute, path and
+        status
+        '''
+        response = self.respond('/checkout/', 500)
+        self.respond('/checkout/', 500)
+        self.respond('/checkout/', 200)
+        minute = rollups.truncate(response.created,
+                                  history.TrafficRollup.MINUTE)
+        self.assertEqual(counts(), [
+            ('minute', minute, '/checkout/', 200, 1),
+            ('minute', minute, '/checkout/', 500, 2),
+        ])
+
+    def test_ingested(self):
+        ''' Test asserting that responses stored by batch ingestion are counted
+        '''
+        item = {
+            'content': 'GET /checkout/ HTTP/1.1\r\n\r\n',
+            'full_url': 'http://example.com/checkout/',
+            'remote_addr': '127.0.0.1',
+            'session': {'app': self.app.code, 'key': '01234'},
+            'response': {'content': 'HTTP/1.1 502 Bad Gateway\r\n\r\n'},
+        }
+        ingest.ingest_batch([item, item])
+        self.assertEqual([rollup.count for rollup
+                          in history.TrafficRollup.objects.filter(status=502)],
+                         [2])
+
+    def test_weighted(self):
+        ''' Test asserting that sampled responses are counted by their weight,
+        and that invalid weights are rejected
+        '''
+        item = {
+            'content': 'GET /checkout/ HTTP/1.1\r\n\r\n',
+            'full_url': 'http://example.com/checkout/',
+            'remote_addr': '127.0.0.1',
+            'session': {'app': self.app.code, 'key': '01234'},
+            'response': {'content': 'HTTP/1.1 200 OK\r\n\r\n'},
+        }
+        # (Requests sampled at rates of 1 in 4, and of 1 in 2.5.)
+        results = ingest.ingest_batch([dict(item, weight=4),
+                                       dict(item, weight=2.5), item,
+                                       dict(item, weight=0),
+                                       dict(item, weight=float('inf')),
+                                       dict(item, weight=float('nan'))])
+        self.assertEqual([str(error) for (_request, error) in results[3:]],
+                         ['Weight must be a positive number'] * 3)
+        self.assertEqual([request.weight for (request, _error)
+                          in results[:3]], [4, 2.5, 1])
+        self.assertEqual([rollup.count for rollup
+                          in history.TrafficRollup.objects.filter(status=200)],
+                         [7.5])
+
+    def test_increment(self):
+        ''' Test asserting that rollups are incremented in bulk, with an UPDATE
+        per distinct count
+        '''
+        period = rollups.truncate(timezone.now(), history.TrafficRollup.MINUTE)
+        keys = [(history.TrafficRollup.MINUTE, period, self.app.pk,
+                 'example.com', '/page/{0}/'.format(index), 200)
+                for index in range(4)]
+        history.TrafficRollup.objects.increment(
+            dict((key, 1) for key in keys[:3]))
+        # One SELECT, an UPDATE per distinct count, and one INSERT:
+        with self.assertNumQueries(4):
+            history.TrafficRollup.objects.increment(
+                {keys[0]: 1, keys[1]: 1, keys[2]: 2, keys[3]: 1})
+        self.assertEqual([count for (_resolution, _period, _path, _status,
+                                     count) in counts()],
+                         [2, 2, 3, 1])
+
+    def test_compact(self):
+        ''' Test asserting that aged rollups are compacted into coarser
+        resolutions
+        '''
+        self.respond('/checkout/', 500)
+        self.respond('/checkout/', 500)
+        now = timezone.now()
+        # Age the rollups to yesterday:
+        yesterday = now - datetime.timedelta(days=1)
+        history.TrafficRollup.objects.update(
+            period=rollups.truncate(yesterday, history.TrafficRollup.MINUTE))
+        self.respond('/checkout/', 500)
+
+        with self.settings(HISTORY_ROLLUP_MINUTE_RETENTION=60 * 60):
+            rollups.compact_all(now)
+        hour = rollups.truncate(yesterday, history.TrafficRollup.HOUR)
+        minute = rollups.truncate(now, history.TrafficRollup.MINUTE)
+        self.assertEqual(counts(), [
+            ('hour', hour, '/checkout/', 500, 2),
+            ('minute', minute, '/checkout/', 500, 1),
+        ])
+
+        with self.settings(HISTORY_ROLLUP_MINUTE_RETENTION=0,
+                           HISTORY_ROLLUP_HOUR_RETENTION=0):
+            rollups.compact_all(now + datetime.timedelta(days=1))
+        self.assertEqual([(rollup.resolution, rollup.count) for rollup
+                          in history.TrafficRollup.objects.all()],
+                         [('day', 3)] if hour.date() == minute.date() else
+                         [('day', 2), ('day', 1)])
+
+    def test_api(self):
+        ''' Test asserting that TrafficRollup objects may be listed and
+        filtered via the API
+        '''
+        self.respond('/checkout/', 500)
+        self.respond('/cart/', 500)
+        self.respond('/checkout/', 200)
+        response = self.api_client.get(
+            reverse('api_dispatch_list',
+                    kwargs={'resource_name': 'trafficrollup'}),
+            format='json',
+            data={'app__code': self.app.code, 'resolution': 'minute',
+                  'path': '/checkout/', 'status__gte': 500},
+            authentication=self.apikey_credentials,
+        )
+        self.assertValidJSONResponse(response)
+        objects = json.loads(response.content)['objects']
+        self.assertEqual([(obj['path'], obj['status'], obj['count'])
+                          for obj in objects],
+                         [('/checkout/', 500, 1)])
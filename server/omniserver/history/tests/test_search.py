@@ -0,0 +1,128 @@
+import json
+import textwrap
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.test.utils import override_settings
+
+from history import ingest, models as history, search
+from history.tests.test_api import ApiTestCase
+
+
+class TestSearch(ApiTestCase):
+
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        self.session = history.ClientSession.objects.create(app=self.app,
+                                                            key='01234')
+        self.base_url = reverse('api_dispatch_list',
+                                kwargs={'resource_name': 'clientrequest'})
+
+    def make_request(self, path, body=''):
+        request = history.ClientRequest(
+            session=self.session,
+            remote_addr='127.0.0.1',
+            full_url='http://example.com{0}'.format(path),
+            content=textwrap.dedent('''\
+                POST {0} HTTP/1.1
+                Content-Type: application/x-www-form-urlencoded
+
+                {1}''').format(path, body),
+        )
+        request.save()
+        return request
+
+    def search(self, query):
+        response = self.api_client.get(self.base_url, format='json',
+                                       data={'q': query},
+                                       authentication=self.apikey_credentials)
+        self.assertValidJSONResponse(response)
+        return json.loads(response.content)['objects']
+
+    def test_saved(self):
+        ''' Test asserting that saved requests are found by full-text search,
+        with a highlighted snippet, and that malformed queries find nothing
+        '''
+        self.make_request('/login/', 'username=alice')
+        self.make_request('/logout/')
+        objects = self.search('alice')
+        self.assertEqual([obj['path'] for obj in objects], ['/login/'])
+        self.assertIn('<mark>alice</mark>', objects[0]['search_snippet'])
+        self.assertEqual(self.search('"unbalanced'), [])
+
+    def test_response_saved(self):
+        ''' Test asserting that requests are found by the content of their
+        responses, and are no longer found once deleted
+        '''
+        request = self.make_request('/login/')
+        history.ServerResponse.objects.create(
+            request=request,
+            session=self.session,
+            content='HTTP/1.1 403 Forbidden\r\n'
+                    'Content-Type: text/plain\r\n\r\n'
+                    'Account locked',
+        )
+        self.assertEqual(len(self.search('locked')), 1)
+
+        request.delete()
+        self.assertEqual(self.search('login'), [])
+
+    def test_ingested(self):
+        ''' Test asserting that requests stored by batch ingestion are found by
+        full-text search
+        '''
+        results = ingest.ingest_batch([{
+            'content': 'GET /reports/ HTTP/1.1\r\n\r\n',
+            'full_url': 'http://example.com/reports/',
+            'remote_addr': '127.0.0.1',
+            'session': {'app': self.app.code, 'key': '01234'},
+            'response': {'content': 'HTTP/1.1 500 Internal Server Error\r\n'
+                                    'Content-Type: text/html\r\n\r\n'
+                                    '<p>Traceback</p>'},
+        }])
+        (request, _error) = results[0]
+        objects = self.search('traceback reports')
+        self.assertEqual([obj['id'] for obj in objects], [request.pk])
+
+    def test_fallback_backend(self):
+        ''' Test asserting that the fallback backend matches URLs
+        case-insensitively
+        '''
+        self.make_request('/login/', 'username=alice')
+        backend = search.SearchBackend('default')
+        requests = history.ClientRequest.objects.all()
+        self.assertEqual(backend.search(requests, 'LOGIN').count(), 1)
+        self.assertEqual(backend.search(requests, 'alice').count(), 0)
+
+    def test_default_backend(self):
+        ''' Test asserting that the default backend is chosen by database,
+        and that databases without one require configuration
+        '''
+        connection = connections['default']
+        vendor = connection.vendor
+        try:
+            connection.vendor = 'postgresql'
+            self.assertIsInstance(search.get_backend(),
+                                  search.PostgresSearchBackend)
+            connection.vendor = 'mysql'
+            self.assertRaises(ImproperlyConfigured, search.get_backend)
+            with override_settings(
+                    HISTORY_SEARCH_BACKEND='history.search.SearchBackend'):
+                self.assertIs(type(search.get_backend()),
+                              search.SearchBackend)
+        finally:
+            connection.vendor = vendor
+
+    def test_postgres_backend(self):
+        ''' Test asserting that the PostgreSQL backend matches queries
+        against its (indexed) tsvectors, by rank
+        '''
+        backend = search.PostgresSearchBackend('default')
+        requests = backend.search(history.ClientRequest.objects.all(),
+                                  'alice login')
+        (sql, params) = requests.query.sql_with_params()
+        self.assertIn('history_search.document @@ plainto_tsquery(', sql)
+        self.assertIn('ORDER BY "search_rank" DESC', sql)
+        self.assertEqual(list(params).count('alice login'), 3)
+        self.assertEqual(list(backend.search(requests, ' ')), [])
@@ -0,0 +1,124 @@
+import gzip
+import zlib
+from StringIO import StringIO
+from unittest import TestCase
+
+from history import util
+
+
+def gzipped(data):
+    buf = StringIO()
+    zipped = gzip.GzipFile(fileobj=buf, mode='wb')
+    zipped.write(data)
+    zipped.close()
+    return buf.getvalue()
+
+
+def chunked(data, size=7):
+    chunks = [data[index:index + size] for index in range(0, len(data), size)]
+    return ''.join('{0:x}\r\n{1}\r\n'.format(len(chunk), chunk)
+                   for chunk in chunks) + '0\r\n\r\n'
+
+
+class TestParseMessage(TestCase):
+
+    def test_body_is_view(self):
+        ''' Test asserting that a parsed message's body is a view of its
+        content, rather than a copy
+        '''
+        content = 'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello'
+        message = util.parse_message(content)
+        self.assertEqual(message.start_line, 'HTTP/1.1 200 OK')
+        self.assertEqual(message.headers, (('Content-Length', '5'),))
+        self.assertEqual(message.body_offset, len(content) - 5)
+        self.assertIsInstance(message.body, memoryview)
+        self.assertEqual(message.body.tobytes(), 'hello')
+
+    def test_empty(self):
+        ''' Test asserting that empty content fails to parse
+        '''
+        self.assertRaises(util.ParseError, util.parse_message, '')
+
+
+class TestParseResponse(TestCase):
+
+    def test_content_length(self):
+        ''' Test asserting that a response's body is limited to its
+        Content-Length
+        '''
+        parsed = util.parse_response(
+            'HTTP/1.0 200 OK\nContent-Length: 5\n\nhello, and more')
+        self.assertEqual(parsed.version, 'HTTP/1.0')
+        self.assertEqual(parsed.body, 'hello')
+
+    def test_chunked_gzip(self):
+        ''' Test asserting that a chunked, gzipped response body is decoded
+        '''
+        body = '{"key": "value"}' * 100
+        parsed = util.parse_response(
+            'HTTP/1.1 200 OK\r\n'
+            'Transfer-Encoding: chunked\r\n'
+            'Content-Encoding: gzip\r\n'
+            '\r\n' + chunked(gzipped(body)))
+        self.assertEqual(parsed.body, body)
+
+    def test_deflate(self):
+        ''' Test asserting that a deflated response body is decoded, whether or
+        not it is zlib-wrapped
+        '''
+        for compress in (zlib.compressobj(), zlib.compressobj(6, zlib.DEFLATED,
+                                                              -zlib.MAX_WBITS)):
+            payload = compress.compress('hello') + compress.flush()
+            parsed = util.parse_response(
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Encoding: deflate\r\n'
+                'Content-Length: {0}\r\n'
+                '\r\n{1}'.format(len(payload), payload))
+            self.assertEqual(parsed.body, 'hello')
+
+    def test_undecodable(self):
+        ''' Test asserting that a response body which cannot be decoded is left
+        as it was received
+        '''
+        for (encoding, payload) in (('gzip', gzipped('hello')[:-8]),
+                                    ('deflate', 'hello'), ('br', 'hello')):
+            parsed = util.parse_response(
+                'HTTP/1.1 200 OK\r\n'
+                'Content-Encoding: {0}\r\n'
+                '\r\n{1}'.format(encoding, payload))
+            self.assertEqual(parsed.body, payload)
+
+    def test_bodyless(self):
+        ''' Test asserting that responses which may not have a body are parsed
+        without one
+        '''
+        parsed = util.parse_response('HTTP/1.1 304 Not Modified\r\n\r\njunk')
+        self.assertEqual(parsed.status, 304)
+        self.assertEqual(parsed.body, '')
+
+    def test_malformed(self):
+        ''' Test asserting that malformed responses, and malformed chunked
+        encoding, fail to parse
+        '''
+        self.assertRaises(util.ParseError, util.parse_response, 'hello\n\n')
+        self.assertRaises(util.ParseError, util.parse_response,
+            'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n')
+
+
+class TestEncodePairs(TestCase):
+
+    def test_round_trip(self):
+        ''' Test asserting that encoded pairs are decoded unchanged
+        '''
+        pairs = [(u'a', u'1'), (u'b:c', u''), (u'', u'\u2603 12:x')]
+        encoded = util.encode_pairs(pairs)
+        self.assertEqual(encoded[:6], u'1:a1:1')
+        self.assertEqual(util.decode_pairs(encoded), pairs)
+        self.assertEqual(util.decode_pairs(u''), [])
+
+    def test_invalid(self):
+        ''' Test asserting that malformed encodings fail to decode
+        '''
+        for data in (u'1:a', u'1:a9:1', u'a', u'x:a1:1', u':a1:1',
+                     u'-1:1:a'):
+            self.assertRaises(util.ParseError, util.decode_pairs, data)
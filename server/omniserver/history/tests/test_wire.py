@@ -0,0 +1,46 @@
+import zlib
+
+from django.test import TestCase
+
+from history import wire
+
+
+class TestWire(TestCase):
+
+    items = [
+        {
+            'content': u'POST / HTTP/1.1\r\nHost: example.com\r\n\r\n\u2603',
+            'full_url': 'http://example.com/',
+            'remote_addr': '127.0.0.1',
+            'session': {'app': 'myapp', 'key': '01234'},
+            'response': {'content': 'HTTP/1.1 200 OK\r\n\r\n\xff\x00',
+                         'created': '2013-04-01T12:00:00Z'},
+        },
+        {
+            'content': 'GET / HTTP/1.1\r\n\r\n',
+            'full_url': 'http://example.com/',
+            'remote_addr': '127.0.0.1',
+            'session': {'app': 'myapp', 'key': '01234'},
+        },
+    ]
+
+    def test_round_trip(self):
+        ''' Test asserting that items are decoded from frames unchanged
+        '''
+        self.assertEqual(wire.decode(wire.encode(self.items)), self.items)
+        self.assertEqual(wire.decode(wire.encode([])), [])
+
+    def test_invalid(self):
+        ''' Test asserting that malformed and truncated batches are rejected
+        '''
+        data = zlib.decompress(wire.encode(self.items))
+        for invalid in ('bogus', zlib.compress(data[:-1]),
+                        zlib.compress(data[:5]),
+                        zlib.compress(wire.HEADER.pack(2, 0, 0) + '[]')):
+            self.assertRaises(wire.WireError, wire.decode, invalid)
+
+    def test_max_size(self):
+        ''' Test asserting that batches exceeding the maximum size are rejected
+        '''
+        data = wire.encode(self.items)
+        self.assertRaises(wire.WireError, wire.decode, data, max_size=32)
@@ -0,0 +1,129 @@
+"""The timeline of a ClientSession: its requests, in order, each with its
+parameters and response.
+
+Timelines are rendered as a stream of JSON, fetched in chunks of
+``TIMELINE_CHUNK_SIZE`` requests, such that each chunk costs a fixed number
+of queries, (regardless of the number of its parameters and responses), and
+no more than a chunk is held in memory.
+
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+from history import models as history
+from history.conf import settings
+
+
+encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def iter_chunks(session, chunk_size, content=False):
+    """Generate lists of the given session's requests, in order of creation,
+    with their parameters prefetched, and their ``timeline_response``
+    attached, (or None).
+
+    Given ``content``, the content blobs of the requests and responses are
+    fetched as well.
+
+    """
+    requests = history.ClientRequest.objects.filter(session=session).order_by(
+        'created', 'pk').select_related(
+        'host_dimension', 'path_dimension', 'user_agent_dimension',
+    ).prefetch_related('query_params', 'form_params')
+    after = Q()
+    while True:
+        chunk = list(requests.filter(after)[:chunk_size])
+        if not chunk:
+            return
+
+        responses = dict(
+            (response.request_id, response)
+            for response in history.ServerResponse.objects.filter(
+                request__in=[request.pk for request in chunk])
+        )
+        for request in chunk:
+            request.timeline_response = responses.get(request.pk)
+
+        if content:
+            objs = chunk + responses.values()
+            blobs = history.Blob.objects.in_bulk(
+                set(obj.content_blob_id for obj in objs))
+            for obj in objs:
+                obj.content_blob = blobs[obj.content_blob_id]
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        after = (Q(created__gt=last.created) |
+                 Q(created=last.created, pk__gt=last.pk))
+
+
+def response_data(response, resource_uri, content=False):
+    data = {
+        'resource_uri': resource_uri,
+        'created': response.created,
+        'status': response.status,
+        'reason': response.reason,
+        'location': response.location,
+    }
+    if content:
+        data['content'] = response.content
+    return data
+
+
+def request_data(request, resource_uris, content=False):
+    response = request.timeline_response
+    data = {
+        'resource_uri': resource_uris['request'](request),
+        'created': request.created,
+        'remote_addr': request.remote_addr,
+        'method': request.method,
+        'full_url': request.full_url,
+        'protocol': request.protocol,
+        'host': request.host,
+        'path': request.path,
+        'user_agent': request.user_agent,
+        'query_params': [(param.key, param.value)
+                         for param in request.query_params.all()],
+        'form_params': [(param.key, param.value)
+                        for param in request.form_params.all()],
+        'response': response and response_data(
+            response, resource_uris['response'](response), content),
+    }
+    if content:
+        data['content'] = request.content
+    return data
+
+
+def render(session, resource_uris, content=False, linked=False):
+    """Generate the JSON of the given session's timeline, in pieces.
+
+    ``resource_uris`` maps 'session', 'request' and 'response' to
+    functions returning the resource URIs of such objects. Given
+    ``content``, the raw content of requests and responses is included;
+    given ``linked``, so are the URIs of the session's ``linked_sessions``.
+
+    """
+    yield '{{"session":{0}'.format(encoder.encode({
+        'resource_uri': resource_uris['session'](session),
+        'created': session.created,
+        'key': session.key,
+        'app': session.app.code,
+    }))
+    if linked:
+        yield ',"linked_sessions":{0}'.format(encoder.encode([
+            resource_uris['session'](linked_session)
+            for linked_session in session.linked_sessions.all()
+        ]))
+
+    yield ',"requests":['
+    separator = ''
+    for chunk in iter_chunks(session, settings.TIMELINE_CHUNK_SIZE, content):
+        yield separator + ','.join(
+            encoder.encode(request_data(request, resource_uris, content))
+            for request in chunk
+        )
+        separator = ','
+    yield ']}'
@@ -1,30 +1,316 @@
-from BaseHTTPServer import BaseHTTPRequestHandler
-from StringIO import StringIO
+import collections
+import urlparse
+import zlib
 
+from django.utils.encoding import force_unicode
 
-class DumbHTTPRequestHandler(BaseHTTPRequestHandler):
-    """A crippled BaseHTTPRequestHandler -- we only want it for its request-
-    parsing logic.
+
+class ParseError(ValueError):
+    pass
+
+
+class HeadersMixin(object):
+
+    __slots__ = ()
+
+    def header(self, name, default=None):
+        """Return the value of the first header of the given (case-
+        insensitive) name, or ``default``.
+
+        """
+        name = name.lower()
+        for (key, value) in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+
+class ParsedRequest(HeadersMixin, collections.namedtuple('ParsedRequest', (
+    'method',       # the method of the request
+    'target',       # the resource path, as given in the request line
+    'version',      # the HTTP version of the request
+    'headers',      # a tuple of the request's (name, value) header pairs
+    'body_offset',  # the byte offset of the body in the (UTF-8) content
+    'body',         # the request body, (a byte string)
+    'protocol',     # the scheme of the full URL
+    'host',         # the hostname of the full URL
+    'path',         # the path of the full URL
+    'query',        # a tuple of the (key, value) pairs of the query string
+    'form',         # a tuple of the (key, value) pairs of the request body
+))):
+    """The immutable record of a parsed request."""
+
+    __slots__ = ()
+
+
+class ParsedResponse(HeadersMixin, collections.namedtuple('ParsedResponse', (
+    'version',      # the HTTP version of the response
+    'status',       # the response status code
+    'reason',       # the response status reason
+    'headers',      # a tuple of the response's (name, value) header pairs
+    'body_offset',  # the byte offset of the body in the (UTF-8) content
+    'body',         # the (decoded) response body, (a byte string)
+    'location',     # the value of the Location header, if any
+))):
+    """The immutable record of a parsed response."""
+
+    __slots__ = ()
+
+
+# Low-level message parsing #
+
+Message = collections.namedtuple('Message', (
+    'start_line',   # the request or status line
+    'headers',      # a tuple of the message's (name, value) header pairs
+    'body_offset',  # the offset of the body in the message buffer
+    'body',         # a memoryview of the (still transfer-encoded) body
+))
+
+
+def _as_buffer(content):
+    if isinstance(content, unicode):
+        # A copy is unavoidable here; but bytes are parsed in place:
+        content = content.encode('utf-8')
+    return content
+
+
+def _find_head_end(data):
+    """Return the offsets of the end of the message head and of the start
+    of its body (which differ by the length of the blank line).
+
+    """
+    best = None
+    for terminator in ('\r\n\r\n', '\n\n', '\n\r\n'):
+        # Search no further than the best terminator so far, so as not to
+        # scan the body:
+        end = len(data) if best is None else best[0]
+        index = data.find(terminator, 0, end)
+        if index != -1:
+            best = (index, index + len(terminator))
+    if best is None:
+        # Head without body (and perhaps without final newline):
+        return (len(data), len(data))
+    return best
+
+
+def _header_pairs(lines):
+    pairs = []
+    for line in lines:
+        if line[:1] in (' ', '\t') and pairs:
+            # Continuation of the previous header:
+            (name, value) = pairs[-1]
+            pairs[-1] = (name, value + ' ' + line.strip())
+        elif ':' in line:
+            (name, value) = line.split(':', 1)
+            pairs.append((name.strip(), value.strip()))
+    return tuple(pairs)
+
+
+def parse_message(content):
+    """Split the given raw HTTP message into its start line, headers and
+    body.
+
+    Only the message head is copied; the body is returned as a memoryview
+    onto the content, (or, if unicode, onto its UTF-8 encoding, the offsets
+    of which are those given).
+
+    """
+    data = _as_buffer(content)
+    (head_end, body_offset) = _find_head_end(data)
+    lines = data[:head_end].splitlines()
+    if not lines or not lines[0].strip():
+        raise ParseError("Empty message")
+    return Message(
+        start_line=lines[0].strip(),
+        headers=_header_pairs(lines[1:]),
+        body_offset=body_offset,
+        body=memoryview(data)[body_offset:],
+    )
+
+
+def _header(headers, name, default=None):
+    name = name.lower()
+    for (key, value) in headers:
+        if key.lower() == name:
+            return value
+    return default
+
+
+def _dechunk(body):
+    """Decode the given chunked transfer-encoded body (a memoryview)."""
+    decoded = bytearray()
+    offset = 0
+    while True:
+        # Only the (short) chunk-size lines are copied, for parsing:
+        window = body[offset:offset + 1024].tobytes()
+        line_end = window.find('\n')
+        if line_end == -1:
+            raise ParseError("Malformed chunked body")
+        size_line = window[:line_end].split(';', 1)[0].strip()
+        try:
+            size = int(size_line, 16)
+        except ValueError:
+            raise ParseError("Malformed chunk size: {0!r}".format(size_line))
+        offset += line_end + 1
+        if size == 0:
+            return decoded
+        if offset + size > len(body):
+            raise ParseError("Truncated chunked body")
+        decoded.extend(body[offset:offset + size])
+        offset += size
+        # Skip the CRLF (or bare LF) ending the chunk data:
+        ending = body[offset:offset + 2].tobytes()
+        if ending.startswith('\r\n'):
+            offset += 2
+        elif ending.startswith('\n'):
+            offset += 1
+
+
+def _decompress(body, encoding):
+    """Return the given body decompressed, or None if its encoding is
+    unsupported, (raising zlib.error if it is undecodable).
 
     """
-    def __init__(self, request):
-        BaseHTTPRequestHandler.__init__(self, request, None, None)
+    if encoding == 'gzip' or encoding == 'x-gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # Some servers send raw deflate data, without the zlib wrapper:
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return None
 
-    def setup(self):
-        self.rfile = StringIO(self.request)
 
-    def handle(self):
-        self.raw_requestline = self.rfile.readline()
-        if not self.raw_requestline:
-            return
-        if not self.parse_request(): # An error code has been sent, just exit
-            return
+def decode_body(message, bodyless=False):
+    """Return the payload of the given Message, undoing its transfer and
+    content encodings.
 
-    def finish(self):
-        pass
+    The result is a memoryview onto the original buffer, unless decoding
+    required that it be rebuilt. A body of an unsupported content encoding,
+    or which fails to decompress, (e.g. being truncated, or mislabeled), is
+    returned as is; ParseError is raised for errors of framing only.
 
+    """
+    if bodyless:
+        return memoryview('')
+
+    body = message.body
+    transfer_encoding = _header(message.headers, 'Transfer-Encoding', '')
+    if transfer_encoding.lower().strip().endswith('chunked'):
+        body = memoryview(_dechunk(body))
+    else:
+        length = _header(message.headers, 'Content-Length')
+        if length is not None:
+            try:
+                body = body[:int(length)]
+            except ValueError:
+                raise ParseError("Invalid Content-Length: {0!r}".format(length))
+
+    content_encoding = _header(message.headers, 'Content-Encoding', '')
+    content_encoding = content_encoding.lower().strip()
+    if content_encoding and content_encoding != 'identity' and len(body):
+        try:
+            decompressed = _decompress(body.tobytes(), content_encoding)
+        except zlib.error:
+            decompressed = None
+        if decompressed is not None:
+            body = memoryview(decompressed)
+
+    return body
 
-class FakeSocket(StringIO):
 
-    def makefile(self, *_args, **_kws):
-        return self
+# Parsed records #
+
+def parse_request(content, full_url):
+    """Parse the given raw request content and full URL into a
+    ParsedRequest.
+
+    """
+    message = parse_message(content)
+    words = message.start_line.split()
+    if len(words) == 3:
+        (method, target, version) = words
+    elif len(words) == 2:
+        (method, target) = words
+        version = 'HTTP/0.9'
+    else:
+        raise ParseError("Bad request line: {0!r}".format(message.start_line))
+
+    body = decode_body(message).tobytes()
+    parsed_url = urlparse.urlparse(full_url)
+    return ParsedRequest(
+        method=method,
+        target=target,
+        version=version,
+        headers=message.headers,
+        body_offset=message.body_offset,
+        body=body,
+        protocol=parsed_url.scheme,
+        host=parsed_url.hostname,
+        path=parsed_url.path,
+        query=tuple(urlparse.parse_qsl(parsed_url.query)),
+        form=tuple(urlparse.parse_qsl(body.strip())),
+    )
+
+
+def parse_response(content):
+    """Parse the given raw response content into a ParsedResponse."""
+    message = parse_message(content)
+    words = message.start_line.split(None, 2)
+    if len(words) < 2 or not words[0].startswith('HTTP/'):
+        raise ParseError("Bad status line: {0!r}".format(message.start_line))
+    try:
+        status = int(words[1])
+    except ValueError:
+        raise ParseError("Bad status code: {0!r}".format(words[1]))
+
+    bodyless = status < 200 or status in (204, 304)
+    return ParsedResponse(
+        version=words[0],
+        status=status,
+        reason=words[2] if len(words) > 2 else '',
+        headers=message.headers,
+        body_offset=message.body_offset,
+        body=decode_body(message, bodyless).tobytes(),
+        location=_header(message.headers, 'Location'),
+    )
+
+
+# Compact parameter encoding #
+
+def encode_pairs(pairs):
+    """Encode the given (key, value) pairs as a single string, each key and
+    value prefixed by its length, (e.g. ``u'1:a1:12:bb0:'`` for a=1&bb=).
+
+    """
+    return u''.join(
+        u'{0}:{1}'.format(len(part), part)
+        for pair in pairs
+        for part in (force_unicode(pair[0]), force_unicode(pair[1]))
+    )
+
+
+def decode_pairs(data):
+    """Decode the (key, value) pairs of the given string, (see
+    ``encode_pairs``).
+
+    """
+    parts = []
+    position = 0
+    while position < len(data):
+        colon = data.find(u':', position)
+        if colon == -1:
+            raise ParseError("Invalid encoded pairs")
+        try:
+            length = int(data[position:colon])
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ParseError("Invalid encoded pair length: {0!r}"
+                             .format(data[position:colon]))
+        position = colon + 1 + length
+        parts.append(data[colon + 1:position])
+    if len(parts) % 2 or position != len(data):
+        raise ParseError("Invalid encoded pairs")
+    return zip(parts[::2], parts[1::2])
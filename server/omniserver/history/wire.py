@@ -0,0 +1,109 @@
+"""The compact "frames" wire format of batches of ingest items, (see
+``ingest.build_item``), accepted next to JSON as CONTENT_TYPE by the batch
+endpoint.
+
+A batch is a zlib-compressed sequence of frames, one per item:
+
+    <4-byte big-endian metadata length><4-byte request content length>
+    <4-byte response content length><metadata><request content>
+    <response content>
+
+where the metadata is the JSON-encoded item less the ``content`` of its
+request and response, which follow, raw. (The response content is empty
+where the item has no ``response``.) Raw messages so escape neither JSON
+encoding nor decoding, and need not be text.
+
+"""
+import json
+import struct
+import zlib
+
+from history.conf import settings
+
+
+CONTENT_TYPE = 'application/x-omnispective-frames'
+HEADER = struct.Struct('>III')
+
+
+class WireError(ValueError):
+    pass
+
+
+def _bytes(content):
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return content or ''
+
+
+def _text(content):
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        # Content need not be text:
+        return content
+
+
+def encode(items, level=6):
+    """Encode the given ingest items as a batch of frames."""
+    frames = []
+    for item in items:
+        item = dict(item)
+        content = _bytes(item.pop('content', None))
+        if item.get('response') is None:
+            response_content = ''
+        else:
+            item['response'] = dict(item['response'])
+            response_content = _bytes(item['response'].pop('content', None))
+        metadata = json.dumps(item, separators=(',', ':'))
+        frames.extend((
+            HEADER.pack(len(metadata), len(content), len(response_content)),
+            metadata, content, response_content,
+        ))
+    return zlib.compress(''.join(frames), level)
+
+
+def decode(data, max_size=None):
+    """Decode the given batch of frames as a list of ingest items, raising
+    WireError if it is invalid, or decompresses to more than ``max_size``
+    bytes, (by default, WIRE_MAX_SIZE).
+
+    """
+    if max_size is None:
+        max_size = settings.WIRE_MAX_SIZE
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(data, max_size)
+    except zlib.error as exc:
+        raise WireError("Invalid compressed data: {0}".format(exc))
+    if decompressor.unconsumed_tail:
+        raise WireError("Batch exceeds {0} bytes".format(max_size))
+
+    items = []
+    offset = 0
+    while offset < len(data):
+        if offset + HEADER.size > len(data):
+            raise WireError("Truncated frame header")
+        (metadata_length, length, response_length) = HEADER.unpack_from(
+            data, offset)
+        offset += HEADER.size
+        end = offset + metadata_length + length + response_length
+        if end > len(data):
+            raise WireError("Truncated frame")
+
+        try:
+            item = json.loads(data[offset:offset + metadata_length])
+        except ValueError as exc:
+            raise WireError("Invalid frame metadata: {0}".format(exc))
+        if not isinstance(item, dict):
+            raise WireError("Frame metadata must be an object")
+        offset += metadata_length
+        item['content'] = _text(data[offset:offset + length])
+        offset += length
+        if isinstance(item.get('response'), dict):
+            item['response']['content'] = _text(data[offset:end])
+        elif response_length:
+            raise WireError("Response content given without response")
+        items.append(item)
+        offset = end
+    return items
+
@@ -5,6 +5,8 @@ from history import api
 
 urlpatterns = patterns('',
     (r'^api/', include(api.ClientRequestResource().urls)),
+    (r'^api/', include(api.ServerResponseResource().urls)),
     (r'^api/', include(api.ClientSessionResource().urls)),
     (r'^api/', include(api.AppResource().urls)),
+    (r'^api/', include(api.TrafficRollupResource().urls)),
 )